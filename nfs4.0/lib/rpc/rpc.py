@@ -9,7 +9,6 @@
 
 from __future__ import absolute_import
 import struct
-import xdrlib
 import socket
 import select
 import threading
@@ -635,7 +634,7 @@ class RPCServer(Server):
         self.rpcunpacker.reset(recv_data)
         try:
             recv_msg = self.rpcunpacker.unpack_rpc_msg()
-        except xdrlib.Error as e:
+        except rpc_pack.XDRError as e:
             print("XDRError", e)
             return
         if recv_msg.body.mtype != CALL:
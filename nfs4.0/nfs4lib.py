@@ -41,8 +41,9 @@ import xdrdef.nfs4_const as nfs4_const
 from  xdrdef.nfs4_const import *
 import xdrdef.nfs4_type as nfs4_type
 from xdrdef.nfs4_type import *
-from xdrlib import Error as XDRError
+from xdrdef.nfs4_pack import XDRError
 import xdrdef.nfs4_pack as nfs4_pack
+from xdrdef.fattrcodec import FattrCodec, list2bitmap, bitmap2list
 
 import nfs_ops
 op4 = nfs_ops.NFS4ops()
@@ -91,7 +92,7 @@ class InvalidCompoundRes(NFSException):
             return "Invalid COMPOUND result"
 
 class FancyNFS4Packer(nfs4_pack.NFS4Packer):
-    """Handle fattr4 and dirlist4 more cleanly than auto-generated methods"""
+    """Handle fattr4 more cleanly than auto-generated methods"""
     def filter_bitmap4(self, data):
         out = []
         while data:
@@ -105,8 +106,6 @@ class FancyNFS4Packer(nfs4_pack.NFS4Packer):
             data = dict2fattr(data)
         return data
 
-    # def pack_dirlist4(self):
-
 class FancyNFS4Unpacker(nfs4_pack.NFS4Unpacker):
     def filter_bitmap4(self, data):
         """Put bitmap into single long, instead of array of 32bit chunks"""
@@ -122,19 +121,6 @@ class FancyNFS4Unpacker(nfs4_pack.NFS4Unpacker):
         return fattr2dict(data)
 
 
-    def filter_dirlist4(self, data):
-        """Return as simple list, instead of strange chain structure"""
-        e = data.entries
-        if not e:
-            return data
-        array = [e[0]]
-        while e[0].nextentry:
-            e = e[0].nextentry
-            array.append(e[0])
-        data.entries = array
-        return data
-
-
 # STUB
 class CBServer(rpc.RPCServer):
     def __init__(self, client):
@@ -552,15 +538,11 @@ class NFS4Client(rpc.RPCClient):
                     raise UnexpectedCompoundRes("READDIR had no entries")
                 else:
                     break
-            entry = reply.entries[0]
             # Loop over all entries in result.
-            while 1:
+            for entry in reply.entries:
                 entry.attrdict = entry.attrs
                 entry.count = count
                 entries.append(entry)
-                if not entry.nextentry:
-                    break
-                entry = entry.nextentry[0]
             if reply.eof:
                 break
             cookie = entry.cookie
@@ -971,61 +953,22 @@ def get_attrunpacker(unpacker):
 
     return attrunpackers
 
-_cache_packer = FancyNFS4Packer()
-_cache_attrpackers = get_attrpackers(_cache_packer)
+fattr_codec = FattrCodec(FancyNFS4Packer, FancyNFS4Unpacker, fattr4,
+                          get_bitnumattr_dict())
 
 def dict2fattr(dict):
     """Convert a dictionary of form {numb:value} to a fattr4 object.
 
     Returns a fattr4 object.
     """
-
-    attrs = sorted(dict.keys())
-
-    attr_vals = b""
-    packer = _cache_packer
-    attrpackers = _cache_attrpackers
-
-    for attr in attrs:
-        value = dict[attr]
-        packerfun = attrpackers[attr];
-        packer.reset()
-        packerfun(value)
-        attr_vals += packer.get_buffer()
-    attrmask = list2bitmap(attrs)
-    return fattr4(attrmask, attr_vals);
+    return fattr_codec.encode(dict)
 
 def fattr2dict(obj):
     """Convert a fattr4 object to a dictionary with attribute name and values.
 
     Returns a dictionary of form {bitnum:value}
     """
-
-    result = {}
-    unpacker = FancyNFS4Unpacker(obj.attr_vals)
-    list = bitmap2list(obj.attrmask)
-    for bitnum in list:
-        result[bitnum] = get_attrunpacker(unpacker)[bitnum]()
-    unpacker.done()
-    return result
-
-def list2bitmap(list):
-    """Construct a bitmap from a list of bit numbers"""
-    mask = 0
-    for bit in list:
-        mask |= 1 << bit
-    return mask
-
-def bitmap2list(bitmap):
-    """Return (sorted) list of bit numbers set in bitmap"""
-    out = []
-    bitnum = 0
-    while bitmap:
-        if bitmap & 1:
-            out.append(bitnum)
-        bitnum += 1
-        bitmap >>= 1
-    return out
+    return fattr_codec.decode(obj)
 
 def parse_nfs_url(url):
     """Parse [nfs://]host:port/path, format taken from rfc 2224
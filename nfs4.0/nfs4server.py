@@ -34,7 +34,7 @@ import time, StringIO, random, traceback, codecs
 import StringIO
 import nfs4state
 from nfs4state import NFS4Error, printverf
-from xdrlib import Error as XDRError
+from xdrdef.nfs4_pack import XDRError
 
 unacceptable_names = [ "", ".", ".." ]
 unacceptable_characters = [ "/", "~", "#", ]
@@ -149,13 +149,16 @@ class NFS4Server(rpc.RPCServer):
     def check_replay(self, op, replay):
         """Pull appropriate info for a replay attempt"""
         fh, args, oldop = replay
+        if op == oldop:
+            return (fh, args)
+        # Values can differ yet encode the same, so compare encodings too
         p = nfs4lib.FancyNFS4Packer()
         p.pack_nfs_argop4(op)
         newstr = p.get_buffer()
         p.reset()
         p.pack_nfs_argop4(oldop)
         oldstr = p.get_buffer()
-        if oldstr == newstr: # Sadly, op == oldop won't work
+        if oldstr == newstr:
             return (fh, args)
         else:
             return (None, (NFS4ERR_BAD_SEQID,))
@@ -685,10 +688,8 @@ class NFS4Server(rpc.RPCServer):
                 entries.insert(0,entry)
             if (not entries) and dirlist:
                 return simple_error(NFS4ERR_TOOSMALL)
-            # Encode entries as linked list
-            e4 = []
-            for entry in entries:
-                e4 = [entry4(entry.cookie, entry.name, entry.attr, nextentry=e4)]
+            e4 = [entry4(entry.cookie, entry.name, entry.attr, [])
+                  for entry in reversed(entries)]
             if len(entries) < len(dirlist):
                 d4 = dirlist4(e4, eof=0)
             else:
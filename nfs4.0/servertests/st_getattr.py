@@ -556,13 +556,11 @@ def testOwnerName(t, env):
         # Find 'user' (note this assumes dir listing is small enough that
         # the whole listing was returned)
         reply = res.resarray[-1].switch.switch.reply
-        entry = reply.entries[0]
-        while 1:
+        for entry in reply.entries:
             if entry.name=="unix":
                 break
-            if not entry.nextentry:
-                self.fail("Could not find mountpoint /unix")
-            entry = entry.nextentry[0]
+        else:
+            self.fail("Could not find mountpoint /unix")
         print("From Readdir / - ", entry.attrs)
         
 
@@ -4,9 +4,8 @@ from __future__ import print_function
 from __future__ import absolute_import
 import sys
 from distutils.core import setup, Extension
-from distutils.dep_util import newer_group
 import os
-import glob
+import shutil
 try:
     import xdrgen
 except ImportError:
@@ -23,37 +22,20 @@ if  __name__ == "__main__":
     if os.path.isfile(os.path.join(topdir, 'lib', 'testmod.py')):
         sys.path.insert(1, os.path.join(topdir, 'lib'))
 
-def needs_updating(xdrfile):
-    name_base = xdrfile[:xdrfile.rfind(".")]
-    sources = [xdrfile]
-    targets = [ name_base + "_const.py",
-                name_base + "_type.py",
-                name_base + "_pack.py" ]
-    for t in targets:
-        if newer_group(sources, t):
-            return True
-    return False
-
-def use_xdr(dir, xdrfile):
-    """Move to dir, and generate files based on xdr file"""
-    os.chdir(dir)
-    if needs_updating(xdrfile):
-        xdrgen.run(xdrfile)
-        for file in glob.glob(os.path.join(dir, 'parse*')):
-            print("deleting", file)
-            os.remove(file)
-
 def generate_files():
-    home = os.getcwd()
-    use_xdr(os.path.join(topdir, 'xdrdef'), 'nfs4.x')
-    use_xdr(os.path.join(topdir, 'xdrdef'), 'nfs3.x')
-
-    dir = os.path.join(topdir, 'lib', 'rpc')
-    use_xdr(dir, 'rpc.x')
-
-    dir = os.path.join(topdir, 'lib', 'rpc', 'rpcsec')
-    use_xdr(dir, 'gss.x')
-    os.chdir(home)
+    # Files are only regenerated if they or xdrgen changed
+    xdr_files = [os.path.join(topdir, 'xdrdef', 'nfs4.x'),
+                 os.path.join(topdir, 'xdrdef', 'nfs3.x'),
+                 os.path.join(topdir, 'lib', 'rpc', 'rpc.x'),
+                 os.path.join(topdir, 'lib', 'rpc', 'rpcsec', 'gss.x'),
+                 ]
+    if xdrgen.run_many(xdr_files):
+        sys.exit("xdrgen failed")
+    # nfs4lib uses the fattr4 codec shared with nfs4.1, which like xdrrt
+    # lives beside xdrgen, so ship a copy next to the generated code
+    src = os.path.join(os.path.dirname(os.path.abspath(xdrgen.__file__)),
+                       'fattrcodec.py')
+    shutil.copyfile(src, os.path.join(topdir, 'xdrdef', 'fattrcodec.py'))
 
 # FRED - figure how to get this to run only with build/install type command
 generate_files()
@@ -20,8 +20,9 @@ op4 = nfs_ops.NFS4ops()
 op3 = nfs_ops.NFS3ops()
 
 class DataServer(object):
-    def __init__(self, server, port, path, flavor=rpc.AUTH_SYS, active=True, mdsds=True, multipath_servers=None, summary=None):
+    def __init__(self, server, port, path, flavor=rpc.AUTH_SYS, active=True, mdsds=True, multipath_servers=None, summary=None, nconnect=1):
         self.mdsds = mdsds
+        self.nconnect = nconnect # Connections to use, if supported
         self.server = server
         self.port = int(port)
         self.active = active
@@ -239,7 +240,8 @@ class DataServer3(DataServer):
         s1 = rpc.security.instance(rpc.AUTH_SYS)
         self.cred1 = s1.init_cred(uid=0, gid=0)
         self.c1 = nfs3client.NFS3Client(self.server, self.port,
-                                        summary=self.summary)
+                                        summary=self.summary,
+                                        nconnect=self.nconnect)
         self.c1.set_cred(self.cred1)
         self.rootfh = type3.nfs_fh3(self.c1.mntclnt.get_rootfh(self.path))
         self.c1.null()
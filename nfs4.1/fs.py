@@ -6,22 +6,189 @@ from nfs4lib import NFS4Error
 import struct
 import logging
 from locking import Lock, RWLock
-try:
-    import cStringIO.StringIO as StringIO
-except:
-    from io import StringIO
+from io import BytesIO
 import time
+import bisect
+import itertools
+import weakref
+from collections import OrderedDict
 from xdrdef.nfs4_pack import NFS4Packer
 
 log_o = logging.getLogger("fs.obj")
 log_fs = logging.getLogger("fs")
 logging.addLevelName(5, "FUNCT")
 
+# Attributes which can change without the object's change attribute
+# moving, so are only cached for AttrCache.ttl seconds.
+volatile_attrs = nfs4lib.list2bitmap([
+    FATTR4_LEASE_TIME, FATTR4_FS_STATUS,
+    FATTR4_FILES_AVAIL, FATTR4_FILES_FREE, FATTR4_FILES_TOTAL,
+    FATTR4_SPACE_AVAIL, FATTR4_SPACE_FREE, FATTR4_SPACE_TOTAL,
+    FATTR4_QUOTA_AVAIL_HARD, FATTR4_QUOTA_AVAIL_SOFT, FATTR4_QUOTA_USED])
+
+class AttrCache(object):
+    """Encoded fattr4 values for FSObjects, for GETATTR and READDIR.
+
+    Each object keeps its own entries, obj.fattr_cache = {attrmask:
+    (stamp, fattr4)}, where stamp is the object's change attribute, the
+    fs supported attributes, and for masks with volatile_attrs, which
+    ttl long period we are in.  An entry is only used if the stamp
+    still matches.  change_data/change_meta/change_access drop all of
+    an object's entries.  Across all objects, the least recently used
+    entries are dropped once they hold more than max_bytes; a
+    max_bytes of 0 turns the cache off.
+    """
+    overhead = 200 # Rough bytes used by an entry, beyond its attr_vals
+
+    def __init__(self, max_bytes=0, ttl=0.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl # 0 means masks with volatile_attrs are not cached
+        self.lock = Lock("AttrCacheLock")
+        self.lru = OrderedDict() # {(obj, attrmask): size}
+        self.bytes = 0
+        self.hits = self.misses = self.uncached = 0
+        self.evictions = self.invalidations = 0
+
+    def get(self, obj, attrmask, encode):
+        """Return fattr4 of obj's attributes in attrmask.
+
+        encode() is called to make it if there is no usable entry.
+        The result is shared, so must not be modified.
+        """
+        if not self.max_bytes:
+            return encode()
+        if attrmask & volatile_attrs:
+            if not self.ttl:
+                self.uncached += 1
+                return encode()
+            period = int(time.time() / self.ttl)
+        else:
+            period = 0
+        # Read the stamp first, so a change during encode() is not hidden
+        stamp = (obj.change, obj.fs.fattr4_supported_attrs, period)
+        key = (obj, attrmask)
+        with self.lock:
+            cache = obj.fattr_cache
+            entry = cache.get(attrmask) if cache else None
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                self.lru.move_to_end(key)
+                return entry[1]
+            self.misses += 1
+        fattr = encode()
+        size = len(fattr.attr_vals) + self.overhead
+        with self.lock:
+            self.bytes += size - self.lru.pop(key, 0)
+            self.lru[key] = size
+            if obj.fattr_cache is None:
+                obj.fattr_cache = {}
+            obj.fattr_cache[attrmask] = (stamp, fattr)
+            while self.bytes > self.max_bytes and self.lru:
+                (old, mask), old_size = self.lru.popitem(last=False)
+                old.fattr_cache.pop(mask, None)
+                self.bytes -= old_size
+                self.evictions += 1
+        return fattr
+
+    def invalidate(self, obj):
+        """Drop all of obj's entries"""
+        if not obj.fattr_cache:
+            return
+        with self.lock:
+            for mask in obj.fattr_cache:
+                self.bytes -= self.lru.pop((obj, mask), 0)
+            obj.fattr_cache.clear()
+            self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            for obj, mask in self.lru:
+                obj.fattr_cache.pop(mask, None)
+            self.lru.clear()
+            self.bytes = 0
+
+    def snapshot(self):
+        """Return the statistics as a dictionary, suitable for json.dump"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits" : self.hits,
+                    "misses" : self.misses,
+                    "hit_rate" : self.hits / lookups if lookups else 0.0,
+                    "uncached" : self.uncached,
+                    "evictions" : self.evictions,
+                    "invalidations" : self.invalidations,
+                    "entries" : len(self.lru),
+                    "bytes" : self.bytes,
+                    "max_bytes" : self.max_bytes,
+                    }
+
+attr_cache = AttrCache() # Shared by all filesystems, off until configured
+
+# Cookie verifiers differ between directories, and between server runs
+_dir_verifiers = itertools.count((int(time.time()) & 0xffffffff) << 32)
+
+class DirIndex(object):
+    """The entries of a directory in READDIR order, each with a cookie.
+
+    Cookies are handed out in increasing order as names are added, and
+    never reused, so a READDIR can carry on after any cookie it was
+    given, whatever has been added or removed since, without the
+    server keeping snapshots.  Removed entries leave a hole in
+    self.cookies until there are enough holes to be worth compacting.
+    verifier identifies this index, and so the meaning of its cookies.
+    """
+    first_cookie = 3 # 0, 1 and 2 are reserved, see draft22 18.23.3
+
+    def __init__(self, names=()):
+        self.verifier = struct.pack(">Q", next(_dir_verifiers))
+        self.cookies = [] # Sorted, may include cookies of removed names
+        self.names = {} # {cookie: name}
+        self.cookie_of = {} # {name: cookie}
+        self.next_cookie = self.first_cookie
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        cookie = self.next_cookie
+        self.next_cookie += 1
+        self.cookies.append(cookie)
+        self.names[cookie] = name
+        self.cookie_of[name] = cookie
+
+    def remove(self, name):
+        del self.names[self.cookie_of.pop(name)]
+        if len(self.cookies) > 2 * len(self.names) + 32:
+            names = self.names
+            # Replace rather than modify, in case after() is using it
+            self.cookies = [c for c in self.cookies if c in names]
+
+    def after(self, cookie):
+        """Iterate over (cookie, name) for the entries after cookie"""
+        cookies = self.cookies
+        names = self.names
+        for i in range(bisect.bisect_right(cookies, cookie), len(cookies)):
+            c = cookies[i]
+            name = names.get(c)
+            if name is not None:
+                yield c, name
+
 class MetaData(object):
     """Contains everything that needs to be stored
 
     to preserve all of the object's metadata.
     """
+    __slots__ = ("change", "type", "refcnt", "createverf", "owner", "mode",
+                 "time_access", "time_modify", "time_create",
+                 "parent", "linkdata", "devdata")
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        # state may also be the __dict__ of a pickle from before __slots__
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __init__(self):
         self.change = 0
         self.type = 0
@@ -36,6 +203,29 @@ class MetaData(object):
             self.linkdata = None
             self.devdata = None
 
+_meta_names = frozenset(MetaData.__slots__)
+_make_lock = Lock("MakeLock") # Held while making a _made() attribute
+
+def _made(name, make):
+    """Property for an FSObject attribute that is only made when first used.
+
+    The value is kept in self._<name>, for which the class holds None,
+    so objects which never use it don't pay for it.
+    """
+    attr = "_" + name
+    def get(self):
+        value = getattr(self, attr)
+        if value is None:
+            with _make_lock:
+                value = getattr(self, attr)
+                if value is None:
+                    value = make(self)
+                    object.__setattr__(self, attr, value)
+        return value
+    def set(self, value):
+        object.__setattr__(self, attr, value)
+    return property(get, set)
+
 class FSObject(object):
     """This is the in-memory depiction of an (nfs4) file-system object.
 
@@ -43,6 +233,20 @@ class FSObject(object):
     This will keep read/writes current, but will not work with
     attrs and non NF4REG files.
     """
+    # Made when first used, most objects in a large fs need none of them
+    state = _made("state", lambda s: FileState(s))
+    lock = _made("lock", lambda s: RWLock(name=str(s.id)))
+    seek_lock = _made("seek_lock", lambda s: Lock("SeekLock"))
+    file = _made("file", lambda s: s.init_file()) # NF4REG
+    entries = _made("entries", lambda s: {}) # NF4DIR {name:id}
+    _state = _lock = _seek_lock = _file = _entries = None
+
+    _dirindex = None # NF4DIR, made from self.entries when needed
+    current_layout = None
+    covered_by = None # If this is a mountpoint for fs, equals fs.root
+    fattr_cache = None # {attrmask: (stamp, fattr4)}, see AttrCache
+    fattr4_rdattr_error = NFS4_OK # NOTE does this need sent to disk?
+    fattr4_named_attr = False # STUB - not supported, so not in meta
 
     # NOTE that any change to these attrs needs to be eventually
     #      written to disk
@@ -89,7 +293,7 @@ class FSObject(object):
             else:
                 # Pad with zeroes
                 self.file.seek(0, 2)
-                self.file.write(chr(0) * (value - size))
+                self.file.write(bytes(value - size))
             self.change_data()
         else:
             raise NFS4Error(NFS4ERR_INVAL)
@@ -157,38 +361,27 @@ class FSObject(object):
             else:
                 self.type = kind.type
                 if self.type == NF4LNK:
-                    self.linkdata = kind.linkdata
+                    self.linkdata = bytes(kind.linkdata)
                 elif self.type in (NF4BLK, NF4CHR):
                     self.devdata = kind.devdata
             self.change = 0 # XXX Not really needed
             self.createverf = "" # XXX Not really needed
             self._last_sync = -1
-            if 1: # NF4REG
-                self.file = self.init_file()
             if 1: # NF4DIR
                 # Can't store FSObj, since needs to be pickled
                 self.parent = getattr(parent, "id", None)
-                self.entries = {} # {name:id}
-        if 1: # NF4DIR
-            self.dircache = {}
-        self.state = FileState(self)
-        self._set_fattrs()
-        self.lock = RWLock(name=str(id))
-        self.seek_lock = Lock("SeekLock")
-        self.current_layout = None
-        self.covered_by = None # If this is a mountpoint for fs, equals fs.root
         # XXX Need to write to disk here?
         self._init_hook()
 
     def init_file(self):
         """Hook for subclasses that want to use their own file class"""
-        return StringIO()
+        return BytesIO()
 
     def _init_hook(self):
         pass
 
     def __setattr__(self, name, value):
-        if name != "meta" and hasattr(self.meta, name):
+        if name in _meta_names:
             setattr(self.meta, name, value)
         else:
             object.__setattr__(self, name, value)
@@ -197,9 +390,14 @@ class FSObject(object):
         # Note only get here if self.name does not exist
         return getattr(self.meta, name)
 
-    def _set_fattrs(self):
-        self.fattr4_rdattr_error = NFS4_OK # NOTE does this need sent to disk?
-        self.fattr4_named_attr = False # STUB - not supported, so not in meta
+    def evictable(self):
+        """Returns False if fs.find must keep the object in memory
+
+        Even if True, the object stays while anything, such as open
+        state, is holding it.
+        """
+        return (self.covered_by is None and self.current_layout is None and
+                self is not self.fs.root)
 
     def check_dir(self):
         if self.type not in (NF4DIR, NF4ATTRDIR):
@@ -218,14 +416,17 @@ class FSObject(object):
 
     def change_data(self):
         self.change += 1
+        attr_cache.invalidate(self)
         # STUB reset time_* attrs
 
     def change_meta(self):
         self.change += 1
+        attr_cache.invalidate(self)
         # STUB reset time_* attrs
 
     def change_access(self):
         self.change += 1
+        attr_cache.invalidate(self)
         # STUB reset time_* attrs
 
     def delegation_options(self):
@@ -257,7 +458,10 @@ class FSObject(object):
         return rv
 
     def write(self, data, offset, principal): # NF4REG only
-        """Return count of bytes written"""
+        """Return count of bytes written.
+
+        data may be any bytes-like object, such as a memoryview.
+        """
         if not self.access4_modify(principal):
             raise NFS4Error(NFS4ERR_ACCESS)
         if len(data) == 0:
@@ -475,11 +679,14 @@ class FSObject(object):
         if not self.access4_extend(principal):
             raise NFS4Error(NFS4ERR_ACCESS)
         self.entries[name] = obj.id
+        if self._dirindex is not None:
+            self._dirindex.add(name)
         self.change_data()
         if obj.isdir:
             obj.parent = self.id
         # BUG - does obj.lock need to be held?
         obj.refcnt += 1
+        attr_cache.invalidate(obj) # numlinks changed
 
     def unlink(self, name, principal): # NF4DIR only
         """Removes name from directory"""
@@ -493,32 +700,33 @@ class FSObject(object):
             if obj.isdir and not obj.isempty:
                 raise NFS4Error(NFS4ERR_NOTEMPTY)
             obj.refcnt -= 1
+            attr_cache.invalidate(obj) # numlinks changed
             obj.sync()
         finally:
             obj.lock.release()
         del self.entries[name]
+        if self._dirindex is not None:
+            self._dirindex.remove(name)
 
-    def readdir(self, verifier, client, principal):
-        """Returns list of (name, obj) pairs"""
-        # STUB - this API will certainly change
-        # need to think how to deal with cookies
+    def readdir(self, cookie, verifier, client, principal):
+        """Returns (entries, verifier) for READDIR continuing after cookie.
+
+        entries iterates over (cookie, name, id) in cookie order.  Use
+        self.fs.find(id) for the objects, if they are needed.
+        """
         log_o.log(5, "FSObject.readdir()")
         if not self.access4_read(principal):
             raise NFS4Error(NFS4ERR_ACCESS)
-        t = struct.unpack(">d", verifier)[0]
-        if t != 0.0:
-            try:
-                return self.dircache[t], verifier
-            except KeyError:
-                raise NFS4Error(NFS4ERR_NOT_SAME)
-        res = [(name, self.fs.find(id)) for name, id in self.entries.items()]
-        while len(self.dircache) >= 4:
-            # Clean out old cache entries
-            # NOTE this system is problematic if multiple clients accessing
-            del self.dircache[min(self.dircache.keys())]
-        t = time.time()
-        self.dircache[t] = res
-        return res, struct.pack(">d", t)
+        index = self._dirindex
+        if index is None:
+            index = self._dirindex = DirIndex(self.entries)
+        if verifier != b"\0" * 8 and verifier != index.verifier:
+            raise NFS4Error(NFS4ERR_NOT_SAME)
+        if cookie >= index.next_cookie:
+            raise NFS4Error(NFS4ERR_BAD_COOKIE)
+        entries = self.entries
+        return ((c, name, entries[name]) for c, name in index.after(cookie)
+                if name in entries), index.verifier
 
     def create(self, name, principal, kind, attrs):
         """Create and link a new object into the dir
@@ -538,14 +746,15 @@ class FSObject(object):
         return obj, bitmask
 
 class FileSystem(object):
+    max_ids = 0 # Most objects find() keeps in memory, see set_max_ids
+
     def __init__(self, fsid=0, objclass=FSObject):
         log_fs.log(5, "FileSystem.__init__(fsid=%i)" % fsid)
         self.fsid = (1, fsid) # Return a unique 2-tuple of uint64
         self.objclass = objclass
         self._disk_lock = Lock("FSLock")
         self.read_only = False
-        # This is list of currently active objects.
-        self._ids = {} # {obj.id: obj}
+        self._init_ids()
         self._set_fattrs()
         self.mounted_on = None # obj on which fs is mounted
         # Do this last
@@ -579,6 +788,7 @@ class FileSystem(object):
         """
         dir.covered_by = self.root
         self.mounted_on = dir
+        attr_cache.invalidate(self.root) # mounted_on_fileid changed
 
     def attach_to_server(self, server):
         """Called at mount, gives fs a chance to interact with server.
@@ -599,17 +809,41 @@ class FileSystem(object):
     def layout_options(self):
         return 0
 
+    def _init_ids(self):
+        # This is list of currently active objects, least recently used first
+        self._ids = OrderedDict() # {obj.id: obj}
+        self.evictions = 0
+        # _trim_ids does nothing until _ids is larger than this, which is
+        # raised when a pass finds nothing it can evict
+        self._trim_at = 0
+
+    def set_max_ids(self, count):
+        """Have find() keep about count objects in memory, 0 for no limit.
+
+        Only filesystems which implement evict() can do this.  Returns
+        False for the others, which keep every object.
+        """
+        if type(self).evict is FileSystem.evict:
+            return False
+        self.max_ids = count
+        self._trim_at = 0
+        return True
+
     def find(self, id):
         """ Returns a FSObject with given id
 
         There should only be one such outstanding.  If it has
         already been passed out, point to same obj.  Otherwise
         read disk info to create a new one.
-        Note : cleanup might be helped by sys.getrefcount()
         """
         log_fs.log(5, "FileSystem.find(id=%r)" % id)
         obj = self._ids.get(id, None)
         if obj is not None:
+            if self.max_ids:
+                try:
+                    self._ids.move_to_end(id)
+                except KeyError:
+                    pass # Being evicted, which will fail since we hold obj
             return obj
         else:
             self._disk_lock.acquire()
@@ -621,9 +855,84 @@ class FileSystem(object):
                 # Guess not, create a new in-memory obj using info on disk
                 obj = self.find_on_disk(id)
                 self._ids[id] = obj
-                return obj
             finally:
                 self._disk_lock.release()
+            self._trim_ids()
+            return obj
+
+    def _trim_ids(self):
+        """Evict least recently used objects while there are over max_ids
+
+        For an evictable() object, self.evict() returns what is needed to
+        remake it, and it is dropped from self._ids.  If anything else
+        still holds it, it does not go away, and is put back at the end
+        of the line.  Otherwise what evict() returned is handed to
+        self.save_evicted().  So there is never more than one in-memory
+        obj for an id.  At most a few more objects than needed are looked
+        at per call, and if none of them could be evicted, no more are
+        until the table has grown by an eighth.
+        """
+        ids = self._ids
+        if not self.max_ids or len(ids) <= max(self.max_ids, self._trim_at):
+            return
+        self._disk_lock.acquire()
+        try:
+            excess = len(ids) - self.max_ids
+            evicted = 0
+            for id in list(itertools.islice(ids, 2 * excess + 16)):
+                if len(ids) <= self.max_ids:
+                    break
+                obj = ids.get(id)
+                if obj is None:
+                    continue
+                if not obj.evictable():
+                    ids.move_to_end(id)
+                    continue
+                attr_cache.invalidate(obj) # Drop its references to obj
+                saved = self.evict(obj)
+                if saved is None:
+                    ids.move_to_end(id)
+                    continue
+                ref = weakref.ref(obj)
+                del ids[id], obj
+                obj = ref() # None unless something else holds it
+                if obj is None:
+                    self.save_evicted(id, saved)
+                    self.evictions += 1
+                    evicted += 1
+                else:
+                    ids[id] = obj
+                del obj, saved
+            if evicted:
+                self._trim_at = 0
+            else:
+                # Everything looked at is held, so save rescanning it
+                self._trim_at = len(ids) + len(ids) // 8
+        finally:
+            self._disk_lock.release()
+
+    def id_stats(self):
+        """Return the inode table statistics as a dictionary"""
+        return {"in_memory" : len(self._ids),
+                "evictions" : self.evictions,
+                "max_ids" : self.max_ids,
+                }
+
+    def evict(self, obj):
+        """Return whatever find_on_disk needs to remake obj later.
+
+        Called with _disk_lock held.  Returns None if obj must instead
+        stay in memory.  Nothing should be kept yet, since obj may turn
+        out to be still in use, see save_evicted.
+        """
+        return None
+
+    def save_evicted(self, id, saved):
+        """Keep saved, as returned by evict(), for find_on_disk(id)
+
+        Called with _disk_lock held, once the object is gone.
+        """
+        pass
 
     def find_on_disk(self, id):
         """Returns a FSObject created from disk info pointed to by id"""
@@ -650,6 +959,7 @@ class FileSystem(object):
             log_fs.exception("fs.create failed")
             # traceback.print_exc()
             self.dealloc_id(id)
+        self._trim_ids()
         return obj
 
     def alloc_id(self):
@@ -686,9 +996,39 @@ class RootFS(FileSystem):
 class StubFS_Mem(FileSystem):
     def __init__(self, fsid):
         self._nextid = 0
+        # Evicted objects, as {id: meta} if there is nothing else to
+        # keep, otherwise {id: (meta, file, entries, dirindex)}
+        self._store = {}
         FileSystem.__init__(self)
         self.fsid = (2, fsid)
 
+    def evict(self, obj):
+        if obj._file is None and obj._entries is None and \
+                obj._dirindex is None:
+            return obj.meta
+        return (obj.meta, obj._file, obj._entries, obj._dirindex)
+
+    def save_evicted(self, id, saved):
+        meta = (saved if isinstance(saved, MetaData) else saved[0])
+        if meta.refcnt == 0:
+            # Unlinked, and now nothing holds it, so it can never be
+            # found again
+            return
+        self._store[id] = saved
+
+    def find_on_disk(self, id):
+        data = self._store.pop(id)
+        if isinstance(data, MetaData):
+            return self.objclass(self, id, data)
+        meta, file, entries, dirindex = data
+        obj = self.objclass(self, id, meta)
+        if file is not None:
+            obj.file = file
+        if entries is not None:
+            obj.entries = entries
+        obj._dirindex = dirindex
+        return obj
+
     def alloc_id(self):
         """Alloc disk space for an FSObject, and return an identifier
         that will allow us to find the disk space later.
@@ -711,13 +1051,13 @@ class ConfigObj(FSObject):
         self._reset()
 
     def _reset(self):
-        self.file = StringIO()
-        self.file.write("# %s\n" % self.configline.comment)
+        self.file = BytesIO()
+        self.file.write(("# %s\n" % self.configline.comment).encode())
         value = self.configline.value
         if type(value) is list:
-            self.file.write(" ".join([str(i) for i in value]))
+            self.file.write(" ".join([str(i) for i in value]).encode())
         else:
-            self.file.write("%r\n" % value)
+            self.file.write(("%r\n" % value).encode())
         self.change_data()
         self.dirty = False
 
@@ -741,7 +1081,7 @@ class ConfigObj(FSObject):
         if not self.dirty:
             return
         lines = []
-        for line in self.file.getvalue().split("\n"):
+        for line in self.file.getvalue().decode(errors="replace").split("\n"):
             line = line.strip()
             if line and not line.startswith("#"):
                 lines.append(line)
@@ -777,14 +1117,16 @@ class ConfigObj(FSObject):
             return None
         return self.fs.find(id)
 
-    def readdir(self, verifier, client, principal):
-        v0 = "\x00" * 8
-        v1 = "\x01" * 8
+    def readdir(self, cookie, verifier, client, principal):
+        v0 = b"\x00" * 8
+        v1 = b"\x01" * 8
         if verifier not in (v0, v1):
             raise NFS4Error(NFS4ERR_NOT_SAME)
-        entries = self._build_entries(client)
-        res = [(name, self.fs.find(id)) for name, id in entries.items()]
-        return res, v1
+        # The entries are built in the same order each time
+        entries = list(self._build_entries(client).items())
+        first = DirIndex.first_cookie
+        return ((i + first, name, id) for i, (name, id) in enumerate(entries)
+                if i + first > cookie), v1
 
     def _build_entries(self, client):
         def makefh(code, mask=0):
@@ -980,7 +1322,7 @@ class StubFS_Disk(FileSystem):
         self.objclass = FSObject
         self._disk_lock = Lock("FSLock(Disk)")
         self.read_only = False
-        self._ids = {} # {obj.id: obj}
+        self._init_ids()
 
         # Copy persistent data
         self._fs_data = d
@@ -997,8 +1339,8 @@ class StubFS_Disk(FileSystem):
         fd.close()
         obj = self.objclass(self, id, meta)
         if obj.type == NF4REG:
-            fd = open(os.path.join(self.path, "d_%i" % id), "r")
-            obj.file = StringIO(fd.read())
+            fd = open(os.path.join(self.path, "d_%i" % id), "rb")
+            obj.file = BytesIO(fd.read())
             fd.close()
         elif obj.type == NF4DIR:
             fd = open(os.path.join(self.path, "d_%i" % id), "r")
@@ -1050,12 +1392,12 @@ class StubFS_Disk(FileSystem):
             # Create meta-data file
             log_fs.debug("writing metadata for id=%i" % id)
             fd = open(os.path.join(self.path, "m_%i" % id), "w")
-            log_fs.debug("%r" % obj.meta.__dict__)
+            log_fs.debug("%r" % obj.meta.__getstate__())
             pickle.dump(obj.meta, fd)
             fd.close()
             if obj.type == NF4REG:
                 # Create data file
-                fd = open(os.path.join(self.path, "d_%i" % id), "w")
+                fd = open(os.path.join(self.path, "d_%i" % id), "wb")
                 obj.file.seek(0)
                 fd.write(obj.file.read())
                 fd.close()
@@ -1368,10 +1710,12 @@ class BlockLayoutFS(FileSystem):
         return [self.volume]
 
 class FSLayoutFSObj(FSObject):
+    # STUB: make nflutil a control variable
+    stripe_size = NFL4_UFLG_STRIPE_UNIT_SIZE_MASK & 0x4000
+
     def _get_layout(self, arg):
         """Needs to support striping
         """
-        # STUB: make nflutil a control variable
         nflutil = self.stripe_size
         # STUB: Return the layout_content4 for pnfs-files
         # This works only with one device id
@@ -1406,9 +1750,8 @@ class FSLayoutFSObj(FSObject):
         return None
 
     def init_file(self):
-        self.stripe_size = NFL4_UFLG_STRIPE_UNIT_SIZE_MASK & 0x4000
         if self.fs.dsdevice.mdsds:
-            return StringIO()
+            return BytesIO()
         else:
             return FileLayoutFile(self)
 
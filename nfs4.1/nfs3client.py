@@ -120,7 +120,12 @@ class Mnt3Client(rpc.Client):
         return res.mountinfo.fhandle
 
 class NFS3Client(rpc.Client):
-    def __init__(self, host='localhost', port=None, ctrl_proc=16, summary=None):
+    """NFSv3 client.
+
+    With nconnect > 1, calls are spread over that many connections.
+    """
+    def __init__(self, host='localhost', port=None, ctrl_proc=16, summary=None,
+                 nconnect=1):
         rpc.Client.__init__(self, 100003, 3)
         self.portmap = PORTMAPClient(host=host)
         self.mntport = self.portmap.get_port(MOUNT_PROGRAM, MOUNT_V3)
@@ -133,12 +138,17 @@ class NFS3Client(rpc.Client):
         self.server_address = (host, self.port)
         self.ctrl_proc = ctrl_proc
         self.summary = summary
+        self.nconnect = nconnect
         self._pipe = None
         self.mntclnt = Mnt3Client(host=host, port=self.mntport)
 
     def get_pipe(self):
         if not self._pipe or not self._pipe.is_active():
-            self._pipe = self.connect(self.server_address)
+            if self.nconnect > 1:
+                self._pipe = self.connect_pool(self.server_address,
+                                               self.nconnect)
+            else:
+                self._pipe = self.connect(self.server_address)
         return self._pipe
 
     def set_cred(self, credinfo):
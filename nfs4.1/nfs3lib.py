@@ -89,56 +89,10 @@ class InvalidRes(NFSException):
             return "Invalid NFS result"
 
 class FancyNFS3Packer(NFS3Packer):
-    """Handle dirlist3 and dirlistplus3 more cleanly than auto-generated methods"""
-
-    def filter_dirlistplus3(self, data):
-        """Change simple list of entryplus3 into strange chain structure"""
-        out = []
-        for e in data.entries[::-1]:
-            # print("handle", e)
-            # This reverses the direction of the list, so start with reversed
-            out = [xdrdef.nfs3_type.entry3(e.cookie, e.name, e.fileid, e.attrs, e.handle, out)]
-        # Must not modify original data structure
-        return xdrdef.nfs3_type.dirlistplus3(out, data.eof)
-
-    def filter_dirlist3(self, data):
-        """Change simple list of entry3 into strange chain structure"""
-        out = []
-        for e in data.entries[::-1]:
-            # print("handle", e)
-            # This reverses the direction of the list, so start with reversed
-            out = [xdrdef.nfs3_type.entry3(e.cookie, e.name, e.fileid, out)]
-        # Must not modify original data structure
-        return xdrdef.nfs3_type.dirlist3(out, data.eof)
+    pass
 
 class FancyNFS3Unpacker(NFS3Unpacker):
-    def filter_dirlist3(self, data):
-        """Return as simple list, instead of strange chain structure"""
-        chain = data.entries
-        list = []
-        while chain:
-            # Pop first entry off chain
-            e = chain[0]
-            chain = e.nextentry
-            # Add to list
-            e.nextentry = None # XXX Do we really want to do this?
-            list.append(e)
-        data.entries = list
-        return data
-
-    def filter_dirlistplus3(self, data):
-        """Return as simple list, instead of strange chain structure"""
-        chain = data.entries
-        list = []
-        while chain:
-            # Pop first entry off chain
-            e = chain[0]
-            chain = e.nextentry
-            # Add to list
-            e.nextentry = None # XXX Do we really want to do this?
-            list.append(e)
-        data.entries = list
-        return data
+    pass
 
 ##########################################################
 
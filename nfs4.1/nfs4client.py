@@ -1,5 +1,6 @@
 import use_local # HACK so don't have to rebuild constantly
 import rpc.rpc as rpc
+import rpc.aio as rpc_aio
 import nfs4lib
 from nfs4lib import NFS4Error, NFS4Replay, inc_u32
 from xdrdef.nfs4_type import *
@@ -9,6 +10,8 @@ import nfs_ops
 op = nfs_ops.NFS4ops()
 import time, struct
 import threading
+import itertools
+import concurrent.futures
 import hmac
 import inspect
 from os.path import basename
@@ -27,7 +30,13 @@ op4 = nfs_ops.NFS4ops()
 SHOW_TRAFFIC = 0
 
 class NFS4Client(rpc.Client, rpc.Server):
-    def __init__(self, host=b'localhost', port=2049, minorversion=1, ctrl_proc=16, summary=None, secure=False):
+    """NFSv4.1 client.
+
+    If aio is True, connections are run by an rpc.aio.Engine, self.engine,
+    instead of the polling thread, and compound_aio may be used to keep
+    many compounds outstanding from coroutines running in self.engine.loop.
+    """
+    def __init__(self, host=b'localhost', port=2049, minorversion=1, ctrl_proc=16, summary=None, secure=False, aio=False):
         rpc.Client.__init__(self, 100003, 4)
         self.prog = 0x40000000
         self.versions = [1] # List of supported versions of prog
@@ -39,12 +48,22 @@ class NFS4Client(rpc.Client, rpc.Server):
                                     nfs4lib.get_nfstime())
         self.verifier = struct.pack('>d', time.time())
         self.server_address = (host, port)
+        if aio:
+            self.engine = rpc_aio.Engine(self)
+            self.engine.start_thread()
+        else:
+            self.engine = None
         self.c1 = self.connect(self.server_address,secure=secure)
         self.sessions = {} # XXX Really, this should be per server
         self.clients = {} # XXX Really, this should be per server
         self.ctrl_proc = ctrl_proc
         self.summary = summary
 
+    def connect(self, address, secure=False):
+        if self.engine is None:
+            return rpc.Client.connect(self, address, secure)
+        return self.engine.run(self.engine.connect(address, secure))
+
     def set_cred(self, credinfo):
         self.default_cred = credinfo
 
@@ -109,6 +128,45 @@ class NFS4Client(rpc.Client, rpc.Server):
             data = p.unpack_COMPOUND4res()
         return data
 
+    def compound_future(self, ops, pipe=None, **kwargs):
+        """Send a compound, returning a concurrent.futures.Future.
+
+        The result of the future is what listen() would return.
+        """
+        if pipe is None:
+            pipe = self.c1
+        xid = self.compound_async(ops, pipe=pipe, **kwargs)
+        return _chain_future(pipe.future(xid), _unpack_compound_reply)
+
+    def compound_futures(self, ops_list, **kwargs):
+        """Send a compound for each list of ops in ops_list, without waiting.
+
+        Returns the list of corresponding futures.
+        """
+        return [self.compound_future(ops, **kwargs) for ops in ops_list]
+
+    def compound_many(self, ops_list, timeout=10.0, **kwargs):
+        """Send a compound for each list of ops in ops_list, all at once.
+
+        Returns the list of corresponding results.
+        """
+        futures = self.compound_futures(ops_list, **kwargs)
+        return [f.result(timeout) for f in futures]
+
+    async def compound_aio(self, ops, pipe=None, timeout=10.0, **kwargs):
+        """Coroutine version of compound, requires aio=True.
+
+        This must run in self.engine.loop.
+        """
+        if pipe is None:
+            pipe = self.c1
+        xid = self.compound_async(ops, pipe=pipe, **kwargs)
+        header, data = await pipe.alisten(xid, timeout)
+        if data:
+            p = nfs4lib.FancyNFS4Unpacker(data)
+            data = p.unpack_COMPOUND4res()
+        return data
+
     def handle_0(self, data, cred):
         """NULL procedure"""
         allow_null_data = True
@@ -163,7 +221,8 @@ class NFS4Client(rpc.Client, rpc.Server):
                 env.cache.valid.set()
         except NFS4Replay as e:
             log_cb.info("Replay...waiting for valid data")
-            e.cache.valid.wait()
+            with rpc.blocking():
+                e.cache.valid.wait()
             log_cb.info("Replay...sending data")
             data = e.cache.data
         return rpc.SUCCESS, data, getattr(env, "notify", None)
@@ -465,6 +524,36 @@ class SendChannel(object):
         finally:
             self.lock.release()
 
+def _unpack_compound_reply(reply):
+    header, data = reply
+    if data:
+        p = nfs4lib.FancyNFS4Unpacker(data)
+        data = p.unpack_COMPOUND4res()
+    return data
+
+def _chain_future(future, funct, release=None):
+    """Return a future whose result is funct(future.result())
+
+    If given, release() is called once future is done, whatever the
+    outcome, before the returned future is completed.
+    """
+    out = concurrent.futures.Future()
+    def done(f):
+        try:
+            try:
+                result = funct(f.result())
+            finally:
+                if release is not None:
+                    release()
+        except Exception as e:
+            if out.set_running_or_notify_cancel():
+                out.set_exception(e)
+        else:
+            if out.set_running_or_notify_cancel():
+                out.set_result(result)
+    future.add_done_callback(done)
+    return out
+
 class SessionRecord(object):
     def __init__(self, csr, client):
         self.sessionid = csr.csr_sessionid
@@ -528,6 +617,70 @@ class SessionRecord(object):
         res = self.remove_seq_op(res)
         return res
 
+    def compound_future(self, ops, pipe=None, **kwargs):
+        """Send a compound on the session, returning a Future.
+
+        The result of the future is what listen() would return.  The slot
+        is released as soon as the reply arrives, or the call fails.
+        """
+        if pipe is None:
+            pipe = self.c.c1
+        slot = self.compound_async(ops, pipe=pipe, **kwargs)
+        xid, slot.xid = slot.xid, None
+        def finish(reply):
+            res = _unpack_compound_reply(reply)
+            res = self.update_seq_state(res, slot)
+            return self.remove_seq_op(res)
+        def release():
+            # update_seq_state has not run if the call or unpack failed
+            with self.fore_channel.lock:
+                slot.inuse = False
+        return _chain_future(pipe.future(xid), finish, release)
+
+    def compound_futures(self, ops_list, **kwargs):
+        """Send a compound for each list of ops in ops_list, without waiting.
+
+        Raises RuntimeError if ops_list is longer than the free slots.
+        """
+        return [self.compound_future(ops, **dict(kwargs)) for ops in ops_list]
+
+    def compound_many(self, ops_list, timeout=10.0, **kwargs):
+        """Send a compound for each list of ops in ops_list.
+
+        As many are kept outstanding as the slot table allows, sending
+        the next as each reply arrives.  Returns the list of results.
+        If any call fails, the others still outstanding are cancelled
+        (their slots are released as their replies arrive) and the error
+        is raised.  Raises RuntimeError if there is more to send but no
+        slot is free and nothing is outstanding.
+        """
+        results = [None] * len(ops_list)
+        todo = enumerate(ops_list)
+        pending = {} # {future: index}
+        def send():
+            # Always try at least one when nothing is outstanding, so that
+            # running out of slots raises rather than sending nothing
+            with self.fore_channel.lock:
+                free = len([s for s in self.fore_channel.slots if not s.inuse])
+            count = max(free, 0 if pending else 1)
+            for i, ops in itertools.islice(todo, count):
+                pending[self.compound_future(ops, **dict(kwargs))] = i
+        try:
+            send()
+            while pending:
+                done, not_done = concurrent.futures.wait(pending, timeout,
+                                    concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    raise rpc.RPCTimeout
+                for f in done:
+                    results[pending.pop(f)] = f.result()
+                send()
+        except:
+            for f in pending:
+                f.cancel()
+            raise
+        return results
+
     def compound(self, ops, **kwargs):
         max_retries = 10
         delay_time = 1
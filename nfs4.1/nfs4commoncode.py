@@ -15,6 +15,7 @@ _d = {"CompoundState" : "CompoundState",
       "encode_status" : "encode_status",
       "nfs_resop4" : "nfs_resop4",
       "nfs_opnum4" : "nfs_opnum4",
+      "encoders" : "encoders",
       "mangle" : '"op" + name_l',
       }
 
@@ -24,35 +25,76 @@ _cb_d = {"CompoundState" : "CBCompoundState",
          "encode_status" : "cb_encode_status",
          "nfs_resop4" : "nfs_cb_resop4",
          "nfs_opnum4" : "nfs_cb_opnum4",
+         "encoders" : "cb_encoders",
          "mangle" : '"opcb" + name_l[3:]',
          }
 
 code_str = '''\
-def %(encode_status)s_by_name(name, status, *args, **kwargs):
-    """ returns %(nfs_resop4)s(OP_NAME, opname=NAME4res(status, *args)) """
-    tag = kwargs.pop("msg", None)
-    name_l = name.lower()
-    name_u = name.upper()
-    try:
-        res4 = getattr(xdrdef.nfs4_type, name_u + "4res")(status, *args, **kwargs)
-        result = %(nfs_resop4)s(getattr(xdrdef.nfs4_const, "OP_" + name_u))
-        setattr(result, %(mangle)s, res4)
+def _%(encode_status)s_builder(opnum):
+    """Return function encode_<name>(status, *args, **kwargs), which
+    returns %(nfs_resop4)s(OP_NAME, opname=NAME4res(status, *args)).
+
+    The keyword msg, if given, is used as the result's tag.
+    """
+    name_l = %(nfs_opnum4)s[opnum].lower()[3:]
+    res_class = getattr(xdrdef.nfs4_type, name_l.upper() + "4res")
+    arm = %(mangle)s
+    if hasattr(%(nfs_resop4)s, "__slots__"):
+        template = None
+    else:
+        # Copying a prepared __dict__ is much quicker than __init__,
+        # which sets every arm of the union one at a time.
+        template = %(nfs_resop4)s(opnum).__dict__
+        if arm not in template:
+            raise RuntimeError("No arm %%r in %(nfs_resop4)s" %% arm)
+    def build(status, *args, **kwargs):
+        tag = kwargs.pop("msg", None)
+        res4 = res_class(status, *args, **kwargs)
+        if template is None:
+            result = %(nfs_resop4)s(opnum)
+            setattr(result, arm, res4)
+        else:
+            result = %(nfs_resop4)s.__new__(%(nfs_resop4)s)
+            result.__dict__ = d = dict(template)
+            d[arm] = res4
         # STUB XXX 4.1 has messed with the naming conventions,
         #      and added prefixes to the "status" variable. Grrr.
         result.status = status # This is a HACK to deal.
         if tag:
             result.tag = tag
         return result
-    except StandardError:
-        raise
-        pass
-    raise RuntimeError("Problem with name %%r" %% name)
+    build.__name__ = "encode_" + name_l
+    return build
+
+# Result builders, by opnum and as module functions encode_<name>
+%(encoders)s = {} # {opnum: encode_<name>}
+%(encoders)s_by_name = {} # {name: encode_<name>}
+for _opnum in %(nfs_opnum4)s:
+    try:
+        _build = _%(encode_status)s_builder(_opnum)
+    except (AttributeError, RuntimeError):
+        # No result type for this op in nfs4.x
+        continue
+    %(encoders)s[_opnum] = _build
+    %(encoders)s_by_name[_build.__name__[7:]] = _build
+    globals()[_build.__name__] = _build
+
+def %(encode_status)s_by_name(name, status, *args, **kwargs):
+    """ returns %(nfs_resop4)s(OP_NAME, opname=NAME4res(status, *args)) """
+    try:
+        build = %(encoders)s_by_name[name.lower()]
+    except KeyError:
+        raise RuntimeError("Problem with name %%r" %% name)
+    return build(status, *args, **kwargs)
 
 def %(encode_status)s(status, *args, **kwargs):
     """Called from function op_<name>, encodes the operations response.
 
     Basically, we want to find:
     result = nfs_resop4(OP_NAME, opname=NAME4res(status, *args))
+
+    This looks up the caller by name, so where it matters, call the
+    builder encode_<name> directly instead.
     """
     funct_name = sys._getframe(1).f_code.co_name # Name of calling function
     if funct_name.startswith("op_"):
@@ -67,20 +109,22 @@ class %(CompoundArgResults)s(object):
     def __init__(self, env, prefix=b""):
         self.status = NFS4_OK # Generally == self.results[-1].status
         self.results = [] # Array of nfs_resop4 structures
-        self.packed = [] # Corresponding XDR encoded nfs_resop4 structures
         self.prefix = prefix # String to prepend onto COMPOUND tag
         self._base_len = 8 # status + arraysize
         self._p = nfs4lib.FancyNFS4Packer()
         self._env = env
 
-    def append(self, result):
+    def sizeof(self, result):
+        """Return size of XDR encoded nfs_resop4 structure"""
+        return self._p.sizeof_%(nfs_resop4)s(result)
+
+    def append(self, result, size=None):
         """Add an nfs_resop4 structure to our list"""
+        if size is None:
+            size = self.sizeof(result)
         self.status = result.status
         self.results.append(result)
-        self._p.reset()
-        self._p.pack_%(nfs_resop4)s(result)
-        self.packed.append(self._p.get_buffer())
-        self._base_len += len(self.packed[-1])
+        self._base_len += size
 
     def __getitem__(self, key):
         return self.results[key]
@@ -96,27 +140,49 @@ class %(PairedResults)s(object):
         self.cache = %(CompoundArgResults)s(env, prefix=b"[REPLAY] ")
 
     def append(self, result):
+        """Add result, returning it or the error it had to be replaced with"""
         if hasattr(result, "tag"):
             self.env.tag_msg(result.tag)
-        self.reply.append(result)
-        # Basically, ignoring size checks, this does:
+        result, size = self.check_size(result)
+        self.reply.append(result, size)
+        # Basically, this does:
         #    if self.env.cacheing:
         #        self.cache = self.reply
         #    else:
         #        self.cache = self.reply[0:1] + [NFS4ERR_RETRY_UNCACHED_REP]
         #                        ^
         #                         \should be SEQ
-
-        # STUB - do size checking on self.reply
         if self.env.caching or self.env.index == 0:
-            self.cache.append(result)
-            # STUB - do size checking on self.cache
+            self.cache.append(result, size)
         elif self.env.index == 1:
             name = %(nfs_opnum4)s[result.resop].lower()[3:]
             res = %(encode_status)s_by_name(name, NFS4ERR_RETRY_UNCACHED_REP)
             self.cache.append(res)
         else:
             pass
+        return result
+
+    def check_size(self, result):
+        """Replace result with an error if it would make the reply, or the
+        cached reply, bigger than the channel allows.  See draft22 2.10.6.4
+
+        Returns (result, encoded size of result).
+        """
+        size = self.reply.sizeof(result)
+        channel = self.env.channel
+        if channel is None:
+            return result, size
+        # STUB - limits are over-the-wire, so should allow for rpc header
+        if self.env.caching and \
+           self.cache.size + size > channel.maxresponsesize_cached:
+            status = NFS4ERR_REP_TOO_BIG_TO_CACHE
+        elif self.reply.size + size > channel.maxresponsesize:
+            status = NFS4ERR_REP_TOO_BIG
+        else:
+            return result, size
+        name = %(nfs_opnum4)s[result.resop].lower()[3:]
+        result = %(encode_status)s_by_name(name, status)
+        return result, self.reply.sizeof(result)
 
     def set_empty_return(self, status, tag=None):
         self.reply.status = self.cache.status = status
@@ -146,6 +212,7 @@ class %(CompoundState)s(object):
         # XXX Do we want a setter funct, since resetting would be bad?
         self.cache = None # Where to cache it, of type Cache
         self.session = None
+        self.channel = None # Channel whose size limits apply, set by SEQUENCE
 
         # Access to args, since operations sometimes need access to others
         self.req_size = args.req_size
@@ -195,3 +262,10 @@ exec(code_str % _d)
 # Create callback code
 exec(code_str % _cb_d)
 
+
+__all__ = ["CompoundState", "CBCompoundState",
+           "encode_status", "cb_encode_status",
+           "encode_status_by_name", "cb_encode_status_by_name",
+           "encoders", "cb_encoders"] + \
+          [f.__name__ for f in encoders.values()] + \
+          [f.__name__ for f in cb_encoders.values()]
@@ -3,6 +3,7 @@ import rpc.rpc as rpc
 import xdrdef.nfs4_const
 from xdrdef.nfs4_pack import NFS4Packer, NFS4Unpacker
 import xdrdef.nfs4_type
+from fattrcodec import FattrCodec, list2bitmap, bitmap2list
 import nfs_ops
 import time
 import collections
@@ -191,7 +192,7 @@ class InvalidCompoundRes(NFSException):
             return "Invalid COMPOUND result"
 
 class FancyNFS4Packer(NFS4Packer):
-    """Handle fattr4 and dirlist4 more cleanly than auto-generated methods"""
+    """Handle fattr4 more cleanly than auto-generated methods"""
     def filter_bitmap4(self, data):
         out = []
         while data:
@@ -205,16 +206,6 @@ class FancyNFS4Packer(NFS4Packer):
             data = dict2fattr(data)
         return data
 
-    def filter_dirlist4(self, data):
-        """Change simple list of entry4 into strange chain structure"""
-        out = []
-        for e in data.entries[::-1]:
-            # print("handle", e)
-            # This reverses the direction of the list, so start with reversed
-            out = [xdrdef.nfs4_type.entry4(e.cookie, e.name, e.attrs, out)]
-        # Must not modify original data structure
-        return xdrdef.nfs4_type.dirlist4(out, data.eof)
-
 class FancyNFS4Unpacker(NFS4Unpacker):
     def filter_bitmap4(self, data):
         """Put bitmap into single integer, instead of array of 32bit chunks"""
@@ -229,68 +220,22 @@ class FancyNFS4Unpacker(NFS4Unpacker):
         """Return as dict, instead of opaque attrlist"""
         return fattr2dict(data)
 
-    def filter_dirlist4(self, data):
-        """Return as simple list, instead of strange chain structure"""
-        chain = data.entries
-        list = []
-        while chain:
-            # Pop first entry off chain
-            e = chain[0]
-            chain = e.nextentry
-            # Add to list
-            e.nextentry = None # XXX Do we really want to do this?
-            list.append(e)
-        data.entries = list
-        return data
+fattr_codec = FattrCodec(FancyNFS4Packer, FancyNFS4Unpacker,
+                          xdrdef.nfs4_type.fattr4, bitnum2attr)
 
 def dict2fattr(dict):
     """Convert a dictionary of form {numb:value} to a fattr4 object.
 
     Returns a fattr4 object.
     """
-
-    attrs = sorted(dict.keys())
-
-    packer = FancyNFS4Packer()
-    attr_vals = b""
-    for bitnum in attrs:
-        value = dict[bitnum]
-        packer.reset()
-        getattr(packer, bitnum2packer[bitnum])(value)
-        attr_vals += packer.get_buffer()
-    attrmask = list2bitmap(attrs)
-    return xdrdef.nfs4_type.fattr4(attrmask, attr_vals);
+    return fattr_codec.encode(dict)
 
 def fattr2dict(obj):
     """Convert a fattr4 object to a dictionary with attribute name and values.
 
     Returns a dictionary of form {bitnum:value}
     """
-    result = {}
-    list = bitmap2list(obj.attrmask)
-    unpacker = FancyNFS4Unpacker(obj.attr_vals)
-    for bitnum in list:
-        result[bitnum] = getattr(unpacker, bitnum2unpacker[bitnum])()
-    unpacker.done()
-    return result
-
-def list2bitmap(list):
-    """Construct a bitmap from a list of bit numbers"""
-    mask = 0
-    for bit in list:
-        mask |= 1 << bit
-    return mask
-
-def bitmap2list(bitmap):
-    """Return (sorted) list of bit numbers set in bitmap"""
-    out = []
-    bitnum = 0
-    while bitmap:
-        if bitmap & 1:
-            out.append(bitnum)
-        bitnum += 1
-        bitmap >>= 1
-    return out
+    return fattr_codec.decode(obj)
 
 ##########################################################
 
@@ -463,6 +408,9 @@ class SSVContext(object):
 ##########################################################
 
 def test_equal(obj1, obj2, kind="COMPOUND4res"):
+    if obj1 == obj2:
+        return True
+    # Values can differ yet encode the same, so compare encodings too
     p = FancyNFS4Packer()
     pack = getattr(p, "pack_%s" % kind)
     pack(obj1)
@@ -15,10 +15,28 @@ import hmac
 import random
 import struct
 import collections
+import operator
 import logging
 from nfs4state import find_state
-from nfs4commoncode import CompoundState, encode_status, encode_status_by_name
-from fs import RootFS, ConfigFS
+from nfs4commoncode import (CompoundState, encode_access,
+                            encode_bind_conn_to_session, encode_close,
+                            encode_commit, encode_create,
+                            encode_create_session, encode_delegreturn,
+                            encode_destroy_session, encode_exchange_id,
+                            encode_getattr, encode_getdeviceinfo,
+                            encode_getdevicelist, encode_getfh, encode_illegal,
+                            encode_layoutcommit, encode_layoutget,
+                            encode_layoutreturn, encode_link, encode_lock,
+                            encode_lockt, encode_locku, encode_lookup,
+                            encode_lookupp, encode_nverify, encode_open,
+                            encode_putfh, encode_putrootfh, encode_read,
+                            encode_readdir, encode_readlink, encode_remove,
+                            encode_rename, encode_restorefh, encode_savefh,
+                            encode_secinfo_no_name, encode_sequence,
+                            encode_set_ssv, encode_setattr, encode_setclientid,
+                            encode_setclientid_confirm, encode_status_by_name,
+                            encode_verify, encode_write, encoders)
+from fs import FileSystem, RootFS, ConfigFS, attr_cache
 from config import ServerConfig, ServerPerClientConfig, OpsConfigServer, Actions
 
 logging.basicConfig(level=logging.WARN,
@@ -547,6 +565,11 @@ class NFS4Server(rpc.Server):
     # As the only per-server attribute, lease_time is handled specially
     fattr4_lease_time = property(lambda s: s.config.lease_time)
 
+    # WRITE data is passed down as a view of the received record
+    zerocopy = True
+
+    max_attr_plans = 1024 # Clients choose the masks, so limit the cache
+
     def __init__(self, **kwargs):
         # Handle ctrl_proc keyword
         ctrl_proc = kwargs.pop("ctrl_proc", CONTROL_PROCEDURE)
@@ -564,6 +587,12 @@ class NFS4Server(rpc.Server):
 
         self.summary = SummaryOutput(kwargs.pop('show_summary', False))
 
+        # COMPOUND relies on the session replay cache, so the duplicate
+        # request cache is only needed for the control procedure.
+        if kwargs.pop("drc", False):
+            kwargs["drc"] = rpc.ReplyCache(
+                procs=[(NFS4_PROGRAM, 4, ctrl_proc)])
+
         rpc.Server.__init__(self, prog=NFS4_PROGRAM, versions=[4], port=port,
                             **kwargs)
         self.root = RootFS().root # Root of exported filesystem tree
@@ -583,6 +612,24 @@ class NFS4Server(rpc.Server):
         rpcsec = rpc.security.instance(rpc.AUTH_SYS)
         self.default_cred = rpcsec.init_cred(uid=4321,gid=42,name="mystery")
         self.err_inc_dict = self.init_err_inc_dict()
+        self.op_table = self.make_op_table()
+        self.attr_plans = {} # {(class, fs, supported, attrs, ignore): plan}
+
+    def make_op_table(self):
+        """Return the table op_compound uses to find each operation.
+
+        It maps opnum to (opname, name, handler, encoder), where opname
+        is for example "OP_GETATTR" and name "getattr", handler is the
+        method op_<name>, or None if it is not implemented, and encoder
+        is the builder encode_<name> for its results.
+        """
+        table = {}
+        for opnum, encoder in encoders.items():
+            opname = nfs_opnum4[opnum]
+            name = opname.lower()[3:]
+            handler = getattr(self, "op_" + name, None)
+            table[opnum] = (opname, name, handler, encoder)
+        return table
 
     def start(self):
         """Cause the server to start listening on the previously bound port"""
@@ -691,11 +738,13 @@ class NFS4Server(rpc.Server):
         log_41.info("Handling COMPOUND")
         # data is an XDR packed string.  Unpack it.
         unpacker = nfs4lib.FancyNFS4Unpacker(data)
+        # Names, owners and such stay bytes, only bulk data is a view
+        unpacker.zerocopy = NFS4_OPAQUE_LIMIT + 1
         try:
             args = unpacker.unpack_COMPOUND4args()
             unpacker.done()
         except:
-            log_41.info(repr(data))
+            log_41.info(repr(bytes(data)))
             log_41.warn("returning GARBAGE_ARGS")
             log_41.debug("unpacking raised the following error", exc_info=True)
             return rpc.GARBAGE_ARGS, None
@@ -723,7 +772,8 @@ class NFS4Server(rpc.Server):
                 env.cache.valid.set()
         except NFS4Replay as e:
             log_41.info("Replay...waiting for valid data")
-            e.cache.valid.wait()
+            with rpc.blocking():
+                e.cache.valid.wait()
             log_41.info("Replay...sending data")
             reply = e.cache.data
             unpacker.reset(reply)
@@ -814,16 +864,15 @@ class NFS4Server(rpc.Server):
         # Handle the individual operations
         status = NFS4_OK
         opnames = []
+        op_table = self.op_table
+        illegal = op_table[OP_ILLEGAL]
         for arg in args.argarray:
-            opname = nfs_opnum4.get(arg.argop, 'op_illegal')
-            log_41.info("*** %s (%d) ***" % (opname, arg.argop))
+            opname, name, funct, encode = op_table.get(arg.argop, illegal)
+            log_41.info("*** %s (%d) ***", opname, arg.argop)
             env.index += 1
-            # Look for function self.op_<name>
-            funct = getattr(self, opname.lower(), None)
             if funct is None:
-                # If it doesn't exist, return _NOTSUPP
-                result = encode_status_by_name(opname.lower()[3:],
-                                               NFS4ERR_NOTSUPP)
+                # If there is no self.op_<name>, return _NOTSUPP
+                result = encode(NFS4ERR_NOTSUPP)
             else:
                 try:
                     # Otherwise, call the function
@@ -832,18 +881,16 @@ class NFS4Server(rpc.Server):
                     # XXX NOTE this only works for error returns that
                     # include no data.  Must ensure others (eg setattr)
                     # catch error themselves to encode properly.
-                    result = encode_status_by_name(opname.lower()[3:],
-                                                   e.status, msg=e.tag)
+                    result = encode(e.status, msg=e.tag)
                 except NFS4Replay:
                     # Just pass this on up
                     raise
-                except StandardError:
+                except Exception:
                     # Uh-oh.  This is a server bug
                     traceback.print_exc()
-                    result = encode_status_by_name(opname.lower()[3:],
-                                                   NFS4ERR_SERVERFAULT)
-            env.results.append(result)
-            opnames.append(opname.lower()[3:])
+                    result = encode(NFS4ERR_SERVERFAULT)
+            result = env.results.append(result)
+            opnames.append(name)
             status = result.status
             if status != NFS4_OK:
                 break
@@ -868,10 +915,10 @@ class NFS4Server(rpc.Server):
         See draft22 2.10.4
         """
         if env.index != 0:
-            return encode_status(NFS4ERR_SEQUENCE_POS)
+            return encode_sequence(NFS4ERR_SEQUENCE_POS)
         session = self.sessions.get(arg.sa_sessionid, None)
         if session is None:
-            return encode_status(NFS4ERR_BADSESSION)
+            return encode_sequence(NFS4ERR_BADSESSION)
 
         # We have a session. Check for injected errors
         try:
@@ -885,45 +932,46 @@ class NFS4Server(rpc.Server):
         channel = session.channel_fore
         if connection not in channel.connections:
            if session.binding:
-               return encode_status(NFS4ERR_CONN_NOT_BOUND_TO_SESSION)
+               return encode_sequence(NFS4ERR_CONN_NOT_BOUND_TO_SESSION)
            else:
                # Bind this connection to session, see 2.10.3.1
                channel.connections.append(connection)
         # Bounds checking
         if env.req_size + env.header_size > channel.maxrequestsize:
-            return encode_status(NFS4ERR_REQ_TOO_BIG)
+            return encode_sequence(NFS4ERR_REQ_TOO_BIG)
         if len(env.argarray) > channel.maxoperations:
-            return encode_status(NFS4ERR_TOO_MANY_OPS)
+            return encode_sequence(NFS4ERR_TOO_MANY_OPS)
         # XXX we are ignoring maxslot
         check_size(env, session.sessionid, 0, 0, 0, 0, 0)
         # seqid checking - see 2.10.5.1
         try:
             slot = channel.slots[arg.sa_slotid]
         except IndexError:
-            return encode_status(NFS4ERR_BADSLOT)
+            return encode_sequence(NFS4ERR_BADSLOT)
         env.cache = slot.check_seqid(arg.sa_sequenceid)
         # At this point we are not allowed to return an error
         env.caching = arg.sa_cachethis
         env.session = session
+        env.channel = channel
         session.client.renew_lease() # Lease only renewed in non-error case
         # STUB - figure out return flags
         pass
         # return
         res = SEQUENCE4resok(session.sessionid, slot.seqid, arg.sa_slotid,
                              arg.sa_highest_slotid, channel.maxrequests, 0)
-        return encode_status(NFS4_OK, res)
+        return encode_sequence(NFS4_OK, res)
 
 
     def op_create_session(self, arg, env):
         # This implements draft22
         check_session(env, unique=True)
         if arg.csa_flags & ~nfs4lib.create_session_mask:
-            return encode_status(NFS4ERR_INVAL,
+            return encode_create_session(NFS4ERR_INVAL,
                                  msg="Unknown bits set in flag")
         # Step 1: Client record lookup
         c = self.clients[arg.csa_clientid]
         if c is None: # STUB - or if c.frozen ???
-            return encode_status(NFS4ERR_STALE_CLIENTID)
+            return encode_create_session(NFS4ERR_STALE_CLIENTID)
         # NOTE - had problem here where client with id=0 does some work.
         # Then server reboots, wipe state, and a different client grabs id=0.
         # Now first comes back, gets BADSESSION, so tries to create new
@@ -938,7 +986,7 @@ class NFS4Server(rpc.Server):
         if not c.confirmed:
             # STUB - use matching function here???
             if env.principal != c.principal:
-                return encode_status(NFS4ERR_CLID_INUSE)
+                return encode_create_session(NFS4ERR_CLID_INUSE)
             else:
                 c.confirmed = True
                 # STUB - need to purge state of any previous, and
@@ -972,7 +1020,7 @@ class NFS4Server(rpc.Server):
         # Return
         res = CREATE_SESSION4resok(session.sessionid, arg.csa_sequence,
                                    flags, fore_attrs, back_attrs)
-        return encode_status(NFS4_OK, res)
+        return encode_create_session(NFS4_OK, res)
 
     def op_set_ssv(self, arg, env):
         # This implements draft26
@@ -981,20 +1029,20 @@ class NFS4Server(rpc.Server):
         protect = env.session.client.protection
         if protect.type != SP4_SSV:
             # Per draft26 18.47.3
-            return encode_status(NFS4ERR_INVAL,
+            return encode_set_ssv(NFS4ERR_INVAL,
                                  msg="Did not request SP4_SSV protection")
         # Do some argument checking
         size = protect.context.ssv_len
         if len(arg.ssa_ssv) != size:
-            return encode_status(NFS4ERR_INVAL, msg="SSV size != %i" % size)
+            return encode_set_ssv(NFS4ERR_INVAL, msg="SSV size != %i" % size)
         if arg.ssa_ssv == "\0" * size:
-            return encode_status(NFS4ERR_INVAL, msg="SSV==0 not allowed")
+            return encode_set_ssv(NFS4ERR_INVAL, msg="SSV==0 not allowed")
         # Now we need to compute and check digest, using SEQUENCE args
         p = nfs4lib.FancyNFS4Packer()
         p.pack_SEQUENCE4args(env.argarray[0].opsequence)
         digest = protect.context.hmac(p.get_buffer(), SSV4_SUBKEY_MIC_I2T)
         if digest != arg.ssa_digest:
-            return encode_status(NFS4ERR_BAD_SESSION_DIGEST)
+            return encode_set_ssv(NFS4ERR_BAD_SESSION_DIGEST)
         # OK, it checks, so set new ssv
         protect.context.set_ssv(arg.ssa_ssv)
         # Now create new digest using SEQUENCE result
@@ -1002,16 +1050,16 @@ class NFS4Server(rpc.Server):
         p.pack_SEQUENCE4res(env.results[0].switch)
         digest = protect.context.hmac(p.get_buffer(), SSV4_SUBKEY_MIC_T2I)
         res = SET_SSV4resok(digest)
-        return encode_status(NFS4_OK, res)
+        return encode_set_ssv(NFS4_OK, res)
 
     def op_exchange_id(self, arg, env):
         # This implements draft21
         check_session(env, unique=True)
         # Check arguments for blatent errors
         if arg.eia_flags & ~nfs4lib.exchgid_mask:
-            return encode_status(NFS4ERR_INVAL, msg="Unknown flag")
+            return encode_exchange_id(NFS4ERR_INVAL, msg="Unknown flag")
         if arg.eia_flags & EXCHGID4_FLAG_CONFIRMED_R:
-            return encode_status(NFS4ERR_INVAL,
+            return encode_exchange_id(NFS4ERR_INVAL,
                                  msg="Client used server-only flag")
         if arg.eia_client_impl_id:
             impl_id = arg.eia_client_impl_id[0]
@@ -1034,14 +1082,14 @@ class NFS4Server(rpc.Server):
             if c is None:
                 if update:
                     # Case 7
-                    return encode_status(NFS4ERR_NOENT, msg="No such client")
+                    return encode_exchange_id(NFS4ERR_NOENT, msg="No such client")
                 else:
                     # The simple, common case 1: a new client
                     c = self.clients.add(arg, env.principal, self.sec_flavors)
             elif not c.confirmed:
                 if update:
                     # Case 7
-                    return encode_status(NFS4ERR_NOENT,
+                    return encode_exchange_id(NFS4ERR_NOENT,
                                          msg="Client not confirmed")
                 else:
                     # Case 4
@@ -1056,11 +1104,11 @@ class NFS4Server(rpc.Server):
                 if update:
                     if c.verifier != verf:
                         # Case 8
-                        return encode_status(NFS4ERR_NOT_SAME,
+                        return encode_exchange_id(NFS4ERR_NOT_SAME,
                                              msg="Verifier mismatch")
                     elif c.principal != env.principal:
                         # Case 9
-                        return encode_status(NFS4ERR_PERM,
+                        return encode_exchange_id(NFS4ERR_PERM,
                                              msg="Principal mismatch")
                     else:
                         # Case 6 - update
@@ -1068,7 +1116,7 @@ class NFS4Server(rpc.Server):
                 elif c.principal != env.principal:
                     # Case 3
                     # STUB - need to check state
-                    return encode_status(NFS4ERR_CLID_INUSE,
+                    return encode_exchange_id(NFS4ERR_CLID_INUSE,
                                          msg="Principal mismatch")
                 elif c.verifier != verf:
                     # Case 5
@@ -1103,7 +1151,7 @@ class NFS4Server(rpc.Server):
                                 c.protection.rv(arg.eia_state_protect),
                                 self.config._owner, self.config.scope,
                                 [self.config.impl_id])
-        return encode_status(NFS4_OK, res, msg="draft21")
+        return encode_exchange_id(NFS4_OK, res, msg="draft21")
 
     def client_reboot(self, c):
         # STUB - locking?
@@ -1132,20 +1180,20 @@ class NFS4Server(rpc.Server):
         # STUB XXX do size checking
         if len(env.argarray) != 1:
             # QUESTION what is correct error return here?
-            return encode_status(NFS4ERR_INVAL)
+            return encode_bind_conn_to_session(NFS4ERR_INVAL)
         session = self.sessions.get(arg.bctsa_sessid, None)
         if session is None:
-            return encode_status(NFS4ERR_BADSESSION)
+            return encode_bind_conn_to_session(NFS4ERR_BADSESSION)
         connection = env.connection
         hash_funct = session.binding # BUG - this is from draft10
         if hash_funct is None:
             # This is the easy case.  We just accept anything.
             if arg.bctsa_digest:
                 # QUESTION _INVAL or _BAD_SESSION_DIGEST also possible
-                return encode_status(NFS4ERR_CONN_BINDING_NOT_ENFORCED,
+                return encode_bind_conn_to_session(NFS4ERR_CONN_BINDING_NOT_ENFORCED,
                                      msg="Expected zero length digest")
             if arg.bctsa_step1 is False:
-                return encode_status(NFS4ERR_INVAL, msg="Expected step1==True")
+                return encode_bind_conn_to_session(NFS4ERR_INVAL, msg="Expected step1==True")
             dir = bind_to_channels(arg.bctsa_dir)
             nonce = session.get_nonce(connection, [arg.bctsa_nonce])
             # STUB this should be a session method
@@ -1159,7 +1207,7 @@ class NFS4Server(rpc.Server):
                                                            arg.bctsa_nonce, 0))
             digest = hmac.new(session.ssv, p.get_buffer(), hash_funct).digest()
             if digest != arg.bctsa_digest:
-                return encode_status(NFS4ERR_BAD_SESSION_DIGEST)
+                return encode_bind_conn_to_session(NFS4ERR_BAD_SESSION_DIGEST)
             # STUB - XXX need config so can choose not to challenge
             nonce = session.get_nonce(connection, [arg.bctsa_nonce])
             p.reset()
@@ -1174,17 +1222,17 @@ class NFS4Server(rpc.Server):
                 # STUB XXX this should be a session method
                 old_s_nonce, old_c_nonce = session.nonce[connection]
             except KeyError:
-                return encode_status(NFS4ERR_INVAL,
+                return encode_bind_conn_to_session(NFS4ERR_INVAL,
                                      msg="server has no record of step1")
             if old_c_nonce == arg.bctsa_nonce:
-                return encode_status(NFS4ERR_INVAL, msg="Client reused nonce")
+                return encode_bind_conn_to_session(NFS4ERR_INVAL, msg="Client reused nonce")
             p = nfs4lib.FancyNFS4Packer()
             p.pack_bctsr_digest_input4(bctsr_digest_input4(arg.bctsa_sessid,
                                                            arg.bctsa_nonce,
                                                            old_s_nonce))
             digest = hmac.new(session.ssv, p.get_buffer(), hash_funct).digest()
             if digest != arg.bctsa_digest:
-                return encode_status(NFS4ERR_BAD_SESSION_DIGEST)
+                return encode_bind_conn_to_session(NFS4ERR_BAD_SESSION_DIGEST)
             # Finally, actually bind the connection
             dir = bind_to_channels(arg.bctsa_dir)
             nonce = session.get_nonce(connection, [arg.bctsa_nonce])
@@ -1196,20 +1244,20 @@ class NFS4Server(rpc.Server):
             digest = hmac.new(session.ssv, p.get_buffer(), hash_funct).digest()
             res = BIND_CONN_TO_SESSION4resok(session.sessionid, False,
                                              dir, False, nonce, digest)
-        return encode_status(NFS4_OK, res)
+        return encode_bind_conn_to_session(NFS4_OK, res)
 
     def op_putrootfh(self, arg, env):
         check_session(env)
         # STUB - do WRONGSEC checking
         env.set_cfh(self.root)
-        return encode_status(NFS4_OK)
+        return encode_putrootfh(NFS4_OK)
 
     def op_secinfo_no_name(self, arg, env):
         check_session(env)
         # xxx add gss support
         secinfo4_list = [ secinfo4(rpc.AUTH_SYS) ]
         res = SECINFO_NO_NAME4res(NFS4_OK, secinfo4_list)
-        return encode_status(NFS4_OK, res)
+        return encode_secinfo_no_name(NFS4_OK, res)
 
     # op_putpubfh SHOULD be the same as op_putrootfh
     # See draft23, section 18.20.3, line 25005
@@ -1227,9 +1275,9 @@ class NFS4Server(rpc.Server):
         finally:
             env.cfh.lock.release()
         if obj is None:
-            return encode_status(NFS4ERR_NOENT)
+            return encode_lookup(NFS4ERR_NOENT)
         env.set_cfh(obj)
-        return encode_status(NFS4_OK)
+        return encode_lookup(NFS4_OK)
 
     def op_lookupp(self, arg, env):
         check_session(env)
@@ -1241,7 +1289,7 @@ class NFS4Server(rpc.Server):
         finally:
             env.cfh.lock.release()
         env.set_cfh(obj)
-        return encode_status(NFS4_OK)
+        return encode_lookupp(NFS4_OK)
 
     def op_putfh(self, arg, env):
         check_session(env)
@@ -1249,7 +1297,7 @@ class NFS4Server(rpc.Server):
         if obj.fh != arg.object:
             log_41.error("\nobj.fh = %r\nwanted fh = %r" % (obj.fh, arg.object))
         env.set_cfh(obj)
-        return encode_status(NFS4_OK)
+        return encode_putfh(NFS4_OK)
 
     def op_getfh(self, arg, env):
         check_session(env)
@@ -1257,20 +1305,20 @@ class NFS4Server(rpc.Server):
         # We don't need to grab env.cfh.lock, since .fh is static
         fh = env.cfh.fh
         res = GETFH4resok(fh)
-        return encode_status(NFS4_OK, res)
+        return encode_getfh(NFS4_OK, res)
 
     def op_savefh(self, arg, env):
         check_cfh(env)
         env.sfh = env.cfh
         env.sid = env.cid
-        return encode_status(NFS4_OK)
+        return encode_savefh(NFS4_OK)
 
     def op_restorefh(self, arg, env):
         if env.sfh is None:
             raise NFS4Error(NFS4ERR_RESTOREFH)
         env.cfh = env.sfh
         env.cid = env.sid
-        return encode_status(NFS4_OK)
+        return encode_restorefh(NFS4_OK)
 
     def op_create(self, arg, env):
         check_session(env)
@@ -1279,7 +1327,7 @@ class NFS4Server(rpc.Server):
         dir.check_dir()
         kind = arg.objtype
         if kind.type not in (NF4DIR, NF4LNK, NF4BLK, NF4CHR, NF4SOCK, NF4FIFO):
-            return encode_status(NFS4ERR_BADTYPE)
+            return encode_create(NFS4ERR_BADTYPE)
         self.check_component(arg.objname)
         if kind.type == NF4LNK:
             self.check_utf8str_cs(arg.objtype.linkdata)
@@ -1287,7 +1335,7 @@ class NFS4Server(rpc.Server):
         try:
             old_change = dir.fattr4_change
             if dir.exists(arg.objname):
-                return encode_status(NFS4ERR_EXIST)
+                return encode_create(NFS4ERR_EXIST)
             obj, bitmask = dir.create(arg.objname, env.principal, kind,
                                       arg.createattrs)
             new_change = dir.fattr4_change
@@ -1299,24 +1347,24 @@ class NFS4Server(rpc.Server):
         env.cid = nfs4lib.state00
         cinfo = change_info4(True, old_change, new_change)
         res = CREATE4resok(cinfo, bitmask)
-        return encode_status(NFS4_OK, res)
+        return encode_create(NFS4_OK, res)
 
     def op_getattr(self, arg, env):
         check_session(env)
         check_cfh(env)
         env.cfh.lock.acquire()
         try:
-            attr_dict = self.get_attributes(env.cfh, arg.attr_request)
+            attrs = self.get_fattr4(env.cfh, arg.attr_request)
         finally:
             env.cfh.lock.release()
-        return encode_status(NFS4_OK, GETATTR4resok(attr_dict))
+        return encode_getattr(NFS4_OK, GETATTR4resok(attrs))
 
     def op_write(self, arg, env):
         check_session(env)
         check_cfh(env)
         env.cfh.verify_file()
         if arg.offset + len(arg.data) > 0x3ffffffe: # STUB - arbitrary value
-            return encode_status(NFS4ERR_INVAL)
+            return encode_write(NFS4ERR_INVAL)
         with find_state(env, arg.stateid) as state:
             state.has_permission(OPEN4_SHARE_ACCESS_WRITE)
             state.mark_writing()
@@ -1327,7 +1375,7 @@ class NFS4Server(rpc.Server):
             finally:
                 state.mark_done_writing()
         res = WRITE4resok(count, how, self.verifier)
-        return encode_status(NFS4_OK, res)
+        return encode_write(NFS4_OK, res)
 
     def op_read(self, arg, env):
         check_session(env)
@@ -1344,7 +1392,7 @@ class NFS4Server(rpc.Server):
             finally:
                 state.mark_done_reading()
         res = READ4resok(eof, data)
-        return encode_status(NFS4_OK, res)
+        return encode_read(NFS4_OK, res)
 
     def op_open(self, arg, env):
         self.check_opsconfig(env, "open")
@@ -1355,7 +1403,7 @@ class NFS4Server(rpc.Server):
 
         claim_type = arg.claim.claim
         if claim_type != CLAIM_NULL and arg.openhow.opentype == OPEN4_CREATE:
-            return encode_status(NFS4ERR_INVAL,
+            return encode_open(NFS4ERR_INVAL,
                                  msg="OPEN4_CREATE not compatible with %s" %
                                  open_claim_type4[claim_type])
         # emulate switch(claim_type)
@@ -1363,11 +1411,11 @@ class NFS4Server(rpc.Server):
             func = getattr(self,
                            "open_%s" % open_claim_type4[claim_type].lower())
         except AttributeError:
-            return encode_status(NFS4ERR_NOTSUPP, msg="Unsupported claim type")
+            return encode_open(NFS4ERR_NOTSUPP, msg="Unsupported claim type")
         existing, cinfo, bitmask = func(arg, env)
         # existing now points to file we want to open
         if existing is None:
-            return encode_status(NFS4ERR_NOENT)
+            return encode_open(NFS4ERR_NOENT)
         existing.verify_file(notelink=True) # Raise _ISDIR, _SYMLINK, or _INVAL
         log_41.debug("OPEN - fh = %r" % existing.fh)
         sid, deleg, flags = self.open_file(existing, arg.owner,
@@ -1377,7 +1425,7 @@ class NFS4Server(rpc.Server):
             log_41.info("+++ client(id=%i).state = %r" %
                         (env.session.client.clientid, env.session.client.state))
         res = OPEN4resok(sid, cinfo, flags, bitmask, deleg)
-        return encode_status(NFS4_OK, res)
+        return encode_open(NFS4_OK, res)
 
     def open_claim_null(self, arg, env):
         """Simulated switch function from op_open that handles CLAIM_NULL"""
@@ -1488,13 +1536,57 @@ class NFS4Server(rpc.Server):
         return sid, deleg, 0
 
     def get_attributes(self, obj, attrs, ignore=True):
+        """Return dictionary {bitnum: value} of the attributes of obj.
+
+        attrs is a bitmap or a list of bitnums.  Unknown and write only
+        attributes are skipped.  Unsupported ones are also skipped if
+        ignore is set (GETATTR and READDIR, per 15.1); otherwise they
+        raise NFS4ERR_ATTRNOTSUPP (VERIFY and NVERIFY).
+        """
         # XXX This really should be a FSObject method, but having trouble
         # figuring how to deal with server-wide attributes.
-        if type(attrs) == int:
-            attrs = nfs4lib.bitmap2list(attrs)
+        if type(attrs) != int:
+            attrs = nfs4lib.list2bitmap(attrs)
+        fs = obj.fs
+        key = (obj.__class__, fs, fs.fattr4_supported_attrs, attrs, ignore)
+        plan = self.attr_plans.get(key)
+        if plan is None:
+            plan = self._attr_plan(obj, attrs, ignore)
+            if len(self.attr_plans) >= self.max_attr_plans:
+                self.attr_plans.clear()
+            self.attr_plans[key] = plan
         ret_dict = {}
+        for attr, get in plan:
+            try:
+                ret_dict[attr] = get(obj)
+            except AttributeError:
+                # The object does not have it after all
+                if not ignore:
+                    raise NFS4Error(NFS4ERR_ATTRNOTSUPP)
+        obj.fattr4_rdattr_error = NFS4_OK # XXX STUB Handle correctly
+        return ret_dict
+
+    def get_fattr4(self, obj, attrs):
+        """Return a fattr4 of the attributes of obj in bitmap attrs.
+
+        This is for GETATTR and READDIR, and goes through the attribute
+        cache.  The result may be shared, so must not be modified.
+        """
+        return attr_cache.get(obj, attrs, lambda:
+                    nfs4lib.dict2fattr(self.get_attributes(obj, attrs)))
+
+    def _attr_plan(self, obj, attrs, ignore):
+        """Return the plan get_attributes uses for obj and bitmap attrs.
+
+        This is a tuple of (bitnum, getter) in bitnum order, where
+        getter(obj) returns the value of the attribute.  Which attributes
+        are included depends only on the class of obj, its filesystem and
+        the filesystem's supported attributes, which is how plans are
+        cached.
+        """
+        plan = []
         info = nfs4lib.attr_info
-        for attr in attrs:
+        for attr in nfs4lib.bitmap2list(attrs):
             if attr not in info:
                 # Ignore unknown attributes
                 log_41.info("Skipping unknown attr: %s" % (attr,))
@@ -1503,16 +1595,22 @@ class NFS4Server(rpc.Server):
                 # XXX How deal with write-only attrs?
                 log_41.info("Skipping write only attr: %s" % (attr,))
                 continue
+            name = "fattr4_%s" % nfs4lib.attr_name(attr)
             # Attributes hide in different places, call the place 'base'
             if info[attr].from_fs:
                 base = obj.fs
+                get = operator.attrgetter("fs." + name)
             elif info[attr].from_serv:
                 base = self
+                get = lambda obj, get=operator.attrgetter(name): get(self)
             else:
                 base = obj
-            name = "fattr4_%s" % nfs4lib.attr_name(attr)
-            if hasattr(base, name) and (obj.fs.fattr4_supported_attrs & 1<<attr): # STUB we should be able to remove hasattr
-                ret_dict[attr] = getattr(base, name)
+                get = operator.attrgetter(name)
+            # Look for the name without calling any property
+            found = hasattr(base.__class__, name) or \
+                    name in getattr(base, "__dict__", ())
+            if found and (obj.fs.fattr4_supported_attrs & 1<<attr):
+                plan.append((attr, get))
             else:
                 if ignore:
                     # Must ignore for GETATTR (and READDIR) per 15.1
@@ -1522,8 +1620,7 @@ class NFS4Server(rpc.Server):
                     # This is for VERIFY/NVERIFY
                     log_41.info("attr NOT SUPP %s" % (name,))
                     raise NFS4Error(NFS4ERR_ATTRNOTSUPP)
-        obj.fattr4_rdattr_error = NFS4_OK # XXX STUB Handle correctly
-        return ret_dict
+        return tuple(plan)
 
     def op_access(self, arg, env):
         check_session(env)
@@ -1543,49 +1640,42 @@ class NFS4Server(rpc.Server):
             if access_funct(env.principal):
                 access |= flag
         res = ACCESS4resok(supported, access)
-        return encode_status(NFS4_OK, res)
+        return encode_access(NFS4_OK, res)
 
     def op_readdir(self, arg, env):
-        def find_size(e):
-            # Find size of xdr encoded response
-            p = nfs4lib.FancyNFS4Packer()
-            p.pack_entry4(e)
-            return len(p.get_buffer())
-
-        offset = 3 # index offset used to avoid reserved cookies
+        find_size = nfs4lib.FancyNFS4Packer().sizeof_entry4
         check_session(env)
         check_cfh(env)
         env.cfh.check_dir()
         if arg.cookie in (1, 2) or \
-               (arg.cookie==0 and arg.cookieverf != "\0" * 8):
-            return encode_status(NFS4ERR_BAD_COOKIE)
-        objlist, verifier = env.cfh.readdir(arg.cookieverf, env.session.client, env.principal) # (name, obj) pairs
+               (arg.cookie==0 and arg.cookieverf != b"\0" * 8):
+            return encode_readdir(NFS4ERR_BAD_COOKIE)
+        entries, verifier = env.cfh.readdir(arg.cookie, arg.cookieverf,
+                                            env.session.client, env.principal)
         # STUB - think through rdattr_error handling
-        if arg.cookie == 0:
-            i = 0
-        else:
-            i = arg.cookie - offset + 1
-        eof = False
+        find = env.cfh.fs.find
+        no_attrs = fattr4(0, b"")
+        eof = True
         entrylist = []
         size = 16 # Size of packing an empty list into READDIR4resok
-        while True:
-            try:
-                name, obj = objlist[i]
-            except IndexError:
-                eof = True
-                break
-            e = entry4(i+offset, name,
-                       self.get_attributes(obj, arg.attr_request), [])
+        for cookie, name, id in entries:
+            # Only look up the object if its attributes are wanted.
+            # Encode attrs now, so they are not encoded again for sizing
+            if arg.attr_request:
+                attrs = self.get_fattr4(find(id), arg.attr_request)
+            else:
+                attrs = no_attrs
+            e = entry4(cookie, name, attrs, [])
             size += find_size(e)
             if size > arg.maxcount:
                 if not entrylist:
-                    return encode_status(NFS4ERR_TOOSMALL)
+                    return encode_readdir(NFS4ERR_TOOSMALL)
+                eof = False
                 break
             entrylist.append(e)
-            i += 1
-        log_41.debug("ENTRIES: %r" % entrylist)
+        log_41.debug("ENTRIES: %r", entrylist)
         res = READDIR4resok(verifier, dirlist4(entrylist, eof))
-        return encode_status(NFS4_OK, res)
+        return encode_readdir(NFS4_OK, res)
 
     def op_setattr(self, arg, env):
         try:
@@ -1603,24 +1693,24 @@ class NFS4Server(rpc.Server):
                     bitmap = env.cfh.set_attrs(attrs, env.principal)
                 finally:
                     state.mark_done_writing()
-            return encode_status(NFS4_OK, bitmap)
+            return encode_setattr(NFS4_OK, bitmap)
         except NFS4Error as e:
             # SETATTR failure does not encode just status
-            return encode_status(e.status, e.attrs)
+            return encode_setattr(e.status, e.attrs)
 
     def op_destroy_session(self, arg, env):
         # STUB - need to deal with other threads using session
         session = self.sessions.get(arg.dsa_sessionid, None)
         if session is None:
-            return encode_status(NFS4ERR_BADSESSION)
+            return encode_destroy_session(NFS4ERR_BADSESSION)
         if session == env.session:
             # This must be last op in compound
             if env.index != len(env.argarray) - 1:
-                return encode_status(NFS4ERR_INVAL) # QUESTION - what error?
+                return encode_destroy_session(NFS4ERR_INVAL) # QUESTION - what error?
         # STUB - need to think through any locking issues
         del self.sessions[arg.dsa_sessionid]
         session.client.sessions.remove(session)
-        return encode_status(NFS4_OK)
+        return encode_destroy_session(NFS4_OK)
 
     def op_remove(self, arg, env):
         check_session(env)
@@ -1631,7 +1721,7 @@ class NFS4Server(rpc.Server):
         # BUG fs locking
         obj = dir.lookup(arg.target, env.session.client, env.principal)
         if obj is None:
-            return encode_status(NFS4ERR_NOENT)
+            return encode_remove(NFS4ERR_NOENT)
         old_change = dir.fattr4_change
         with obj.state:
             obj.state.test_share(OPEN4_SHARE_ACCESS_WRITE,
@@ -1641,7 +1731,7 @@ class NFS4Server(rpc.Server):
         dir.sync()
         cinfo = change_info4(True, old_change, new_change)
         res = REMOVE4resok(cinfo)
-        return encode_status(NFS4_OK, res)
+        return encode_remove(NFS4_OK, res)
 
     def op_close(self, arg, env):
         check_session(env)
@@ -1655,7 +1745,7 @@ class NFS4Server(rpc.Server):
                 env.cfh.layout_close_hook()
             state.close()
             id = state.get_id()
-        return encode_status(NFS4_OK, id)
+        return encode_close(NFS4_OK, id)
 
     def op_commit(self, arg, env):
         check_session(env)
@@ -1665,7 +1755,7 @@ class NFS4Server(rpc.Server):
             # BUG fs locking
             env.cfh.sync()
         res = COMMIT4resok(self.verifier)
-        return encode_status(NFS4_OK, res)
+        return encode_commit(NFS4_OK, res)
 
     def op_link(self, arg, env):
         check_session(env)
@@ -1677,22 +1767,22 @@ class NFS4Server(rpc.Server):
         env.cfh.lock.acquire_write()
         try:
             if env.cfh.exists(arg.newname):
-                return encode_status(NFS4ERR_EXIST)
+                return encode_link(NFS4ERR_EXIST)
             old_change = env.cfh.fattr4_change
             env.cfh.link(arg.newname, env.sfh, env.principal)
             new_change = env.cfh.fattr4_change
         finally:
             env.cfh.lock.release()
         res = LINK4resok(change_info4(True, old_change, new_change))
-        return encode_status(NFS4_OK, res)
+        return encode_link(NFS4_OK, res)
 
     def op_readlink(self, arg, env):
         check_session(env)
         check_cfh(env)
         if env.cfh.fattr4_type != NF4LNK:
-            return encode_status(NFS4_INVAL, msg="cfh type was %i" % i)
+            return encode_readlink(NFS4_INVAL, msg="cfh type was %i" % i)
         res = READLINK4resok(env.cfh.linkdata)
-        return encode_status(NFS4_OK, res)
+        return encode_readlink(NFS4_OK, res)
 
     def op_nverify(self, arg, env):
         check_session(env)
@@ -1703,11 +1793,11 @@ class NFS4Server(rpc.Server):
                 raise NFS4Error(NFS4ERR_INVAL)
             attrvals = self.get_attributes(env.cfh, attrreq.keys(), ignore=False)
         except NFS4Error as e:
-            return encode_status(e.code)
+            return encode_nverify(e.code)
         if attrvals == attrreq:
-            return encode_status(NFS4ERR_SAME)
+            return encode_nverify(NFS4ERR_SAME)
         else:
-            return encode_status(NFS4_OK)
+            return encode_nverify(NFS4_OK)
 
     def op_verify(self, arg, env):
         check_session(env)
@@ -1718,11 +1808,11 @@ class NFS4Server(rpc.Server):
                 raise NFS4Error(NFS4ERR_INVAL)
             attrvals = self.get_attributes(env.cfh, attrreq.keys(), ignore=False)
         except NFS4Error as e:
-            return encode_status(e.code)
+            return encode_verify(e.code)
         if attrvals != attrreq:
-            return encode_status(NFS4ERR_NOT_SAME)
+            return encode_verify(NFS4ERR_NOT_SAME)
         else:
-            return encode_status(NFS4_OK)
+            return encode_verify(NFS4_OK)
 
     def op_rename(self, arg, env):
         check_session(env)
@@ -1734,14 +1824,14 @@ class NFS4Server(rpc.Server):
         self.check_component(arg.newname)
         if not nfs4lib.test_equal(env.sfh.fattr4_fsid, env.cfh.fattr4_fsid,
                                   kind="fsid4"):
-            return encode_status(NFS4ERR_XDEV, msg="%r != %r" % (env.sfh.fattr4_fsid, env.cfh.fattr4_fsid))
+            return encode_rename(NFS4ERR_XDEV, msg="%r != %r" % (env.sfh.fattr4_fsid, env.cfh.fattr4_fsid))
         order = sorted(set([env.cfh, env.sfh])) # Used to prevent locking problems
         # BUG fs locking
         old_change_src = env.sfh.fattr4_change
         old_change_dst = env.cfh.fattr4_change
         src = env.sfh.lookup(arg.oldname, env.session.client, env.principal, follow_mount=False)
         if src is None:
-            return encode_status(NFS4ERR_NOENT)
+            return encode_rename(NFS4ERR_NOENT)
         dst = env.cfh.lookup(arg.newname, env.session.client, env.principal, follow_mount=False)
         if dst is not None:
             if dst.fattr4_fileid == src.fattr4_fileid:
@@ -1750,14 +1840,14 @@ class NFS4Server(rpc.Server):
                                                 old_change_src),
                                    change_info4(True, old_change_dst,
                                                 old_change_dst))
-                return encode_status(NFS4_OK, res)
+                return encode_rename(NFS4_OK, res)
             compatible = dst.fattr4_type == src.fattr4_type
             if dst.isdir and not dst.isempty:
                 # BUG there is a race here, since we don't have any
                 # lock on dst
                 compatible = False
             if not compatible:
-                return encode_status(NFS4ERR_EXIST)
+                return encode_rename(NFS4ERR_EXIST)
             with dst.state:
                 dst.state.test_share(OPEN4_SHARE_ACCESS_WRITE,
                                      error=NFS4ERR_FILE_OPEN)
@@ -1770,7 +1860,7 @@ class NFS4Server(rpc.Server):
         new_change_dst = env.cfh.fattr4_change
         res = RENAME4resok(change_info4(True, old_change_src, new_change_src),
                            change_info4(True, old_change_dst, new_change_dst))
-        return encode_status(NFS4_OK, res)
+        return encode_rename(NFS4_OK, res)
 
     def _getlockend(self, offset, length):
         if length == 0:
@@ -1807,9 +1897,9 @@ class NFS4Server(rpc.Server):
                     state.add_lock(arg.locktype, arg.offset, end)
                     stateid = state.get_id()
         except NFS4Error as e:
-            return encode_status(e.status, denied=e.lock_denied)
+            return encode_lock(e.status, denied=e.lock_denied)
         l4resok = LOCK4resok(stateid)
-        return encode_status(NFS4_OK, l4resok)
+        return encode_lock(NFS4_OK, l4resok)
 
     def op_lockt(self, arg, env):
         check_session(env)
@@ -1821,8 +1911,8 @@ class NFS4Server(rpc.Server):
                 env.cfh.state.test_lock(env.session.client, arg.owner.owner,
                                         arg.locktype, arg.offset, end)
         except NFS4Error as e:
-            return encode_status(e.status, denied=e.lock_denied)
-        return encode_status(NFS4_OK)
+            return encode_lockt(e.status, denied=e.lock_denied)
+        return encode_lockt(NFS4_OK)
 
     def op_locku(self, arg, env):
         check_session(env)
@@ -1832,7 +1922,7 @@ class NFS4Server(rpc.Server):
         with find_state(env, arg.lock_stateid, allow_0=False) as state:
             state.remove_lock(arg.locktype, arg.offset, end)
             stateid = state.get_id()
-        return encode_status(NFS4_OK, stateid)
+        return encode_locku(NFS4_OK, stateid)
 
     def op_delegreturn(self, arg, env):
         self.check_opsconfig(env, "delegreturn")
@@ -1840,13 +1930,13 @@ class NFS4Server(rpc.Server):
         check_cfh(env)
         with find_state(env, arg.deleg_stateid, allow_0=False) as state:
             state.delegreturn()
-        return encode_status(NFS4_OK)
+        return encode_delegreturn(NFS4_OK)
 
     def op_getdevicelist(self, arg, env): # STUB
         check_session(env)
         check_cfh(env)
         if arg.gdla_maxdevices == 0:
-            return encode_status(NFS4ERR_INVAL)
+            return encode_getdevicelist(NFS4ERR_INVAL)
         fs = env.cfh.fs
         # STUB Deal with whole cookie thing
         kind = arg.gdla_layout_type
@@ -1865,14 +1955,14 @@ class NFS4Server(rpc.Server):
         res = GETDEVICELIST4resok(new_cookie, new_verf,
                                   [dev.devid for dev in slice],
                                   new_cookie >= len(list))
-        return encode_status(NFS4_OK, res)
+        return encode_getdevicelist(NFS4_OK, res)
 
     def op_getdeviceinfo(self, arg, env): # STUB
         # STUB - ignoring notifications
         check_session(env)
         device = self.find_device(arg.gdia_device_id, arg.gdia_layout_type)
         if device is None:
-            return encode_status(NFS4ERR_NOENT)
+            return encode_getdeviceinfo(NFS4ERR_NOENT)
         maxcount = arg.gdia_maxcount
         body = (device.address_body if maxcount else "")
         address = device_addr4(arg.gdia_layout_type, body)
@@ -1882,19 +1972,19 @@ class NFS4Server(rpc.Server):
             p.pack_device_addr4(address)
             buflen = len(p.get_buffer())
             if buflen > maxcount:
-                return encode_status(NFS4ERR_TOOSMALL, gdir_mincount = buflen)
+                return encode_getdeviceinfo(NFS4ERR_TOOSMALL, gdir_mincount = buflen)
         res = GETDEVICEINFO4resok(address, 0)
-        return encode_status(NFS4_OK, res)
+        return encode_getdeviceinfo(NFS4_OK, res)
 
     def op_layoutget(self, arg, env): # STUB
         try:
             check_session(env)
             check_cfh(env)
             if arg.loga_length == 0:
-                return encode_status(NFS4_INVAL, msg="length == 0")
+                return encode_layoutget(NFS4_INVAL, msg="length == 0")
             if arg.loga_length != 0xffffffffffffffff:
                 if arg.loga_length + arg.loga_offset > 0xffffffffffffffff:
-                     return encode_status(NFS4_INVAL, msg="offset+length too big")
+                     return encode_layoutget(NFS4_INVAL, msg="offset+length too big")
             if not env.session.has_backchannel:
                 raise NFS4Error(NFS4ERR_LAYOUTTRYLATER)
             # STUB do state locking and check on iomode,offset,length triple
@@ -1903,11 +1993,11 @@ class NFS4Server(rpc.Server):
                 # STUB at some point make the decision below dynamic
                 return_on_close = False
                 res = LAYOUTGET4resok(return_on_close, entry.get_id(), [layout])
-                return encode_status(NFS4_OK, res)
+                return encode_layoutget(NFS4_OK, res)
         except NFS4Error as e:
             # LAYOUTGET failure does not encode just status
             if e.status == NFS4ERR_LAYOUTTRYLATER:
-                return encode_status(e.status, None, False)
+                return encode_layoutget(e.status, None, False)
             raise
 
     def op_layoutcommit(self, arg, env): # STUB
@@ -1919,7 +2009,7 @@ class NFS4Server(rpc.Server):
         else:
             new_size = newsize4(True, size)
         res = LAYOUTCOMMIT4resok(new_size)
-        return encode_status(NFS4_OK, res)
+        return encode_layoutcommit(NFS4_OK, res)
 
     def op_layoutreturn(self, arg, env): # STUB
         # This just returns OK
@@ -1930,10 +2020,10 @@ class NFS4Server(rpc.Server):
             state = layoutreturn_stateid(True, arg.lrf_stateid)
         else:
             state = layoutreturn_stateid(False)
-        return encode_status(NFS4_OK, state)
+        return encode_layoutreturn(NFS4_OK, state)
 
     def op_illegal(self, arg, env):
-        return encode_status(NFS4ERR_OP_ILLEGAL)
+        return encode_illegal(NFS4ERR_OP_ILLEGAL)
 
     def ctrl_reset(self, arg):
         self.recording.reset()
@@ -1975,10 +2065,10 @@ class NFS4Server(rpc.Server):
         return xdrdef.sctrl_const.CTRLSTAT_ILLEGAL, xdrdef.sctrl_type.resdata_t(arg.ctrlop)
 
     def op_setclientid(self, arg, env):
-        return encode_status(NFS4ERR_NOTSUPP)
+        return encode_setclientid(NFS4ERR_NOTSUPP)
 
     def op_setclientid_confirm(self, arg, env):
-        return encode_status(NFS4ERR_NOTSUPP)
+        return encode_setclientid_confirm(NFS4ERR_NOTSUPP)
 
     def fh2obj(self, fh):
         """Given a fh, find the appropriate FSObject"""
@@ -1997,6 +2087,17 @@ class NFS4Server(rpc.Server):
     def fsid2fs(self, fsid):
         return self._fsids[fsid]
 
+    def set_max_inodes(self, count):
+        """Limit the inode table of each fs which can evict, see
+        fs.set_max_ids"""
+        for fs in list(self._fsids.values()):
+            fs.set_max_ids(count)
+
+    def inode_stats(self):
+        """Return the inode table statistics of each fs, see fs.id_stats"""
+        return dict(("%i.%i" % fsid, fs.id_stats())
+                    for fsid, fs in list(self._fsids.items()))
+
     def cb_compound_async(self, args, prog, credinfo=None, pipe=None, tag=None):
         if tag is None:
             tag = "Default callback tag"
@@ -2095,11 +2196,39 @@ def scan_options():
                  help="File used to determine dataserver addresses")
     p.add_option("--port", type="int", default=2049,
                  help="Set port to listen on (2049)")
+    p.add_option("--aio", action="store_true", default=False,
+                 help="Run connections from an asyncio event loop")
+    p.add_option("--workers", type="int", default=16,
+                 help="Number of RPC dispatch threads, "
+                 "0 uses a thread per request (16)")
+    p.add_option("--queue", type="int", default=1024,
+                 help="Number of RPC requests that may wait for "
+                 "a dispatch thread (1024)")
+    p.add_option("--drc", action="store_true", default=False,
+                 help="Answer retransmitted control calls from a "
+                 "duplicate request cache")
+    p.add_option("--attr_cache", type="int", default=0, metavar="BYTES",
+                 help="Keep up to BYTES of encoded GETATTR and READDIR "
+                 "attributes, 0 to turn off (0)")
+    p.add_option("--attr_ttl", type="float", default=0, metavar="SECONDS",
+                 help="How long cached attributes such as space_free, "
+                 "which change on their own, may be used.  With 0, "
+                 "requests for them are not cached (0)")
+    p.add_option("--max_inodes", type="int", default=0, metavar="COUNT",
+                 help="Keep about COUNT objects per filesystem in memory, "
+                 "evicting idle ones where the filesystem allows it, "
+                 "0 for no limit (0)")
 
     g = OptionGroup(p, "Debug options",
                     "These affect information collected and printed.")
     g.add_option("--debug_locks", action="store_true", default=False,
                  help="Threads track locks and their state")
+    g.add_option("--stats", type="int", default=0, metavar="SECONDS",
+                 help="Collect per procedure RPC statistics, "
+                 "and dump them every SECONDS")
+    g.add_option("--stats_file", default=None, metavar="FILE",
+                 help="Dump RPC statistics to FILE as JSON, "
+                 "instead of to the log")
     p.add_option_group(g)
 
     opts, args = p.parse_args()
@@ -2116,9 +2245,24 @@ if __name__ == "__main__":
                    is_mds=opts.use_block or opts.use_files,
                    is_ds = opts.is_ds,
                    verbose = opts.verbose,
-                   show_summary = opts.show_summary)
+                   show_summary = opts.show_summary,
+                   dispatch_workers = opts.workers,
+                   dispatch_queue = opts.queue,
+                   drc = opts.drc)
     read_exports(S, opts)
-    if True:
+    S.set_max_inodes(opts.max_inodes)
+    attr_cache.max_bytes = opts.attr_cache
+    attr_cache.ttl = opts.attr_ttl
+    if opts.attr_cache:
+        S.stats.extra["attr_cache"] = attr_cache.snapshot
+    if opts.max_inodes:
+        S.stats.extra["inodes"] = S.inode_stats
+    if opts.stats:
+        S.stats.start_dump(opts.stats, opts.stats_file)
+    if opts.aio:
+        from rpc.aio import Engine
+        Engine(S).start()
+    elif True:
         S.start()
     else:
         import profile
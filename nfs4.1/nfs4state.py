@@ -1,6 +1,7 @@
 from __future__ import with_statement
 from contextlib import contextmanager
 import threading
+import weakref
 from locking import Lock
 import struct
 import nfs4lib
@@ -232,7 +233,10 @@ class FileStateTyped(object):
     the structure is in use.
     """
     def __init__(self, file, lock, depth):
-        self.file = file
+        # The file holds its FileState, so only refer back weakly.
+        # Entries handed to clients hold the file, see grab_entry.
+        self.file = weakref.proxy(file)
+        self._file = weakref.ref(file)
         self.lock = lock # Shared lock from FileState, passed to leaves
         self._tree = DictTree(depth)
 
@@ -262,6 +266,7 @@ class FileStateTyped(object):
             client = key[0]
             other = self.get_new_other(client)
             entry = klass(other, self, key)
+            entry.file = self._file() # Keep file in memory while in use
             self._tree[key] = entry
             client.state[other] = entry
         return entry
@@ -469,7 +474,7 @@ class FileState(object):
     """Holds all state for a file."""
     def __init__(self, file):
         self.lock = lock = Lock("StateLock_%i" % file.id)
-        self.file = file
+        self.file = weakref.proxy(file) # See FileStateTyped
         self.types = (ShareState(file, lock), ByteState(file, lock),
                       DelegState(file, lock), LayoutState(file, lock),
                       AnonState(file, lock))
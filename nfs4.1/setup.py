@@ -36,20 +36,11 @@ class build_py(_build_py):
         xdrdir = os.path.join(cwd, dir, 'xdrdef')
         print("xdrdir = %r" % xdrdir)
         if os.path.exists(xdrdir):
-            try:
-                os.chdir(xdrdir)
-                xdr_files = glob(os.path.join(xdrdir, "*.x"))
-                for f in xdr_files:
-                    # Can conditionalize this
-                    # XXX need some way to pass options here
-                    xdrgen.run(f)
-                    try:
-                        os.remove("parser.out")
-                        os.remove("parsetab.py")
-                    except:
-                        print("Remove parse* failed")
-            finally:
-                os.chdir(cwd)
+            xdr_files = glob(os.path.join(xdrdir, "*.x"))
+            # Files are only regenerated if they or xdrgen changed
+            # XXX need some way to pass options here
+            if xdrgen.run_many(xdr_files):
+                raise RuntimeError("xdrgen failed in %s" % xdrdir)
 
 setup(name = "nfs4",
       version = "0.0.0", # import this?
@@ -74,6 +74,9 @@ def scan_options(p):
                  help="Store test results in xml format [%default]")
     p.add_option("--debug_fail", action="store_true", default=False,
                  help="Force some checks to fail")
+    p.add_option("--rpcstats", default=None, metavar="FILE",
+                 help="Store per procedure RPC statistics in JSON format "
+                 "[%default]")
     p.add_option("--minorversion", type="int", default=1,
                  metavar="MINORVERSION", help="Choose NFSv4 minor version")
 
@@ -330,6 +333,8 @@ def main():
     # Run the tests and save/print(results)
     try:
         env = environment.Environment(opt)
+        if opt.rpcstats is not None:
+            env.c1.stats.enable()
         env.init()
     except socket.gaierror as e:
         if e.args[0] == -2:
@@ -367,6 +372,9 @@ def main():
     if fail:
         print("\nWARNING: could not clean testdir due to:\n%s\n" % err)
 
+    if opt.rpcstats is not None:
+        env.c1.stats.dump(opt.rpcstats)
+
     if opt.jsonout is not None:
         testmod.json_printresults(tests, opt.jsonout)
     elif opt.xmlout is not None:
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# xdrbench.py - time XDR encoding and decoding of typical NFSv4.1 traffic
+#
+# Each case is a full RPC record: the RPC header, packed and unpacked with
+# rpc.FancyRPCPacker/Unpacker, followed by a COMPOUND (or CB_COMPOUND)
+# body, packed and unpacked with nfs4lib.FancyNFS4Packer/Unpacker, just
+# as the client and server do.  The generated code in xdrdef is used, so
+# rebuild it (setup.py build) after changing the generator.
+#
+# Results can be saved with --json, and a saved run given to --baseline
+# to show how a change to the generator compares.
+
+import use_local # HACK so don't have to rebuild constantly
+import sys
+import gc
+import json
+import platform
+import time
+import tracemalloc
+from optparse import OptionParser
+
+import rpc.rpc as rpc
+from rpc.rpc_const import CALL, REPLY, MSG_ACCEPTED, SUCCESS, AUTH_NONE
+from rpc.rpc_type import opaque_auth, rpc_msg, rpc_msg_body, call_body, \
+     reply_body, accepted_reply, rpc_reply_data
+import nfs4lib
+from nfs4lib import FancyNFS4Packer, FancyNFS4Unpacker
+import nfs_ops
+from xdrdef.nfs4_const import *
+from xdrdef.nfs4_type import *
+
+op4 = nfs_ops.NFS4ops()
+
+NFS4_PROGRAM = 100003
+CB_PROGRAM = 0x40000000
+NULL_AUTH = opaque_auth(AUTH_NONE, b'')
+
+sessionid = b"\x01" * 16
+stateid = stateid4(1, b"\x02" * 12)
+fh = b"\x03" * 32
+
+def seq_res():
+    return nfs_resop4(OP_SEQUENCE, opsequence=SEQUENCE4res(NFS4_OK,
+                      SEQUENCE4resok(sessionid, 1, 0, 63, 63, 0)))
+
+def putfh_res():
+    return nfs_resop4(OP_PUTFH, opputfh=PUTFH4res(NFS4_OK))
+
+def file_attrs(fileid):
+    """Return the attributes a linux client asks for in a GETATTR"""
+    t = nfstime4(1700000000, 123456789)
+    return {
+        FATTR4_SUPPORTED_ATTRS: 0x00b0be3f80fff,
+        FATTR4_TYPE: NF4REG,
+        FATTR4_FH_EXPIRE_TYPE: FH4_PERSISTENT,
+        FATTR4_CHANGE: 0x1234567812345678,
+        FATTR4_SIZE: 1 << 20,
+        FATTR4_LINK_SUPPORT: True,
+        FATTR4_SYMLINK_SUPPORT: True,
+        FATTR4_NAMED_ATTR: False,
+        FATTR4_FSID: fsid4(2, 1),
+        FATTR4_UNIQUE_HANDLES: False,
+        FATTR4_LEASE_TIME: 90,
+        FATTR4_RDATTR_ERROR: NFS4_OK,
+        FATTR4_FILEHANDLE: fh,
+        FATTR4_FILEID: fileid,
+        FATTR4_MAXNAME: 255,
+        FATTR4_MODE: 0o644,
+        FATTR4_NUMLINKS: 1,
+        FATTR4_OWNER: b"nobody@example.com",
+        FATTR4_OWNER_GROUP: b"nogroup@example.com",
+        FATTR4_RAWDEV: specdata4(0, 0),
+        FATTR4_SPACE_USED: 1 << 20,
+        FATTR4_TIME_ACCESS: t,
+        FATTR4_TIME_METADATA: t,
+        FATTR4_TIME_MODIFY: t,
+        FATTR4_MOUNTED_ON_FILEID: fileid,
+        }
+
+def case_read():
+    args = [op4.sequence(sessionid, 1, 0, 0, False),
+            op4.putfh(fh),
+            op4.read(stateid, 0, 1 << 20)]
+    res = [seq_res(), putfh_res(),
+           nfs_resop4(OP_READ, opread=READ4res(NFS4_OK,
+                      READ4resok(False, b"\xab" * (1 << 20))))]
+    return args, res
+
+def case_getattr():
+    attrs = file_attrs(42)
+    args = [op4.sequence(sessionid, 1, 0, 0, False),
+            op4.putfh(fh),
+            op4.getattr(nfs4lib.list2bitmap(attrs))]
+    res = [seq_res(), putfh_res(),
+           nfs_resop4(OP_GETATTR, opgetattr=GETATTR4res(NFS4_OK,
+                      GETATTR4resok(attrs)))]
+    return args, res
+
+def case_readdir():
+    mask = nfs4lib.list2bitmap([FATTR4_TYPE, FATTR4_FILEID,
+                                FATTR4_MOUNTED_ON_FILEID])
+    entries = [entry4(i + 3, ("file%04i" % i).encode(),
+                      {FATTR4_TYPE: NF4REG, FATTR4_FILEID: i + 100,
+                       FATTR4_MOUNTED_ON_FILEID: i + 100})
+               for i in range(1000)]
+    args = [op4.sequence(sessionid, 1, 0, 0, False),
+            op4.putfh(fh),
+            op4.readdir(0, b"\0" * 8, 1 << 16, 1 << 20, mask)]
+    res = [seq_res(), putfh_res(),
+           nfs_resop4(OP_READDIR, opreaddir=READDIR4res(NFS4_OK,
+                      READDIR4resok(b"\0" * 8, dirlist4(entries, True))))]
+    return args, res
+
+def case_open():
+    attrs = {FATTR4_MODE: 0o644, FATTR4_SIZE: 0}
+    how = openflag4(OPEN4_CREATE, createhow4(GUARDED4, createattrs=attrs))
+    claim = open_claim4(CLAIM_NULL, file=b"newfile")
+    args = [op4.sequence(sessionid, 1, 0, 0, False),
+            op4.putfh(fh),
+            op4.open(0, OPEN4_SHARE_ACCESS_BOTH, OPEN4_SHARE_DENY_NONE,
+                     open_owner4(0x1234, b"bench owner"), how, claim),
+            op4.getfh()]
+    resok = OPEN4resok(stateid, change_info4(True, 1, 2),
+                       OPEN4_RESULT_LOCKTYPE_POSIX,
+                       nfs4lib.list2bitmap(attrs),
+                       open_delegation4(OPEN_DELEGATE_NONE))
+    res = [seq_res(), putfh_res(),
+           nfs_resop4(OP_OPEN, opopen=OPEN4res(NFS4_OK, resok)),
+           nfs_resop4(OP_GETFH, opgetfh=GETFH4res(NFS4_OK,
+                      GETFH4resok(fh)))]
+    return args, res
+
+def case_cb_recall():
+    args = [op4.cb_sequence(sessionid, 1, 0, 0, False, []),
+            op4.cb_recall(stateid, False, fh)]
+    res = [nfs_cb_resop4(OP_CB_SEQUENCE, opcbsequence=CB_SEQUENCE4res(
+               NFS4_OK, CB_SEQUENCE4resok(sessionid, 1, 0, 0, 0))),
+           nfs_cb_resop4(OP_CB_RECALL, opcbrecall=CB_RECALL4res(NFS4_OK))]
+    return args, res
+
+# (name, case function, callback?)
+cases = [
+    ("read_1m", case_read, False),
+    ("getattr_full", case_getattr, False),
+    ("readdir_1k", case_readdir, False),
+    ("open_create", case_open, False),
+    ("cb_recall", case_cb_recall, True),
+    ]
+
+class Message(object):
+    """One direction of a case: a header and a body to pack and unpack."""
+    def __init__(self, name, header, kind, body, zerocopy):
+        self.name = name
+        self.header = header
+        self.kind = kind # For example "COMPOUND4args"
+        self.body = body
+        self.zerocopy = zerocopy
+        self.pack_body = getattr(FancyNFS4Packer, "pack_" + kind)
+        self.unpack_body = getattr(FancyNFS4Unpacker, "unpack_" + kind)
+        self.record = self.pack()
+
+    def pack(self):
+        p = rpc.FancyRPCPacker()
+        p.pack_rpc_msg(self.header)
+        header = p.get_buffer()
+        p = FancyNFS4Packer()
+        self.pack_body(p, self.body)
+        return header + p.get_buffer()
+
+    def unpack(self):
+        record = self.record
+        p = rpc.FancyRPCUnpacker(record)
+        msg = p.unpack_rpc_msg()
+        pos = p.get_position()
+        if self.zerocopy:
+            p = FancyNFS4Unpacker(memoryview(record)[pos:])
+            p.zerocopy = NFS4_OPAQUE_LIMIT + 1
+        else:
+            p = FancyNFS4Unpacker(record[pos:])
+        body = self.unpack_body(p)
+        p.done()
+        return msg, body
+
+def messages(name, fn, callback, zerocopy=False):
+    """Return the call and reply Messages for a case"""
+    args, res = fn()
+    if callback:
+        prog, kinds = CB_PROGRAM, ("CB_COMPOUND4args", "CB_COMPOUND4res")
+        call = CB_COMPOUND4args(b"", 1, 0, args)
+        reply = CB_COMPOUND4res(NFS4_OK, b"", res)
+    else:
+        prog, kinds = NFS4_PROGRAM, ("COMPOUND4args", "COMPOUND4res")
+        call = COMPOUND4args(b"", 1, args)
+        reply = COMPOUND4res(NFS4_OK, b"", res)
+    cbody = call_body(2, prog, 1 if callback else 4, 1, NULL_AUTH, NULL_AUTH)
+    chead = rpc_msg(1, rpc_msg_body(CALL, cbody))
+    rbody = reply_body(MSG_ACCEPTED, areply=accepted_reply(NULL_AUTH,
+                       rpc_reply_data(SUCCESS, b'')))
+    rhead = rpc_msg(1, rpc_msg_body(REPLY, rbody=rbody))
+    return [Message(name + ".call", chead, kinds[0], call, zerocopy),
+            Message(name + ".reply", rhead, kinds[1], reply, zerocopy)]
+
+def timeit(func, min_time, repeat):
+    """Return the best time in seconds for one call of func.
+
+    The number of calls per timing is chosen so that each takes at
+    least min_time seconds; the best of repeat timings is used.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+    best = elapsed
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / loops
+
+def allocations(func):
+    """Return (blocks, peak) for one call of func.
+
+    blocks is the number of memory blocks still allocated by the call
+    once it returns (what its result holds on to), and peak is the
+    highest number of bytes allocated at any one time during the call.
+    """
+    func() # Warm up any caches
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        blocks = sys.getallocatedblocks() - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return blocks, peak
+
+def run(names=None, min_time=0.2, repeat=5, zerocopy=False):
+    """Return results, a dictionary {"<case>.<call|reply>.<pack|unpack>":
+    {"bytes", "ops_per_sec", "mb_per_sec", "alloc_blocks", "alloc_peak"}}
+    """
+    results = {}
+    for name, fn, callback in cases:
+        if names and name not in names:
+            continue
+        for msg in messages(name, fn, callback, zerocopy):
+            size = len(msg.record)
+            for what, func in (("pack", msg.pack), ("unpack", msg.unpack)):
+                t = timeit(func, min_time, repeat)
+                blocks, peak = allocations(func)
+                results["%s.%s" % (msg.name, what)] = {
+                    "bytes": size,
+                    "ops_per_sec": 1.0 / t,
+                    "mb_per_sec": size / t / 1e6,
+                    "alloc_blocks": blocks,
+                    "alloc_peak": peak,
+                    }
+    return results
+
+def show(results, baseline=None):
+    line = "%-28s %9s %12s %10s %8s %10s"
+    print(line % ("test", "bytes", "ops/sec", "MB/s", "blocks", "peak"))
+    for key, r in results.items():
+        print(line % (key, r["bytes"], "%.1f" % r["ops_per_sec"],
+                      "%.1f" % r["mb_per_sec"], r["alloc_blocks"],
+                      r["alloc_peak"]), end="")
+        old = baseline.get(key) if baseline else None
+        if old:
+            print("  %+.1f%%" % (100.0 * r["ops_per_sec"] / old["ops_per_sec"]
+                                 - 100.0), end="")
+        print()
+
+def scan_options(p):
+    p.add_option("--json", metavar="FILE",
+                 help="Also write results to FILE as JSON")
+    p.add_option("--baseline", metavar="FILE",
+                 help="Compare ops/sec with the results saved in FILE")
+    p.add_option("--case", action="append", default=[],
+                 help="Run only the given case (may be repeated): %s" %
+                 ", ".join([c[0] for c in cases]))
+    p.add_option("--time", type="float", default=0.2,
+                 help="Minimum time in seconds for each timing [0.2]")
+    p.add_option("--repeat", type="int", default=5,
+                 help="Number of timings to take the best of [5]")
+    p.add_option("--zerocopy", action="store_true", default=False,
+                 help="Unpack large opaques as memoryviews, as the server does")
+    return p.parse_args()
+
+def main():
+    p = OptionParser("%prog [options]")
+    opts, args = scan_options(p)
+    if args:
+        p.error("Unexpected arguments %r" % args)
+    known = [c[0] for c in cases]
+    for name in opts.case:
+        if name not in known:
+            p.error("Unknown case %r" % name)
+    baseline = None
+    if opts.baseline:
+        with open(opts.baseline) as fd:
+            baseline = json.load(fd)["results"]
+    results = run(opts.case, opts.time, opts.repeat, opts.zerocopy)
+    show(results, baseline)
+    if opts.json:
+        doc = {"python": platform.python_version(),
+               "implementation": platform.python_implementation(),
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "options": {"time": opts.time, "repeat": opts.repeat,
+                           "zerocopy": opts.zerocopy},
+               "results": results}
+        with open(opts.json, "w") as fd:
+            json.dump(doc, fd, indent=1)
+
+if __name__ == "__main__":
+    main()
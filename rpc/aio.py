@@ -0,0 +1,387 @@
+"""asyncio engine for the rpc module.
+
+The threaded ConnectionHandler ties up a thread for every call that is
+waiting on a reply.  An Engine instead drives the connections of a
+ConnectionHandler (an rpc.Server, rpc.Client, or a subclass such as
+NFS4Server or NFS4Client) from an asyncio event loop, so that a single
+thread can keep tens of thousands of calls outstanding.
+
+Record marking, xid handling, security flavors, and the handle_<proc>
+lookup are all shared with the threaded code.  Incoming calls whose
+handler is a coroutine function are awaited in the loop.  Other handlers
+are run by handler.dispatch, exactly as the threaded code would run them.
+
+A client does:
+        engine = Engine(client)
+        engine.start_thread()
+        pipe = engine.run(engine.connect(address))
+and then, from coroutines running in engine.loop:
+        header, data = await engine.call(pipe, procedure, data)
+The returned pipe also supports the blocking pipe.listen(xid) used by
+threaded code, so existing callers keep working.
+
+A server just does:
+        Engine(server).start()
+in place of server.start().
+"""
+from __future__ import absolute_import
+
+import asyncio
+import threading
+import logging
+from collections import deque as Deque
+
+import rpc.rpc as rpc
+import rpc.rpc_pack as rpc_pack
+from rpc_const import *
+import rpclib
+
+log_p = logging.getLogger("rpc.aio.poll") # event loop
+log_t = logging.getLogger("rpc.aio.thread") # handler threads
+
+def _set_future(future, result=None, exception=None):
+    """Complete future, unless it was cancelled or timed out already"""
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+class Deferred(object):
+    """The asyncio counterpart of rpc.DeferredData.
+
+    It is filled in from the event loop, and waited on through its future.
+    """
+    def __init__(self, loop, msg=None):
+        self.future = loop.create_future()
+        self.data = None
+        self.msg = msg # Data that thread calling fill might need
+
+    def fill(self, data=None, exception=None):
+        self.data = data
+        _set_future(self.future, data, exception)
+
+class RpcProtocol(rpc.RecordStream, rpc.RpcEndpoint, asyncio.BufferedProtocol):
+    """An asyncio connection, with the same interface as rpc.RpcPipe.
+
+    send_call, send_reply and listen may be called from any thread
+    except the one running the event loop.  From within the loop, use
+    send_call and alisten.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.loop = engine.loop
+        self.transport = None
+        self._s = None
+        self.wsize = engine.handler.wsize # Max size of packets we send
+        self.stats = engine.handler.stats
+        self.max_record = engine.handler.max_record
+        self._init_record_stream()
+        self._init_endpoint()
+        self.clear_active() # Until connection_made
+
+    def __getattr__(self, attr):
+        """Show socket interface"""
+        s = self.__dict__.get("_s")
+        if s is None:
+            raise AttributeError(attr)
+        return getattr(s, attr)
+
+    def __str__(self):
+        return "aiopipe-%i" % self._s.fileno()
+
+    def _deferred(self, msg):
+        return Deferred(self.loop, msg)
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    # asyncio.BufferedProtocol interface
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._s = transport.get_extra_info("socket")
+        self.set_active()
+        self.engine.pipes.add(self)
+        log_p.info("got connection %s from %s" %
+                   (self, transport.get_extra_info("peername")))
+
+    def get_buffer(self, sizehint):
+        self._reserve(max(sizehint, self.engine.handler.rsize))
+        return memoryview(self._read_buf)[self._read_end:]
+
+    def buffer_updated(self, nbytes):
+        for record in self._parse_records(nbytes):
+            self.engine._rpc_record(record, self)
+
+    def connection_lost(self, exc):
+        log_p.info("Closing %s" % self)
+        self.clear_active()
+        self.engine.pipes.discard(self)
+        for deferred in list(self._pending.values()):
+            deferred.fill(None, rpc.RPCError("Connection lost"))
+
+    # rpc.RpcEndpoint interface
+
+    def push_record(self, record, done=None):
+        """Send record.  This may be called from any thread.
+
+        If done is given, it is called once the transport has taken the
+        record.  (asyncio does not tell us when the socket write happens.)
+        """
+        if self._in_loop():
+            self._write(record, done)
+        else:
+            self.loop.call_soon_threadsafe(self._write, record, done)
+
+    def _write(self, record, done=None):
+        if self.transport is None or self.transport.is_closing():
+            log_p.warn("Dropping record sent on closed %s" % self)
+            return
+        self.transport.writelines(self._mark_record(record, self.wsize))
+        if done is not None:
+            done()
+
+    async def alisten(self, xid, timeout=None):
+        """Wait for a reply to a CALL, from within the event loop."""
+        deferred = self._pending[xid]
+        try:
+            return await asyncio.wait_for(deferred.future, timeout)
+        except asyncio.TimeoutError:
+            raise rpc.RPCTimeout
+        finally:
+            del self._pending[xid]
+
+    def listen(self, xid, timeout=None):
+        """Wait for a reply to a CALL, from outside the event loop."""
+        f = asyncio.run_coroutine_threadsafe(self.alisten(xid, timeout),
+                                             self.loop)
+        with rpc.blocking():
+            return f.result()
+
+    def future(self, xid):
+        """Return a concurrent.futures.Future for the reply to a CALL.
+
+        Its result is what listen(xid) would return.  Use this instead
+        of listen(xid), not as well as it.
+        """
+        return asyncio.run_coroutine_threadsafe(self.alisten(xid), self.loop)
+
+    def close(self):
+        if self.transport is not None:
+            self.loop.call_soon_threadsafe(self.transport.close)
+
+class Engine(object):
+    """Runs the connections of handler from an asyncio event loop.
+
+    handler is an rpc.ConnectionHandler, whose _prepare_call, _make_reply
+    and handle_* methods deal with incoming calls.
+    """
+    def __init__(self, handler, loop=None):
+        self.handler = handler
+        if loop is None:
+            loop = asyncio.new_event_loop()
+        self.loop = loop
+        self.pipes = set() # Open connections
+        self._servers = [] # asyncio Servers created by self.serve
+        self._tasks = set() # Calls being handled
+        # Work refused by handler.dispatch because its queue was full, as
+        # a Deque of functions, and the pipes paused until it is taken.
+        self._held = Deque()
+        self._paused = set()
+        self._want_room = False # Have asked dispatch to call _dispatch_room
+
+    def start(self):
+        """Serve the handler's listening sockets, in the calling thread."""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.serve())
+        try:
+            self.loop.run_forever()
+        finally:
+            for server in self._servers:
+                server.close()
+
+    def start_thread(self):
+        """Run the event loop in a new thread."""
+        t = threading.Thread(target=self.loop.run_forever,
+                             name="AsyncPollingThread")
+        t.setDaemon(True)
+        t.start()
+        return t
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def run(self, coro, timeout=None):
+        """Run coro in the event loop from another thread, returning result"""
+        f = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return f.result(timeout)
+
+    async def serve(self, sockets=None):
+        """Accept connections on the given listening sockets.
+
+        The default is to use those set up by handler.expose().
+        """
+        if sockets is None:
+            h = self.handler
+            sockets = [h.sockets[fd] for fd in h.listeners]
+        for s in sockets:
+            server = await self.loop.create_server(lambda: RpcProtocol(self),
+                                                   sock=s)
+            self._servers.append(server)
+
+    async def connect(self, address, secure=False):
+        """Connect to given address, returning new pipe"""
+        log_p.info("Called connect(%r)" % (address,))
+        s = await self.loop.run_in_executor(None, self.handler._connect_socket,
+                                            address, secure)
+        transport, pipe = await self.loop.create_connection(
+            lambda: RpcProtocol(self), sock=s)
+        return pipe
+
+    async def call(self, pipe, procedure, data=b'', credinfo=None,
+                   program=None, version=None, timeout=None):
+        """Send a CALL using handler.send_call, and wait for the reply.
+
+        Returns (header, data), as pipe.listen does.
+        """
+        xid = self.handler.send_call(pipe, procedure, data, credinfo,
+                                     program, version)
+        return await pipe.alisten(xid, timeout)
+
+    def _rpc_record(self, record, pipe):
+        """Deal with an incoming RPC record, from the event loop."""
+        h = self.handler
+        try:
+            msg, msg_data = h._unpack_record(record)
+        except (rpc_pack.XDRError, EOFError) as e:
+            log_p.warn("XDRError: %s, dropping packet" % e)
+            h._notify_drop()
+            return # Drop incorrectly encoded packets
+        if msg.mtype == REPLY:
+            h._event_rpc_reply(msg, msg_data, pipe)
+        elif msg.mtype == CALL:
+            timer = h.stats.timer() if h.stats.enabled else None
+            task = self.loop.create_task(self._rpc_call(msg, msg_data, pipe,
+                                                        timer))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            log_p.error("Received rpc_record with msg.type=%i" % msg.mtype)
+            h._notify_drop()
+
+    async def _rpc_call(self, msg, msg_data, pipe, timer=None):
+        """Async counterpart of ConnectionHandler._event_rpc_call"""
+        h = self.handler
+        notify = None
+        error = False
+        request_size = msg.length + len(msg_data)
+        if timer is not None:
+            timer.mark("queue")
+        drc_key = None
+        if h.drc is not None and h.drc.wants(msg):
+            drc_key = h.drc.make_key(pipe, msg, msg_data)
+            cached = h.drc.start(drc_key)
+            if cached is not None:
+                # A retransmit, so reuse the original reply
+                try:
+                    record = await asyncio.wait_for(asyncio.wrap_future(cached),
+                                                    h.drc.wait_timeout)
+                except asyncio.TimeoutError:
+                    record = None
+                if record is None:
+                    h._notify_drop()
+                else:
+                    pipe.push_record(record)
+                return
+        try:
+            method, msg_data, call_info = h._prepare_call(msg, msg_data, pipe)
+            if timer is not None:
+                timer.mark("auth")
+            if asyncio.iscoroutinefunction(method):
+                tuple = await method(msg_data, call_info)
+            else:
+                tuple = await self._run_sync(pipe, method, msg_data,
+                                             call_info)
+            if timer is not None:
+                timer.mark("handler")
+            body, data, notify = h._make_reply(msg, call_info, tuple)
+            if timer is not None:
+                timer.mark("auth")
+        except rpclib.RPCDrop:
+            # Silently drop the request
+            if drc_key is not None:
+                h.drc.abandon(drc_key)
+            h._notify_drop()
+            return
+        except rpclib.RPCFlowContol as e:
+            body, data = e.body()
+            error = True
+        except Exception:
+            log_t.warn("Unexpected exception", exc_info=True)
+            body, data = rpclib.RPCUnsuccessfulReply(SYSTEM_ERR).body()
+            error = True
+        done = None
+        if timer is not None:
+            timer.key = h._stats_key(msg)
+            done = timer.flushed
+        if drc_key is None:
+            size = pipe.send_reply(msg.xid, body, data, done)
+        else:
+            record = h._reply_record(msg.xid, body, data)
+            h.drc.finish(drc_key, record)
+            pipe.push_record(record, done)
+            size = len(record[0]) + len(record[1])
+        if timer is not None:
+            timer.finish(request_size, size, error)
+        if notify is not None:
+            await self._run_sync(pipe, notify)
+
+    def _run_sync(self, pipe, function, *args):
+        """Run a blocking function in a worker thread, returning a future
+
+        If the dispatch queue is full, the function waits its turn in
+        self._held, and pipe stops reading until it has been handed over.
+        """
+        pool = self.handler.dispatch
+        if pool is None:
+            return self.loop.run_in_executor(None, function, *args)
+        future = self.loop.create_future()
+        def run():
+            try:
+                result = function(*args)
+            except Exception as e:
+                self.loop.call_soon_threadsafe(_set_future, future, None, e)
+            else:
+                self.loop.call_soon_threadsafe(_set_future, future, result)
+        if self._held or not pool.submit(run):
+            self._held.append(run)
+            if pipe.transport is not None and pipe not in self._paused:
+                self._paused.add(pipe)
+                pipe.transport.pause_reading()
+            self._wait_for_room()
+        return future
+
+    def _wait_for_room(self):
+        if not self._want_room:
+            self._want_room = True
+            self.handler.dispatch.when_room(
+                lambda: self.loop.call_soon_threadsafe(self._dispatch_room))
+
+    def _dispatch_room(self):
+        """Hand held work to dispatch, then let paused pipes read again"""
+        self._want_room = False
+        pool = self.handler.dispatch
+        while self._held:
+            if not pool.submit(self._held[0]):
+                self._wait_for_room()
+                return
+            self._held.popleft()
+        for pipe in self._paused:
+            if not pipe.transport.is_closing():
+                pipe.transport.resume_reading()
+        self._paused.clear()
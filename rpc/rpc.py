@@ -1,12 +1,18 @@
 from __future__ import with_statement
 from __future__ import absolute_import
 
-import socket, select
+import os
+import time
+import socket, selectors
 import struct
+import itertools
 import threading
 import logging
-from collections import deque as Deque
-from errno import EINPROGRESS, EWOULDBLOCK
+import queue
+import zlib
+import concurrent.futures
+from collections import deque as Deque, OrderedDict
+from contextlib import contextmanager
 
 import rpc.rpc_pack as rpc_pack
 from rpc_const import *
@@ -14,6 +20,7 @@ from rpc_type import *
 
 import security
 import rpclib
+import rpcstats
 import random
 
 log_p = logging.getLogger("rpc.poll") # polling loop thread
@@ -22,7 +29,13 @@ log_t = logging.getLogger("rpc.thread") # handler threads
 # log_p.setLevel(logging.DEBUG)
 # log_t.setLevel(logging.DEBUG)
 
-LOOPBACK = "127.0.0.1"
+MAX_FRAGMENT = 0x7fffffff # Largest packet a record mark can describe
+MAX_RECORD = 16 << 20 # Default for the largest record we accept
+READ_STEP = 64 << 10 # Most the read buffer grows past the data already read
+READ_KEEP = 1 << 20 # Read buffers larger than this shrink once drained
+IOV_MAX = 64 # Most segments handed to a single sendmsg call
+
+_have_sendmsg = hasattr(socket.socket, "sendmsg")
 
 def inc_u32(i):
     """Increment a 32 bit integer, with wrap-around."""
@@ -34,6 +47,10 @@ class RPCError(Exception):
 class RPCTimeout(RPCError):
     pass
 
+class RecordTooLarge(RPCError):
+    """The peer sent a record larger than we accept"""
+    pass
+
 class RPCAcceptError(RPCError):
     def __init__(self, a):
         self.verf = a.verf
@@ -125,7 +142,7 @@ class FancyRPCPacker(rpc_pack.RPCPacker):
 
 ###################################################
 
-class DeferredData(object):
+class DeferredData(concurrent.futures.Future):
     """Wait for data to arrive.
 
     Thread 1 does:
@@ -138,65 +155,396 @@ class DeferredData(object):
     # Access defer.msg if needed
     defer.fill()
     # Thread should no longer reference defer
+
+    This is a concurrent.futures.Future, so instead of calling wait()
+    it can be handed to add_done_callback, concurrent.futures.wait or
+    concurrent.futures.as_completed.  Its result is the filled data.
     """
     def __init__(self, msg=None):
-        self._filled = threading.Event()
+        concurrent.futures.Future.__init__(self)
         self.data = None
-        self._exception = None
         self.msg = msg # Data that thread calling fill might need
 
     def wait(self, timeout=10):
         """Wait for data to be filled in"""
-        self._filled.wait(timeout)
-        if not self._filled.isSet():
+        try:
+            with blocking():
+                self.result(timeout)
+        except concurrent.futures.TimeoutError:
             raise RPCTimeout
-        if self._exception is not None:
-            raise self._exception
 
     def fill(self, data=None, exception=None):
         """Fill with data, and flag that this has been done.
 
         Caller should no longer reference the object afterwards.
         """
-        self._exception = exception
         self.data = data
-        self._filled.set()
+        if exception is not None:
+            self.set_exception(exception)
+        else:
+            self.set_result(data)
 
 class Alarm(object):
-    """A method of notifying select loop that there is data waiting"""
-    def __init__(self, address):
+    """A method of notifying select loop that there is data waiting
+
+    Commands are queued, and the loop is woken only when the queue goes
+    from empty to non-empty.  The loop then takes the whole queue at once.
+    Waking uses an eventfd where available, otherwise a socketpair.
+    """
+    def __init__(self):
         self._queue = Deque()
-        self._s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._s.setblocking(0)
-        try:
-            self._s.connect(address)
-        except socket.error as e:
-            if e.args[0] in [EINPROGRESS, EWOULDBLOCK]:
-                # address has not yet called accept, since this is done in a
-                # single thread, so get "op in progress error".  When the
-                # receiving end calls accept, all is good.
-                pass
-            else:
-                raise
+        self._lock = threading.Lock() # Protects self._queue
+        if hasattr(os, "eventfd"):
+            self._fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self._r = self._w = None
+        else:
+            self._r, self._w = socket.socketpair()
+            self._r.setblocking(0)
+            self._w.setblocking(0)
+            self._fd = self._r.fileno()
+
+    def fileno(self):
+        """The fd the polling loop should wait on"""
+        return self._fd
 
     def buzz(self, command, info):
         """Wake the polling loop, passing it info"""
-        self._queue.appendleft(info)
-        # Send one byte of data 'command' to wake select loop
-        # Note bytes sent are counted to determine how many items to pop
-        while (not self._s.send(command)):
-            # Just loop here until we actually send something
+        with self._lock:
+            self._queue.append((command, info))
+            if len(self._queue) > 1:
+                # Loop has already been woken, and not yet taken the queue
+                return
+        try:
+            if self._w is None:
+                os.eventfd_write(self._fd, 1)
+            else:
+                self._w.send(b'\x00')
+        except BlockingIOError:
+            # Loop has plenty of wakeups pending
             pass
 
-    def pop(self):
-        """Called by polling loop to grab the info passed in by buzz"""
-        return self._queue.pop()
+    def pop_all(self):
+        """Called by polling loop to grab the (command, info) pairs queued"""
+        try:
+            if self._r is None:
+                os.eventfd_read(self._fd)
+            else:
+                while self._r.recv(4096):
+                    pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            out, self._queue = self._queue, Deque()
+        return out
 
-    def __getattr__(self, attr):
-        """Show socket interface"""
-        return getattr(self._s, attr)
+    def close(self):
+        if self._r is None:
+            os.close(self._fd)
+        else:
+            self._r.close()
+            self._w.close()
+
+_worker_local = threading.local() # .pool is set in DispatchPool threads
+
+@contextmanager
+def blocking():
+    """Declare that the calling handler is about to block.
+
+    Use this around waits that may only be satisfied by another incoming
+    record, such as a replay waiting for the original request's reply.
+    If called from a DispatchPool worker, the pool is allowed to start an
+    extra worker so that queued records are still serviced.  Otherwise
+    this does nothing.
+    """
+    pool = getattr(_worker_local, "pool", None)
+    if pool is None:
+        yield
+        return
+    pool._enter_blocking()
+    try:
+        yield
+    finally:
+        pool._exit_blocking()
+
+class DispatchPool(object):
+    """A fixed number of worker threads fed from a bounded queue.
+
+    Workers are started on demand, up to 'workers' of them.  Workers
+    which have declared they are blocked (see blocking()) do not count
+    against that limit, and the surplus threads exit once the blocked
+    workers return.  If the queue is full, submit() refuses the work
+    rather than blocking, and the caller can use when_room() to learn
+    when to try again.
+    """
+    def __init__(self, workers=16, maxqueue=1024, name="RPCWorker"):
+        self.workers = workers
+        self.name = name
+        self._queue = queue.Queue(maxqueue)
+        self._lock = threading.Lock() # Protects fields below
+        self._running = 0 # Number of worker threads
+        self._idle = 0 # Number of workers waiting on the queue
+        self._blocked = 0 # Number of workers inside blocking()
+        self._stopping = False
+        self._room_waiters = [] # Callbacks for when_room()
+        # Statistics
+        self.submitted = 0
+        self.completed = 0
+        self.max_depth = 0 # High water mark of queue depth
+        self.full = 0 # Number of times submit() found the queue full
+        self.max_running = 0
+
+    def submit(self, function, *args):
+        """Queue function(*args) to be run by a worker.
+
+        Returns False, without queueing it, if the queue is full.
+        """
+        with self._lock:
+            try:
+                self._queue.put_nowait((function, args))
+            except queue.Full:
+                self.full += 1
+                return False
+            self.submitted += 1
+            depth = self._queue.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if self._idle < depth:
+                self._spawn()
+        return True
+
+    def when_room(self, callback):
+        """Call callback() once the queue has room.
+
+        This is immediate if it already has room, otherwise it is called
+        from a worker thread as soon as it takes work off the queue.
+        """
+        with self._lock:
+            if self._queue.full():
+                self._room_waiters.append(callback)
+                return
+        callback()
+
+    def stop(self):
+        """Tell each worker to exit once the queue is drained."""
+        with self._lock:
+            self._stopping = True
+            count = self._running
+        # Workers which miss out on a token because the queue is full
+        # see _stopping once the queue drains, and pass a token on.
+        for i in range(count):
+            try:
+                self._queue.put_nowait((None, None))
+            except queue.Full:
+                break
+
+    def stats(self):
+        """Return a dictionary of queue-depth and worker statistics."""
+        with self._lock:
+            return {"depth" : self._queue.qsize(),
+                    "max_depth" : self.max_depth,
+                    "maxqueue" : self._queue.maxsize,
+                    "full" : self.full,
+                    "submitted" : self.submitted,
+                    "completed" : self.completed,
+                    "workers" : self.workers,
+                    "running" : self._running,
+                    "max_running" : self.max_running,
+                    "idle" : self._idle,
+                    "blocked" : self._blocked,
+                    }
+
+    def _spawn(self):
+        """Start a worker if under the limit.  Call with self._lock held."""
+        if self._running - self._blocked >= self.workers:
+            return
+        self._running += 1
+        if self._running > self.max_running:
+            self.max_running = self._running
+        t = threading.Thread(target=self._worker,
+                             name="%s-%i" % (self.name, self._running))
+        t.setDaemon(True)
+        t.start()
+
+    def _enter_blocking(self):
+        with self._lock:
+            self._blocked += 1
+            if self._idle < self._queue.qsize():
+                self._spawn()
+
+    def _exit_blocking(self):
+        with self._lock:
+            self._blocked -= 1
+
+    def _worker(self):
+        _worker_local.pool = self
+        while True:
+            with self._lock:
+                if self._running - self._blocked > self.workers:
+                    # We were started to cover for a blocked worker,
+                    # which has since returned.
+                    self._running -= 1
+                    return
+                self._idle += 1
+            function, args = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+                waiters, self._room_waiters = self._room_waiters, []
+                if function is None:
+                    self._running -= 1
+            for callback in waiters:
+                callback()
+            if function is None:
+                return
+            try:
+                function(*args)
+            except Exception:
+                log_t.error("Unhandled exception in %s" % function,
+                            exc_info=True)
+            with self._lock:
+                self.completed += 1
+                if self._stopping and self._queue.empty():
+                    self._running -= 1
+                    stopped = True
+                else:
+                    stopped = False
+            if stopped:
+                try:
+                    # Wake another worker, in case it missed its token
+                    self._queue.put_nowait((None, None))
+                except queue.Full:
+                    pass
+                return
+
+class RecordStream(object):
+    """Record marking (rfc 1831 section 10) of a stream of bytes.
+
+    Keeps the buffer incoming data is read into, splits it into records,
+    and marks outgoing records.  This is shared by Pipe and the asyncio
+    protocol in rpc.aio.  Call _init_record_stream() before use.
+
+    Records larger than max_record bytes raise RecordTooLarge.
+    """
+    max_record = MAX_RECORD
+
+    def _init_record_stream(self):
+        # Raw incoming data is read directly into _read_buf, and lives in
+        # _read_buf[_read_start:_read_end].  The buffer is grown as the
+        # data of a large packet arrives, compacted only when we run out
+        # of room, and shrunk back to READ_KEEP once it is drained.
+        self._read_buf = bytearray(4096)
+        self._read_start = self._read_end = 0
+        self._packet_buf = [] # Store packets read until have a whole record
+        self._packet_len = 0 # Total size of _packet_buf
 
-class Pipe(object):
+    def _check_mark(self, start):
+        """Return the size of the packet with its mark at start.
+
+        The size includes the mark itself.
+        """
+        packetlen = (struct.unpack_from('>L', self._read_buf, start)[0] &
+                     0x7fffffff)
+        if self._packet_len + packetlen > self.max_record:
+            raise RecordTooLarge("Record larger than %i bytes" %
+                                 self.max_record)
+        return packetlen + 4
+
+    def _parse_records(self, count):
+        """Note count bytes were read into the buffer, and return records.
+
+        Each record is returned as a single bytes object, which is the only
+        copy made of the data once it is read from the socket.
+        """
+        buf = self._read_buf
+        out = []
+        start, end = self._read_start, self._read_end + count
+        with memoryview(buf) as view:
+            while end - start >= 4:
+                last = buf[start] & 0x80
+                packetlen = self._check_mark(start)
+                if end - start < packetlen:
+                    # We don't have a full packet yet, wait for more data
+                    break
+                packet = view[start + 4:start + packetlen]
+                start += packetlen
+                if last and not self._packet_buf:
+                    # The common case of a single packet record
+                    out.append(bytes(packet))
+                    continue
+                self._packet_buf.append(bytes(packet))
+                self._packet_len += len(packet)
+                if last:
+                    # We have a full RPC record.  Note this does not imply
+                    # that the read buffer is empty.
+                    out.append(b''.join(self._packet_buf))
+                    self._packet_buf = []
+                    self._packet_len = 0
+        if start == end:
+            start = end = 0
+            if len(buf) > READ_KEEP:
+                # Give back the room taken by a large packet.  The buffer
+                # is replaced rather than resized, since the caller may
+                # still hold a view of it.
+                self._read_buf = bytearray(READ_KEEP)
+        self._read_start, self._read_end = start, end
+        return out
+
+    def _reserve(self, count):
+        """Make sure the read buffer has room for at least count more bytes.
+
+        If a partial packet is waiting, make room for more of it, growing
+        the room by at most as much as has arrived plus READ_STEP, so
+        the memory used follows the data the peer actually sends rather
+        than the size its record mark claims.
+        """
+        buf = self._read_buf
+        start, end = self._read_start, self._read_end
+        have = end - start
+        if have >= 4:
+            packetlen = self._check_mark(start)
+            count = max(count, min(packetlen - have, have + READ_STEP))
+        if len(buf) - end >= count:
+            return
+        if start:
+            # Compact, moving the unparsed data to the front
+            buf[:end - start] = buf[start:end]
+            end -= start
+            self._read_start, self._read_end = 0, end
+        if len(buf) - end < count:
+            buf.extend(bytes(end + count - len(buf)))
+
+    @staticmethod
+    def _mark_record(record, count):
+        """Return list of record marks and pieces to send for the record.
+
+        The record may be a bytes-like object, or a tuple of them.  It is
+        broken into packets of at most count bytes.  No data is copied.
+        """
+        if not isinstance(record, tuple):
+            record = (record,)
+        pieces = [memoryview(r).cast('B') for r in record if len(r)]
+        left = sum(len(p) for p in pieces)
+        segs = []
+        while True:
+            # Add the mark for the next packet, then the pieces it covers
+            chunk = min(left, count)
+            left -= chunk
+            last = (0x80000000 if not left else 0)
+            segs.append(struct.pack('>L', last | chunk))
+            while chunk:
+                p = pieces[0]
+                if len(p) <= chunk:
+                    segs.append(p)
+                    chunk -= len(p)
+                    pieces.pop(0)
+                else:
+                    segs.append(p[:chunk])
+                    pieces[0] = p[chunk:]
+                    chunk = 0
+            if last:
+                break
+        return segs
+
+class Pipe(RecordStream):
     """Groups a socket with its buffers.
 
     We deal with records, packets, and bytes.
@@ -240,9 +588,18 @@ class Pipe(object):
         # looked at by the main thread, so no locking is required.
         self._write_queue = Deque() # Records waiting to be sent out
         self._alarm = write_alarm # Way to notify we have data to write
-        self._write_buf = b'' # Raw outgoing data
-        self._read_buf = b'' # Raw incoming data
-        self._packet_buf = [] # Store packets read until have a whole record
+        # Raw outgoing data, as a queue of record marks and record pieces
+        # to be handed to sendmsg.  _write_offset is how much of the first
+        # segment has already been sent.
+        self._write_segs = Deque()
+        self._write_offset = 0
+        # Callbacks waiting for records to be sent, as (segment, callback)
+        # pairs, where segment is the count of segments ever queued once
+        # the record is.  _segs_queued and _segs_sent count the segments
+        # ever added to and removed from _write_segs.
+        self._write_done = Deque()
+        self._segs_queued = self._segs_sent = 0
+        self._init_record_stream()
 
     def __getattr__(self, attr):
         """Show socket interface"""
@@ -252,72 +609,51 @@ class Pipe(object):
         return "pipe-%i" % self._s.fileno()
 
     def recv_records(self, count):
-        """Pull up to count bytes from pipe, converting into records."""
+        """Pull data from pipe, converting into records.
+
+        At least count bytes of buffer space are offered to recv, more if
+        we already know a larger packet is on its way.
+        """
         # This is only called from main handler thread, so doesn't need locking
-        data = self._s.recv(count)
+        self._reserve(count)
+        with memoryview(self._read_buf) as view:
+            data = self._s.recv_into(view[self._read_end:])
         if not data:
             # This indicates socket has closed
             return None
-        out = []
-        self._read_buf += data
-        while self._read_buf:
-            buf = self._read_buf
-            if len(buf) < 4:
-                # We don't even have the packet length yet, wait for more data
-                break
-            packetlen = struct.unpack('>L', buf[0:4])[0]
-            last = 0x80000000 & packetlen
-            packetlen &= 0x7fffffff
-            packetlen += 4 # Include size of record mark
-            if len(buf) < packetlen:
-                # We don't have a full packet yet, wait for more data
-                break
-            self._packet_buf.append(buf[4:packetlen])
-            self._read_buf = buf[packetlen:]
-            if last:
-                # We have a full RPC record.  Note this does not imply that
-                # self._read_buf is empty.
-                record = b''.join(self._packet_buf)
-                self._packet_buf = []
-                out.append(record)
-        return out
+        return self._parse_records(data)
 
-    def push_record(self, record):
+    def push_record(self, record, done=None):
         """Prepares handler thread to send record.
 
+        The record may be a bytes-like object, or a tuple of them which
+        will be sent back to back without being joined.
+        If done is given, the polling thread calls it once the record
+        has been completely written to the socket.
         If None is sent, no further data will be accepted, and pipe will be
         closed once previous data is flushed.
         """
         # This is called from worker threads, so needs locking.
         # However, deque is thread safe, so all is good
-        self._write_queue.appendleft(record)
+        self._write_queue.appendleft((record, done))
         # Notify ConnectionHandler that there is data to write
         self._alarm.buzz(b'\x00', self)
 
     def pop_record(self, count):
         """Pulls record off stack and places in write buffer.
 
-        Appropriate record marking is added.  This should be called once
+        Appropriate record marking is added, using packets of at most
+        count bytes.  This should be called once
         for each push_record called.  This is handled by arranging to have
         the function called each time the the polling loop responds to
         self._alarm.buzz.
         """
-        def add_record_marks(record, count):
-            """Given a record, convert it to actual stream to send over TCP"""
-            dlen = len(record)
-            i = last = 0
-            out = b'' # FRED - use stringio here?
-            while not last:
-                chunk = record[i: i + count]
-                i += count
-                if i >= dlen:
-                    last = 0x80000000
-                mark = struct.pack('>L', last | len(chunk))
-                out += mark + chunk
-            return out
-
-        record = self._write_queue.pop()
-        self._write_buf += add_record_marks(record, count)
+        record, done = self._write_queue.pop()
+        segs = self._mark_record(record, count)
+        self._write_segs.extend(segs)
+        self._segs_queued += len(segs)
+        if done is not None:
+            self._write_done.append((self._segs_queued, done))
 
     def flush_pipe(self):
         """Try to flush the write buffer.
@@ -327,29 +663,44 @@ class Pipe(object):
         Note this only flushes the buffer of raw bytes waiting to be sent.
         It does not look at the waiting stack of non-marked records.
         """
-        if not self._write_buf:
+        segs = self._write_segs
+        if not segs:
             raise RuntimeError
+        if self._write_offset:
+            iov = [memoryview(segs[0])[self._write_offset:]]
+        else:
+            iov = [segs[0]]
+        iov.extend(itertools.islice(segs, 1, IOV_MAX))
         try:
-            count = self._s.send(self._write_buf)
+            if _have_sendmsg:
+                count = self._s.sendmsg(iov)
+            else:
+                count = self._s.send(iov[0])
         except socket.error as e:
             log_p.error("flush_pipe got exception %s" % str(e))
             return True # This is to stop retries
-        self._write_buf = self._write_buf[count:]
-        return (not self._write_buf)
-
-class RpcPipe(Pipe):
-    """Hide pipe related xid handling.
-
-    The expected use is for a client thread to do:
-            xid = pipe.send_call()
-            reply = pipe.listen(xid)
-    A server thread will just do:
-            pipe.send_reply()
+        count += self._write_offset
+        while segs and count >= len(segs[0]):
+            count -= len(segs.popleft())
+            self._segs_sent += 1
+        self._write_offset = count
+        done = self._write_done
+        while done and done[0][0] <= self._segs_sent:
+            done.popleft()[1]()
+        return (not segs)
+
+class RpcEndpoint(object):
+    """Xid handling and building of RPC messages for one connection.
+
+    This is shared by RpcPipe and the asyncio protocol in rpc.aio.  The
+    subclass provides push_record(), and _deferred, the class used to
+    wait on replies.  Call _init_endpoint() before use.
     """
     rpcversion = 2 # The RPC version that is used by default
+    _deferred = DeferredData
+    stats = None # The rpcstats.RPCStats of our ConnectionHandler
 
-    def __init__(self, *args, **kwargs):
-        Pipe.__init__(self, *args, **kwargs)
+    def _init_endpoint(self):
         self._pending = {} # {xid:defer}
         self._lock = threading.Lock() # Protects fields below
         self._xid = random.randint(0, 0x7fffffff)
@@ -370,24 +721,24 @@ class RpcPipe(Pipe):
     def is_active(self):
         return self._active
 
-    def listen(self, xid, timeout=None):
-        """Wait for a reply to a CALL."""
-        self._pending[xid].wait(timeout)
-        reply = self._pending[xid].data # This is set at end of self.rcv_reply
-        del self._pending[xid]
-        return reply
+    def rpc_send(self, rpc_msg, data=b'', done=None):
+        """Send raw data over pipe using given rpc_msg.
 
-    def rpc_send(self, rpc_msg, data=b''):
-        """Send raw data over pipe using given rpc_msg"""
+        Returns the size of the record sent.
+        """
+        header = self._pack_msg(rpc_msg)
+        self.push_record((header, data), done)
+        return len(header) + len(data)
+
+    def _pack_msg(self, rpc_msg):
         p = FancyRPCPacker()
         p.pack_rpc_msg(rpc_msg)
-        header = p.get_buffer()
-        self.push_record(header + data)
+        return p.get_buffer()
 
-    def send_reply(self, xid, body, proc_response=""):
+    def send_reply(self, xid, body, proc_response=b'', done=None):
         log_t.debug("send_reply\nbody = %r\ndata=%r" % (body, proc_response))
         msg = rpc_msg(xid, rpc_msg_body(REPLY, rbody=body))
-        self.rpc_send(msg, proc_response)
+        return self.rpc_send(msg, proc_response, done)
 
     def send_call(self, program, version, procedure, data, credinfo):
         """Send a CALL, and store info needed to match and verify reply."""
@@ -399,9 +750,17 @@ class RpcPipe(Pipe):
         body.verf = sec.make_call_verf(xid, body)
         msg = rpc_msg(xid, rpc_msg_body(CALL, body))
         data = sec.secure_data(cred, data)
-        # Store info needed be receiving thread to match and verify reply
-        self._pending[xid] = DeferredData((cred, sec))
-        self.rpc_send(msg, data)
+        header = self._pack_msg(msg)
+        # Store info needed be receiving thread to match and verify reply.
+        # The reply can arrive as soon as the record is pushed, so the
+        # deferred must be complete before it is published in _pending.
+        deferred = self._deferred((cred, sec))
+        if self.stats is not None and self.stats.enabled:
+            deferred.key = (program, version, procedure, cred.flavor)
+            deferred.size = len(header) + len(data)
+            deferred.sent = time.monotonic()
+        self._pending[xid] = deferred
+        self.push_record((header, data))
         return xid
 
     def rcv_reply(self, msg, msg_data):
@@ -431,9 +790,247 @@ class RpcPipe(Pipe):
                 # FRED - what is the point of verifier, if this can occur?
                 exc = RPCError("Failed to unsecure data in reply")
         log_t.debug("Filling deferral %i" % msg.xid)
+        if getattr(deferred, "sent", None) is not None:
+            self.stats.record_reply(deferred.key,
+                                    time.monotonic() - deferred.sent,
+                                    deferred.size,
+                                    msg.length + len(msg_data), exc is not None)
         reply = (msg, msg_data) # The return value of self.listen()
         deferred.fill(reply, exc)
 
+class RpcPipe(Pipe, RpcEndpoint):
+    """Hide pipe related xid handling.
+
+    The expected use is for a client thread to do:
+            xid = pipe.send_call()
+            reply = pipe.listen(xid)
+    A server thread will just do:
+            pipe.send_reply()
+    """
+    def __init__(self, *args, **kwargs):
+        Pipe.__init__(self, *args, **kwargs)
+        self._init_endpoint()
+
+    def listen(self, xid, timeout=None):
+        """Wait for a reply to a CALL."""
+        self._pending[xid].wait(timeout)
+        reply = self._pending[xid].data # This is set at end of self.rcv_reply
+        del self._pending[xid]
+        return reply
+
+    def future(self, xid):
+        """Return a concurrent.futures.Future for the reply to a CALL.
+
+        Its result is what listen(xid) would return.  Use this instead
+        of listen(xid), not as well as it.
+        """
+        deferred = self._pending[xid]
+        deferred.add_done_callback(lambda f: self._pending.pop(xid, None))
+        return deferred
+
+class PipePool(object):
+    """Several pipes to the same address, used like a single RpcPipe.
+
+    Each call is sent on the member with the fewest outstanding calls.
+    Members found to be closed are reconnected before being used.
+    The members share one xid sequence, so an xid identifies the member
+    used to send it.
+    """
+    def __init__(self, handler, address, count, secure=False):
+        self.address = address
+        self.secure = secure
+        self._handler = handler
+        self._lock = threading.Lock() # Protects fields below
+        self._xid = random.randint(0, 0x7fffffff)
+        self._owner = {} # {xid: pipe}
+        self._reconnecting = set() # Indices of members being reconnected
+        self.pipes = [self._connect() for i in range(count)]
+
+    def __str__(self):
+        return "pool-%s" % ",".join([str(p) for p in self.pipes])
+
+    def _connect(self):
+        pipe = self._handler.connect(self.address, self.secure)
+        pipe._get_xid = self._get_xid
+        return pipe
+
+    def _get_xid(self):
+        with self._lock:
+            out = self._xid
+            self._xid = inc_u32(out)
+        return out
+
+    def _choose(self):
+        """Return the least busy pipe, reconnecting any that have failed"""
+        with self._lock:
+            dead = [i for i, pipe in enumerate(self.pipes)
+                    if not pipe.is_active() and i not in self._reconnecting]
+            self._reconnecting.update(dead)
+        # Connecting blocks, so is done without holding the lock
+        for i in dead:
+            log_t.info("Reconnecting %s member %i" % (self, i))
+            try:
+                pipe = self._connect()
+            except:
+                with self._lock:
+                    self._reconnecting.difference_update(dead)
+                raise
+            with self._lock:
+                self.pipes[i] = pipe
+                self._reconnecting.discard(i)
+        with self._lock:
+            # Members other threads are still reconnecting are not active
+            pipes = [p for p in self.pipes if p.is_active()] or self.pipes
+            return min(pipes, key=lambda p: len(p._pending))
+
+    def outstanding(self):
+        """Return list of the number of calls outstanding on each member"""
+        return [len(p._pending) for p in self.pipes]
+
+    def is_active(self):
+        # Failed members are reconnected as needed
+        return True
+
+    def send_call(self, program, version, procedure, data, credinfo):
+        pipe = self._choose()
+        xid = pipe.send_call(program, version, procedure, data, credinfo)
+        with self._lock:
+            self._owner[xid] = pipe
+        return xid
+
+    def _pop_owner(self, xid):
+        with self._lock:
+            return self._owner.pop(xid)
+
+    def listen(self, xid, timeout=None):
+        return self._pop_owner(xid).listen(xid, timeout)
+
+    def future(self, xid):
+        return self._pop_owner(xid).future(xid)
+
+    def close(self):
+        for pipe in self.pipes:
+            pipe.close()
+
+class ReplyCache(object):
+    """Duplicate request cache, holding recent encoded replies.
+
+    Calls are keyed by (client host, xid, prog, vers, proc, args checksum).
+    A retransmitted call is answered from the cache, or if the original
+    is still being handled, once its reply is ready.  This keeps
+    non-idempotent procedures of non-session programs from being run twice.
+
+    At most maxentries replies, totalling maxbytes, are kept, the least
+    recently used being evicted first.  Replies older than maxage seconds
+    are expired.  If procs is given, as (prog, vers, proc) triples, only
+    calls to those procedures are cached; the NULL procedure never is.
+    """
+    def __init__(self, maxentries=1024, maxbytes=16 << 20, maxage=120,
+                 procs=None, wait_timeout=30):
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.procs = (None if procs is None else frozenset(procs))
+        self.wait_timeout = wait_timeout # How long a retransmit may wait
+        self._lock = threading.Lock() # Protects fields below
+        self._done = OrderedDict() # {key: (time, size, record)}, oldest first
+        self._active = {} # {key: Future} for calls being handled
+        self.bytes = 0 # Total size of records in self._done
+        # Statistics
+        self.hits = 0 # Retransmits answered from the cache
+        self.waits = 0 # Retransmits which arrived while original was active
+        self.misses = 0
+        self.evictions = 0 # Replies dropped to stay within limits
+        self.expired = 0 # Replies dropped for being older than maxage
+
+    def wants(self, msg):
+        """Return True if calls like msg should go through the cache"""
+        if msg.proc == 0:
+            return False
+        return (self.procs is None or
+                (msg.prog, msg.vers, msg.proc) in self.procs)
+
+    def make_key(self, pipe, msg, msg_data):
+        # Key on the host only, since a retransmit over TCP usually
+        # follows a reconnect, which may come from a different port.
+        try:
+            host = pipe.getpeername()[0]
+        except (socket.error, AttributeError, TypeError):
+            host = None
+        return (host, msg.xid, msg.prog, msg.vers, msg.proc,
+                len(msg_data), zlib.crc32(msg_data))
+
+    def start(self, key):
+        """Note a call is about to be handled.
+
+        Returns None if this is a new call, which must be followed by
+        finish(key, record) or abandon(key).  Otherwise this is a
+        retransmit, and a concurrent.futures.Future is returned whose
+        result is the reply record, or None if the original was dropped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._done.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._done.move_to_end(key)
+                future = concurrent.futures.Future()
+                future.set_result(entry[2])
+                return future
+            future = self._active.get(key)
+            if future is not None:
+                self.waits += 1
+                return future
+            self.misses += 1
+            self._active[key] = concurrent.futures.Future()
+            return None
+
+    def finish(self, key, record):
+        """Store the reply record, a tuple of bytes-like objects, for key"""
+        size = sum(len(r) for r in record)
+        with self._lock:
+            future = self._active.pop(key)
+            self._done[key] = (time.monotonic(), size, record)
+            self.bytes += size
+            while self._done and (len(self._done) > self.maxentries or
+                                  self.bytes > self.maxbytes):
+                self._pop_oldest()
+                self.evictions += 1
+        future.set_result(record)
+
+    def abandon(self, key):
+        """The call for key was dropped, so forget it"""
+        with self._lock:
+            future = self._active.pop(key)
+        future.set_result(None)
+
+    def _expire(self, now):
+        """Drop replies older than maxage.  Call with self._lock held."""
+        done = self._done
+        while done and now - next(iter(done.values()))[0] > self.maxage:
+            self._pop_oldest()
+            self.expired += 1
+
+    def _pop_oldest(self):
+        key, (t, size, record) = self._done.popitem(last=False)
+        self.bytes -= size
+
+    def stats(self):
+        """Return a dictionary of cache size and hit/miss statistics."""
+        with self._lock:
+            return {"entries" : len(self._done),
+                    "active" : len(self._active),
+                    "bytes" : self.bytes,
+                    "maxentries" : self.maxentries,
+                    "maxbytes" : self.maxbytes,
+                    "hits" : self.hits,
+                    "waits" : self.waits,
+                    "misses" : self.misses,
+                    "evictions" : self.evictions,
+                    "expired" : self.expired,
+                    }
+
 #################################################
 
 class ConnectionHandler(object):
@@ -444,41 +1041,109 @@ class ConnectionHandler(object):
 
     NOTE that the _event_* functions should not be called directly,
     but only through start.  Thread safety depends on this.
+
+    Incoming records are handed to a DispatchPool of at most
+    dispatch_workers threads, through a queue holding at most
+    dispatch_queue records.  While the queue is full, reading stops on
+    connections with records waiting for it.  Setting dispatch_workers=0
+    instead starts a new thread for each record.
+
+    If zerocopy is set, the procedure data passed on to handle_* methods
+    and reply listeners is a memoryview of the received record, rather
+    than a copy of it.
     """
-    def __init__(self):
+    zerocopy = False
+
+    def __init__(self, dispatch_workers=16, dispatch_queue=1024):
         self._stopped = False
-        # Set up polling lists
-        self.readlist = set()
-        self.writelist = set()
-        self.errlist = set()
+        if dispatch_workers:
+            self.dispatch = DispatchPool(dispatch_workers, dispatch_queue)
+        else:
+            self.dispatch = None
+        # Set up polling.  Each fd is registered once, for EVENT_READ, and
+        # EVENT_WRITE is added only while it has data waiting to be flushed.
+        self._selector = selectors.DefaultSelector()
+        self._writing = set() # fds currently registered for EVENT_WRITE
+        # Records waiting for room in self.dispatch, {fd: Deque of
+        # (record, timer)}.  These fds are not registered for EVENT_READ.
+        self._held = {}
+        self._want_room = False # Have asked dispatch to call _dispatch_room
         # A list of all sockets we have open, indexed by fileno
         self.sockets = {} # {fd: pipe}
         # A list of the sockets set to listen for connections
         self.listeners = set()
 
-        # Create internal server for alarm system to connect to
-        self.s = self.expose((LOOPBACK, 0), socket.AF_INET, False)
-
         # Set up alarm system, which is how other threads inform the polling
         # thread that data is ready to be sent out
-        # NOTE that there are TWO sockets associated with alarm, one
-        # for each end of the connection.  Nasty bugs creep in here.
-        self._alarm = Alarm(self.s.getsockname())
-        self._alarm_poll = self._event_connect_incoming(self.s.fileno(),
-                                                        internal=True)
+        self._alarm = Alarm()
+        self._selector.register(self._alarm.fileno(), selectors.EVENT_READ)
 
         # Set up some constants that effect general behavior
         self.rsize = 4096 # Read data in chunks of this size
-        self.wsize = 4098 # Read data in chunks of this size
+        self.max_record = MAX_RECORD # Largest record accepted from peers
+        self.wsize = MAX_FRAGMENT # Send records in packets of this size
         self.rpcversions = (2,) # Supported RPC versions
 
         # Dictionary {flavor: handler} used for server-side authentication
         self.sec_flavors = security.instances()
 
+        # Per procedure statistics, collected once self.stats.enable() is
+        # called.  See rpcstats.py.
+        self.stats = rpcstats.RPCStats()
+
+        # Duplicate request cache, if any, set up by Server
+        self.drc = None
+
+    def _set_events(self, fd):
+        """Register fd for the events it currently needs"""
+        events = 0
+        if fd not in self._held:
+            events |= selectors.EVENT_READ
+        if fd in self._writing:
+            events |= selectors.EVENT_WRITE
+        try:
+            key = self._selector.get_key(fd)
+        except KeyError:
+            if events:
+                self._selector.register(fd, events)
+            return
+        if not events:
+            self._selector.unregister(fd)
+        elif key.events != events:
+            self._selector.modify(fd, events)
+
     def _buzz_write_ready(self, pipe):
         """Pipe has data ready to be sent out"""
         pipe.pop_record(self.wsize)
-        self.writelist.add(pipe.fileno())
+        fd = pipe.fileno()
+        if fd not in self._writing and fd in self.sockets:
+            self._writing.add(fd)
+            self._set_events(fd)
+
+    def _dispatch_room(self):
+        """Called, possibly from a worker thread, once dispatch has room"""
+        self._alarm.buzz(b'\x03', None)
+
+    def _buzz_dispatch_room(self, data):
+        """Hand held records to dispatch, and resume reading their fds"""
+        self._want_room = False
+        for fd in list(self._held):
+            held = self._held[fd]
+            pipe = self.sockets[fd]
+            while held:
+                record, timer = held[0]
+                if not self.dispatch.submit(self._event_rpc_record,
+                                            record, pipe, timer):
+                    self._wait_for_room()
+                    return
+                held.popleft()
+            del self._held[fd]
+            self._set_events(fd)
+
+    def _wait_for_room(self):
+        if not self._want_room:
+            self._want_room = True
+            self.dispatch.when_room(self._dispatch_room)
 
     def _buzz_new_socket(self, data):
         """A new socket needs to be added"""
@@ -488,8 +1153,7 @@ class ConnectionHandler(object):
         # Add to known connections
         self.sockets[fd] = pipe
         # Start listening on new connection
-        self.readlist.add(fd)
-        self.errlist.add(fd)
+        self._selector.register(fd, selectors.EVENT_READ)
         # Notify thread which created connection that it is now up
         defer.fill()
 
@@ -498,86 +1162,90 @@ class ConnectionHandler(object):
         self._stopped = True
 
     def start(self):
-        switch = {0 : self._buzz_write_ready,
-                  1 : self._buzz_new_socket,
-                  2 : self._buzz_stop,
+        switch = {b'\x00' : self._buzz_write_ready,
+                  b'\x01' : self._buzz_new_socket,
+                  b'\x02' : self._buzz_stop,
+                  b'\x03' : self._buzz_dispatch_room,
                   }
+        alarm_fd = self._alarm.fileno()
         while not self._stopped:
             log_p.debug("Calling select")
-            log_p.log(5, "Sleeping for: %s, %s, %s" %
-                 (self.readlist, self.writelist, self.errlist))
-            r,w,e = select.select(self.readlist, self.writelist, self.errlist)
-            log_p.log(5, "Woke with: %s, %s, %s" % (r, w, e))
-            for fd in e:
-                log_p.warn(1, "polling error from %i" % fd)
-                # STUB - now what?
-            for fd in w:
-                try:
-                    self._event_write(fd)
-                except socket.error as e:
-                    self._event_close(fd)
-            for fd in r:
-                if fd in self.listeners:
+            events = self._selector.select()
+            log_p.log(5, "Woke with: %s" %
+                      [(key.fd, mask) for key, mask in events])
+            for key, mask in events:
+                fd = key.fd
+                if mask & selectors.EVENT_WRITE:
                     try:
-                        self._event_connect_incoming(fd)
+                        self._event_write(fd)
                     except socket.error as e:
                         self._event_close(fd)
-                elif fd == self._alarm_poll.fileno():
-                    commands = self._alarm_poll.recv(self.rsize)
-                    for c in commands:
-                        data = self._alarm.pop()
+                if fd == alarm_fd:
+                    for command, data in self._alarm.pop_all():
                         try:
-                            switch[c](data)
+                            switch[command](data)
                         except socket.error as e:
-                            self._event_close(fd)
+                            log_p.error("alarm command %r got exception %s" %
+                                        (command, e))
+                elif not mask & selectors.EVENT_READ or fd not in self.sockets:
+                    # Nothing to read, or fd was closed by write handler
+                    continue
+                elif fd in self.listeners:
+                    try:
+                        self._event_connect_incoming(fd)
+                    except socket.error as e:
+                        self._event_close(fd)
                 else:
                     try:
                         data = self.sockets[fd].recv_records(self.rsize)
                     except socket.error:
                         data = None
+                    except RecordTooLarge as e:
+                        log_p.warning("%s: %s" % (self.sockets[fd], e))
+                        data = None
                     if data is not None:
                         self._event_read(data, fd)
                     else:
                         self._event_close(fd)
         for s in self.sockets.values():
             s.close()
+        self._selector.close()
+        self._alarm.close()
+        if self.dispatch is not None:
+            self.dispatch.stop()
 
     def stop(self):
         self._alarm.buzz(b'\x02', None)
 
-    def _event_connect_incoming(self, fd, internal=False):
+    def _event_connect_incoming(self, fd):
         """Someone else is trying to connect to us (we act like server)."""
         s = self.sockets[fd]
         try:
-            if internal:
-                # We are accepting from the same thread that tried to connect.
-                # In linux this works, but in Windows it raises EWOULDBLOCK
-                # if we don't do this
-                s.setblocking(1)
-                csock, caddr = s.accept()
-                s.setblocking(0)
-            else:
-                csock, caddr = s.accept()
+            csock, caddr = s.accept()
         except socket.error as e:
             log_p.error("accept() got error %s" % str(e))
             return
         csock.setblocking(0)
         fd = csock.fileno()
         pipe = self.sockets[fd] = RpcPipe(csock, self._alarm)
+        pipe.max_record = self.max_record
+        pipe.stats = self.stats
         log_p.info("got connection from %s, assigned to fd=%i" %
              (csock.getpeername(), fd))
         # Start listening for data to come in on new connection
-        self.readlist.add(fd)
-        self.errlist.add(fd)
+        self._selector.register(fd, selectors.EVENT_READ)
         return pipe
 
     def _event_close(self, fd):
         """Close the connection, and remove references to it."""
         log_p.info("Closing %i" % fd)
-        temp = set([fd])
-        self.writelist -= temp
-        self.readlist -= temp
-        self.errlist -= temp
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        self._writing.discard(fd)
+        self._held.pop(fd, None)
+        self.listeners.discard(fd)
         self.sockets[fd].clear_active()
         self.sockets[fd].close()
         del self.sockets[fd]
@@ -585,7 +1253,8 @@ class ConnectionHandler(object):
     def _event_write(self, fd):
         """Data is waiting to be written."""
         if self.sockets[fd].flush_pipe():
-            self.writelist.remove(fd)
+            self._writing.discard(fd)
+            self._set_events(fd)
             log_p.log(5, "Finished writing to %i" % fd)
 
     def _event_read(self, records, fd):
@@ -594,26 +1263,41 @@ class ConnectionHandler(object):
         For each full RPC record, then dispatch it to a thread.
         """
         s = self.sockets[fd]
+        stats = self.stats
+        held = self._held.get(fd)
         for r in records:
             log_p.log(5, "Received record from %i" % fd)
             log_p.log(2, repr(r))
-            t = threading.Thread(target=self._event_rpc_record, args=(r, s))
-            t.setDaemon(True)
-            t.start()
+            timer = stats.timer() if stats.enabled else None
+            if self.dispatch is not None:
+                if held is None and \
+                   self.dispatch.submit(self._event_rpc_record, r, s, timer):
+                    continue
+                if held is None:
+                    # The queue is full, so stop reading from fd until
+                    # there is room, see _buzz_dispatch_room
+                    held = self._held[fd] = Deque()
+                    self._set_events(fd)
+                    self._wait_for_room()
+                held.append((r, timer))
+            else:
+                t = threading.Thread(target=self._event_rpc_record,
+                                     args=(r, s, timer))
+                t.setDaemon(True)
+                t.start()
 
-    def _event_rpc_record(self, record, pipe):
+    def _event_rpc_record(self, record, pipe, timer=None):
         """Deal with an incoming RPC record.
 
-        This is run in its own thread.
+        This is run in a worker thread.  timer is an rpcstats.CallTimer
+        started when the record arrived, if stats are enabled.
         """
+        if timer is not None:
+            timer.mark("queue")
         log_t.log(5, "_event_rpc_record thread receives %r" % record)
         # log_t.info("_event_rpc_record thread receives %r" % record)
         try:
-            p = FancyRPCUnpacker(record)
-            msg = p.unpack_rpc_msg() # RPC header
-            msg_data = record[p.get_position():] # RPC payload
-            # Remember length of the header
-            msg.length = p.get_position()
+            msg, msg_data = self._unpack_record(record)
         except (rpc_pack.XDRError, EOFError) as e:
             log_t.warn("XDRError: %s, dropping packet" % e)
             log_t.debug("unpacking raised the following error", exc_info=True)
@@ -624,12 +1308,24 @@ class ConnectionHandler(object):
         if msg.mtype == REPLY:
             self._event_rpc_reply(msg, msg_data, pipe)
         elif msg.mtype == CALL:
-            self._event_rpc_call(msg, msg_data, pipe)
+            self._event_rpc_call(msg, msg_data, pipe, timer)
         else:
             # Shouldn't get here, but doesn't hurt
             log_t.error("Received rpc_record with msg.type=%i" % msg.type)
             self._notify_drop()
 
+    def _unpack_record(self, record):
+        """Split record into unpacked RPC header and raw procedure data."""
+        p = FancyRPCUnpacker(record)
+        msg = p.unpack_rpc_msg() # RPC header
+        if self.zerocopy:
+            msg_data = memoryview(record)[p.get_position():] # RPC payload
+        else:
+            msg_data = record[p.get_position():] # RPC payload
+        # Remember length of the header
+        msg.length = p.get_position()
+        return msg, msg_data
+
     def _event_rpc_reply(self, msg, msg_data, pipe):
         """Deal with an incoming RPC REPLY.
 
@@ -641,7 +1337,7 @@ class ConnectionHandler(object):
         except Exception:
             self._notify_drop()
 
-    def _event_rpc_call(self, msg, msg_data, pipe):
+    def _event_rpc_call(self, msg, msg_data, pipe, timer=None):
         """Deal with an incoming RPC CALL.
 
         msg is unpacked header, with length fields added.
@@ -651,76 +1347,145 @@ class ConnectionHandler(object):
 
         This is run in its own thread.
         """
-        class XXX(object):
-            pass
-        call_info = XXX() # Store various info we need to pass to procedure
-        call_info.header_size = msg.length
-        call_info.payload_size = len(msg_data)
-        call_info.connection = pipe
-        call_info.raw_cred = msg.body.cred
         notify = None
+        error = False
+        request_size = msg.length + len(msg_data)
+        drc_key = None
+        if self.drc is not None and self.drc.wants(msg):
+            drc_key = self.drc.make_key(pipe, msg, msg_data)
+            cached = self.drc.start(drc_key)
+            if cached is not None:
+                # A retransmit, so reuse the original reply
+                try:
+                    with blocking():
+                        record = cached.result(self.drc.wait_timeout)
+                except concurrent.futures.TimeoutError:
+                    record = None
+                if record is None:
+                    self._notify_drop()
+                else:
+                    pipe.push_record(record)
+                return
         try:
-            # Check for reasons to DENY the call
-            try:
-                self._check_rpcvers(msg)
-                call_info.credinfo = self._check_auth(msg, msg_data)
-            except rpclib.RPCFlowContol:
-                raise
-            except Exception:
-                log_t.warn("Problem with incoming call, returning AUTH_FAILED",
-                           exc_info=True)
-                raise rpclib.RPCDeniedReply(AUTH_ERROR, AUTH_FAILED)
-            # Call has been ACCEPTED, now check for reasons not to succeed
-            sec = call_info.credinfo.sec
-            msg_data = sec.unsecure_data(msg.body.cred, msg_data)
-            if not self._check_program(msg.prog):
-                log_t.warn("PROG_UNAVAIL, do not support prog=%i" % msg.prog)
-                raise rpclib.RPCUnsuccessfulReply(PROG_UNAVAIL)
-            low, hi = self._version_range(msg.prog)
-            if not self._check_version(low, hi, msg.vers):
-                log_t.warn("PROG_MISMATCH, do not support vers=%i" % msg.vers)
-                raise rpclib.RPCUnsuccessfulReply(PROG_MISMATCH, (low, hi))
-            method = self._find_method(msg)
-            if method is None:
-                log_t.warn("PROC_UNAVAIL for vers=%i, proc=%i" %
-                           (msg.vers, msg.proc))
-                raise rpclib.RPCUnsuccessfulReply(PROC_UNAVAIL)
+            method, msg_data, call_info = self._prepare_call(msg, msg_data,
+                                                             pipe)
+            if timer is not None:
+                timer.mark("auth")
             # Everything looks good at this layer, time to do the call
             tuple = method(msg_data, call_info)
-            if len(tuple) == 2:
-                status, result = tuple
-            else:
-                status, result, notify = tuple
-            if result is None:
-                result = b''
-            if isinstance(result, str):
-                result = bytes(result, encoding='UTF-8')
-
-            if not isinstance(result, bytes):
-                raise TypeError("Expected bytes, got %s" % type(result))
-            # status, result = method(msg_data, call_info)
-            log_t.debug("Called method, got %r, %r" % (status, result))
+            if timer is not None:
+                timer.mark("handler")
+            body, data, notify = self._make_reply(msg, call_info, tuple)
+            if timer is not None:
+                timer.mark("auth")
         except rpclib.RPCDrop:
             # Silently drop the request
+            if drc_key is not None:
+                self.drc.abandon(drc_key)
             self._notify_drop()
             return
         except rpclib.RPCFlowContol as e:
             body, data = e.body()
+            error = True
         except Exception:
             log_t.warn("Unexpected exception", exc_info=True)
             body, data = rpclib.RPCUnsuccessfulReply(SYSTEM_ERR).body()
+            error = True
+        done = None
+        if timer is not None:
+            timer.key = self._stats_key(msg)
+            done = timer.flushed
+        if drc_key is None:
+            size = pipe.send_reply(msg.xid, body, data, done)
         else:
-            try:
-                data = sec.secure_data(msg.body.cred, result)
-                verf = sec.make_reply_verf(msg.body.cred, status)
-                areply = accepted_reply(verf, rpc_reply_data(status, b''))
-                body = reply_body(MSG_ACCEPTED, areply=areply)
-            except Exception:
-                body, data = rpclib.RPCUnsuccessfulReply(SYSTEM_ERR).body()
-        pipe.send_reply(msg.xid, body, data)
+            record = self._reply_record(msg.xid, body, data)
+            self.drc.finish(drc_key, record)
+            pipe.push_record(record, done)
+            size = len(record[0]) + len(record[1])
+        if timer is not None:
+            timer.finish(request_size, size, error)
         if notify is not None:
             notify()
 
+    def _reply_record(self, xid, body, data):
+        """Return the encoded REPLY, as a (header, data) record"""
+        p = FancyRPCPacker()
+        p.pack_rpc_msg(rpc_msg(xid, rpc_msg_body(REPLY, rbody=body)))
+        return (p.get_buffer(), data)
+
+    def _stats_key(self, msg):
+        """The key used by self.stats for an incoming call"""
+        return (msg.prog, msg.vers, msg.proc, msg.body.cred.flavor)
+
+    def _prepare_call(self, msg, msg_data, pipe):
+        """Check an incoming CALL, and find the method to handle it.
+
+        Returns (method, unsecured procedure data, call_info), or raises
+        an rpclib.RPCFlowContol exception describing the reply to send.
+        """
+        class XXX(object):
+            pass
+        call_info = XXX() # Store various info we need to pass to procedure
+        call_info.header_size = msg.length
+        call_info.payload_size = len(msg_data)
+        call_info.connection = pipe
+        call_info.raw_cred = msg.body.cred
+        # Check for reasons to DENY the call
+        try:
+            self._check_rpcvers(msg)
+            call_info.credinfo = self._check_auth(msg, msg_data)
+        except rpclib.RPCFlowContol:
+            raise
+        except Exception:
+            log_t.warn("Problem with incoming call, returning AUTH_FAILED",
+                       exc_info=True)
+            raise rpclib.RPCDeniedReply(AUTH_ERROR, AUTH_FAILED)
+        # Call has been ACCEPTED, now check for reasons not to succeed
+        sec = call_info.credinfo.sec
+        msg_data = sec.unsecure_data(msg.body.cred, msg_data)
+        if not self._check_program(msg.prog):
+            log_t.warn("PROG_UNAVAIL, do not support prog=%i" % msg.prog)
+            raise rpclib.RPCUnsuccessfulReply(PROG_UNAVAIL)
+        low, hi = self._version_range(msg.prog)
+        if not self._check_version(low, hi, msg.vers):
+            log_t.warn("PROG_MISMATCH, do not support vers=%i" % msg.vers)
+            raise rpclib.RPCUnsuccessfulReply(PROG_MISMATCH, (low, hi))
+        method = self._find_method(msg)
+        if method is None:
+            log_t.warn("PROC_UNAVAIL for vers=%i, proc=%i" %
+                       (msg.vers, msg.proc))
+            raise rpclib.RPCUnsuccessfulReply(PROC_UNAVAIL)
+        return method, msg_data, call_info
+
+    def _make_reply(self, msg, call_info, tuple):
+        """Turn the return value of a handle_* method into a reply.
+
+        Returns (body, data, notify).
+        """
+        notify = None
+        if len(tuple) == 2:
+            status, result = tuple
+        else:
+            status, result, notify = tuple
+        if result is None:
+            result = b''
+        if isinstance(result, str):
+            result = bytes(result, encoding='UTF-8')
+
+        if not isinstance(result, bytes):
+            raise TypeError("Expected bytes, got %s" % type(result))
+        # status, result = method(msg_data, call_info)
+        log_t.debug("Called method, got %r, %r" % (status, result))
+        sec = call_info.credinfo.sec
+        try:
+            data = sec.secure_data(msg.body.cred, result)
+            verf = sec.make_reply_verf(msg.body.cred, status)
+            areply = accepted_reply(verf, rpc_reply_data(status, b''))
+            body = reply_body(MSG_ACCEPTED, areply=areply)
+        except Exception:
+            body, data = rpclib.RPCUnsuccessfulReply(SYSTEM_ERR).body()
+        return body, data, notify
+
     def _notify_drop(self):
         """Debugging hook called when a request is dropped."""
         log_t.warn("Dropped request")
@@ -811,6 +1576,26 @@ class ConnectionHandler(object):
         If secure==True, will bind local asocket to a port < 1024.
         """
         log_t.info("Called connect(%r)" % (address,))
+        s = self._connect_socket(address, secure)
+        pipe = RpcPipe(s, self._alarm)
+        pipe.stats = self.stats
+        pipe.max_record = self.max_record
+        # Tell polling loop about the new socket
+        defer = DeferredData()
+        self._alarm.buzz(b'\x01', (pipe, defer))
+        # Wait until polling loop knows about new socket
+        defer.wait()
+        return pipe
+
+    def connect_pool(self, address, count, secure=False):
+        """Make count connections to given address, returning a PipePool
+
+        The pool can be used wherever a pipe returned by connect can.
+        """
+        return PipePool(self, address, count, secure)
+
+    def _connect_socket(self, address, secure=False):
+        """Return a non-blocking socket connected to given address"""
         host, port = address
         err = None
         for res in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
@@ -829,13 +1614,7 @@ class ConnectionHandler(object):
                     s.close()
 
         s.setblocking(0)
-        pipe = RpcPipe(s, self._alarm)
-        # Tell polling loop about the new socket
-        defer = DeferredData()
-        self._alarm.buzz(b'\x01', (pipe, defer))
-        # Wait until polling loop knows about new socket
-        defer.wait()
-        return pipe
+        return s
 
     def bindsocket(self, s, port=1):
         """Scan up through ports, looking for one we can bind to"""
@@ -863,17 +1642,16 @@ class ConnectionHandler(object):
         s.bind(address)
         s.setblocking(0)
         s.listen(5)
-        self.listeners.add(s.fileno()) # XXX BUG - never removed
+        self.listeners.add(s.fileno()) # Removed by _event_close
         if safe:
             # Tell polling loop about the new socket
             defer = DeferredData()
-            self._alarm.buzz('\x01', (s, defer))
+            self._alarm.buzz(b'\x01', (s, defer))
             # Wait until polling loop knows about new socket
             defer.wait()
         else:
             # This should only be called before start is run
-            self.readlist.add(s.fileno())
-            self.errlist.add(s.fileno())
+            self._selector.register(s.fileno(), selectors.EVENT_READ)
             # A list of all sockets we have open, indexed by fileno
             self.sockets[s.fileno()] = s
         return s
@@ -897,11 +1675,17 @@ class ConnectionHandler(object):
 #################################################
 
 class Server(ConnectionHandler):
-    def __init__(self, prog, versions, port, interface=''):
-        ConnectionHandler.__init__(self)
+    """Serve the given versions of program prog.
+
+    If drc is a ReplyCache, it is used to answer retransmitted calls.
+    """
+    def __init__(self, prog, versions, port, interface='', drc=None,
+                 **kwargs):
+        ConnectionHandler.__init__(self, **kwargs)
         self.prog = prog
         self.versions = versions # List of supported versions of prog
         self.default_cred = security.CredInfo()
+        self.drc = drc
         try:
             # This listens on both AF_INET and AF_INET6
             self.expose((interface, port), socket.AF_INET6, False)
@@ -926,8 +1710,9 @@ class Server(ConnectionHandler):
         return method
 
 class Client(ConnectionHandler):
-    def __init__(self, program=None, version=None, secureport=False):
-        ConnectionHandler.__init__(self)
+    def __init__(self, program=None, version=None, secureport=False,
+                 **kwargs):
+        ConnectionHandler.__init__(self, **kwargs)
         self.default_prog = program
         self.default_vers = version
         self.default_cred = security.CredInfo()
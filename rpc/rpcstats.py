@@ -0,0 +1,221 @@
+"""Per-procedure RPC statistics.
+
+Each ConnectionHandler owns an RPCStats, which is disabled by default.
+When enabled it keeps, for each (prog, vers, proc, flavor), a count of
+calls and histograms of request and reply sizes and of the time spent
+in each phase of handling a call:
+
+server side (calls received):
+    queue   - waiting for a worker to pick up the record
+    auth    - _check_auth, and unsecuring/securing the data
+    handler - the handle_<proc> method
+    flush   - from the reply being queued until it is written to the socket
+
+client side (calls sent):
+    wait    - from sending the call until the reply arrives
+
+Histograms use power of 2 buckets, of microseconds or bytes.
+"""
+from __future__ import absolute_import
+
+import time
+import json
+import threading
+import logging
+import os
+
+log = logging.getLogger("rpc.stats")
+
+SERVER_PHASES = ("queue", "auth", "handler", "flush")
+CLIENT_PHASES = ("wait",)
+
+class Histogram(object):
+    """Counts of values, bucketed by powers of 2.
+
+    Bucket i holds values v with 2**(i-1) <= v < 2**i, bucket 0 holds 0.
+    """
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        value = int(value)
+        self.buckets[min(value.bit_length(), 63)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        """Return dictionary, listing only the non-empty buckets by upper bound"""
+        return {"count" : self.count,
+                "total" : self.total,
+                "max" : self.max,
+                "buckets" : dict((1 << i, n) for i, n in
+                                 enumerate(self.buckets) if n),
+                }
+
+class ProcStats(object):
+    """Statistics for one (prog, vers, proc, flavor)"""
+    def __init__(self, phases):
+        self.calls = 0
+        self.errors = 0 # Calls which did not get a SUCCESS reply
+        self.request_bytes = Histogram()
+        self.reply_bytes = Histogram()
+        self.latency = dict((phase, Histogram()) for phase in phases)
+
+    def snapshot(self):
+        return {"calls" : self.calls,
+                "errors" : self.errors,
+                "request_bytes" : self.request_bytes.snapshot(),
+                "reply_bytes" : self.reply_bytes.snapshot(),
+                "latency_us" : dict((phase, h.snapshot()) for phase, h in
+                                    self.latency.items()),
+                }
+
+class CallTimer(object):
+    """Timestamps taken while one incoming call is handled.
+
+    mark(phase) charges the time since the previous mark to phase.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+        self.key = None # Set once the call header is unpacked
+        self.last = time.monotonic()
+        self.times = {}
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.times[phase] = self.times.get(phase, 0) + now - self.last
+        self.last = now
+
+    def flushed(self):
+        """Called once the reply has been written out"""
+        self.stats._add_time(self.stats.server, SERVER_PHASES, self.key,
+                             "flush", time.monotonic() - self.last)
+
+    def finish(self, request_size, reply_size, error=False):
+        """Record the call, with the times marked so far"""
+        self.stats._record(self.stats.server, SERVER_PHASES, self.key,
+                           request_size, reply_size, self.times, error)
+
+class RPCStats(object):
+    """Counters and histograms keyed by (prog, vers, proc, flavor).
+
+    Nothing is collected until enable() is called.  Callers check
+    self.enabled before doing any timing, so a disabled RPCStats costs
+    a single attribute lookup per record.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock() # Protects fields below
+        self.server = {} # {key: ProcStats} for calls received
+        self.client = {} # {key: ProcStats} for calls sent
+        self.started = time.time()
+        self.extra = {} # {name: function returning a dict}, for snapshots
+        self._dumper = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.server = {}
+            self.client = {}
+            self.started = time.time()
+
+    def timer(self):
+        """Return a CallTimer for a newly received call, or None if disabled"""
+        if not self.enabled:
+            return None
+        return CallTimer(self)
+
+    def record_reply(self, key, wait, request_size, reply_size, error=False):
+        """Record a reply to a call we sent, which took wait seconds"""
+        self._record(self.client, CLIENT_PHASES, key, request_size,
+                     reply_size, {"wait" : wait}, error)
+
+    def _record(self, table, phases, key, request_size, reply_size,
+                times, error):
+        with self._lock:
+            stats = self._get(table, phases, key)
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            stats.request_bytes.add(request_size)
+            stats.reply_bytes.add(reply_size)
+            for phase, seconds in times.items():
+                stats.latency[phase].add(seconds * 1000000)
+
+    def _add_time(self, table, phases, key, phase, seconds):
+        with self._lock:
+            self._get(table, phases, key).latency[phase].add(seconds * 1000000)
+
+    def _get(self, table, phases, key):
+        """Return ProcStats for key, creating it if needed.  Hold self._lock"""
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = ProcStats(phases)
+        return stats
+
+    def snapshot(self):
+        """Return the statistics as a dictionary, suitable for json.dump.
+
+        Procedures are keyed by "prog/vers/proc/flavor".
+        """
+        def table(t):
+            return dict(("%i/%i/%i/%i" % key, s.snapshot())
+                        for key, s in t.items())
+        with self._lock:
+            snap = {"time" : time.time(),
+                    "started" : self.started,
+                    "enabled" : self.enabled,
+                    "server" : table(self.server),
+                    "client" : table(self.client),
+                    }
+        for name, funct in self.extra.items():
+            snap[name] = funct()
+        return snap
+
+    def dump(self, path=None):
+        """Write snapshot as JSON to path, or if None, to the log"""
+        snap = self.snapshot()
+        if path is None:
+            for side in ("server", "client"):
+                for key, s in sorted(snap[side].items()):
+                    phases = ", ".join(["%s=%ius" % (p, h["total"] // h["count"])
+                                        for p, h in sorted(s["latency_us"].items())
+                                        if h["count"]])
+                    log.info("%s %s: calls=%i errors=%i req=%iB rep=%iB %s" %
+                             (side, key, s["calls"], s["errors"],
+                              s["request_bytes"]["total"],
+                              s["reply_bytes"]["total"], phases))
+            for name in sorted(self.extra):
+                log.info("%s: %s" % (name, ", ".join(["%s=%s" % item for item
+                                                      in sorted(snap[name].items())])))
+            return
+        tmp = "%s.tmp" % path
+        with open(tmp, "w") as fd:
+            json.dump(snap, fd, indent=1, sort_keys=True)
+        os.rename(tmp, path)
+
+    def start_dump(self, interval, path=None):
+        """Enable collection, and dump every interval seconds from a thread"""
+        self.enable()
+        if self._dumper is not None:
+            return
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except Exception:
+                    log.error("Dumping stats failed", exc_info=True)
+        self._dumper = threading.Thread(target=loop, name="RPCStatsDump")
+        self._dumper.setDaemon(True)
+        self._dumper.start()
@@ -3,7 +3,7 @@ from rpc_const import AUTH_NONE, AUTH_SYS, RPCSEC_GSS, SUCCESS, CALL, \
 from rpc_type import opaque_auth, authsys_parms
 from rpc_pack import RPCPacker, RPCUnpacker
 from gss_pack import GSSPacker, GSSUnpacker
-from xdrlib import Packer, Unpacker
+from xdrrt import Packer, Unpacker
 import rpclib
 from gss_const import *
 import gss_type
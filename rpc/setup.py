@@ -31,17 +31,11 @@ class build_py(_build_py):
                 self.build_module(module, module_file, package)
 
     def expand_xdr(self, dir):
-        cwd = os.getcwd()
-        try:
-            if dir:
-                os.chdir(dir)
-            xdr_files = glob(os.path.join(dir, "*.x"))
-            for f in xdr_files:
-                # Can conditionalize this
-                # XXX need some way to pass options here
-                xdrgen.run(f)
-        finally:
-            os.chdir(cwd)
+        xdr_files = glob(os.path.join(dir, "*.x"))
+        # Files are only regenerated if they or xdrgen changed
+        # XXX need some way to pass options here
+        if xdrgen.run_many(xdr_files):
+            raise RuntimeError("xdrgen failed in %r" % dir)
 
 setup(name = "rpc",
       version = "0.0.0", # import this?
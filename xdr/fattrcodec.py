@@ -0,0 +1,76 @@
+"""Conversion between NFSv4 fattr4 objects and dictionaries {bitnum:value}.
+
+This is shared by the nfs4.0 and nfs4.1 trees, each of which makes a
+FattrCodec from its own generated packer, unpacker and fattr4 type.
+"""
+
+def list2bitmap(list):
+    """Construct a bitmap from a list of bit numbers"""
+    mask = 0
+    for bit in list:
+        mask |= 1 << bit
+    return mask
+
+def bitmap2list(bitmap):
+    """Return (sorted) list of bit numbers set in bitmap"""
+    out = []
+    while bitmap:
+        low = bitmap & -bitmap # Lowest set bit
+        out.append(low.bit_length() - 1)
+        bitmap ^= low
+    return out
+
+class FattrCodec(object):
+    """Convert between fattr4 objects and dictionaries {bitnum:value}.
+
+    names is a dictionary {bitnum:attribute name}, and each attribute is
+    converted by the packer's pack_fattr4_<name> and the unpacker's
+    unpack_fattr4_<name>.
+
+    For each attribute mask seen, a plan is made and cached: the ordered
+    tuple of (bitnum, pack, unpack), with pack and unpack the packer and
+    unpacker class functions for the attribute.  Converting is then just
+    a run through the plan with a single packer or unpacker.
+    """
+    max_plans = 1024 # Peers choose the masks, so limit the cache size
+
+    def __init__(self, packer, unpacker, fattr4, names):
+        self.packer = packer
+        self.unpacker = unpacker
+        self.fattr4 = fattr4
+        self.names = names
+        self.plans = {} # {attrmask: plan}
+
+    def plan(self, attrmask):
+        """Return the plan for attrmask.
+
+        Raises KeyError if attrmask has a bit which is not an attribute.
+        """
+        plan = self.plans.get(attrmask)
+        if plan is None:
+            names = self.names
+            plan = tuple([(bitnum,
+                           getattr(self.packer, "pack_fattr4_" + names[bitnum]),
+                           getattr(self.unpacker,
+                                   "unpack_fattr4_" + names[bitnum]))
+                          for bitnum in bitmap2list(attrmask)])
+            if len(self.plans) >= self.max_plans:
+                self.plans.clear()
+            self.plans[attrmask] = plan
+        return plan
+
+    def encode(self, dict):
+        """Return a fattr4 object holding the attributes in dict"""
+        attrmask = list2bitmap(dict)
+        packer = self.packer()
+        for bitnum, pack, unpack in self.plan(attrmask):
+            pack(packer, dict[bitnum])
+        return self.fattr4(attrmask, packer.get_buffer())
+
+    def decode(self, obj):
+        """Return the dictionary of attributes held in fattr4 object obj"""
+        unpacker = self.unpacker(obj.attr_vals)
+        result = {bitnum: unpack(unpacker)
+                  for bitnum, pack, unpack in self.plan(obj.attrmask)}
+        unpacker.done()
+        return result
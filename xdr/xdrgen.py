@@ -221,6 +221,9 @@ except:
     from io import StringIO
 import time
 import os
+import shutil
+import struct
+import hashlib
 # Allow to be run stright from package
 if  __name__ == "__main__":
     if os.path.isfile(os.path.join(sys.path[0], 'lib', 'testmod.py')):
@@ -725,10 +728,11 @@ class Info(object):
     def pack_output(Self):
         return None
 
-    def _get_filter(self):
+    def _get_filter(self, prefix=indent2):
         if use_filters:
-            filter1 = "%sif hasattr(self, 'filter_%s'):\n" % (indent2, self.id)
-            filter2 = "%sdata = getattr(self, 'filter_%s')(data)\n" % (indent*3, self.id)
+            filter1 = "%sif hasattr(self, 'filter_%s'):\n" % (prefix, self.id)
+            filter2 = "%s%sdata = getattr(self, 'filter_%s')(data)\n" % \
+                      (prefix, indent, self.id)
             return filter1 + filter2
         else:
             return ''
@@ -765,12 +769,49 @@ class Info(object):
         else:
             return "const." + value
 
+    def typeslots(self, varlist, prefix=indent):
+        """Return __slots__ declaration, if use_slots is set"""
+        if not use_slots:
+            return ''
+        names = []
+        for var in varlist + list(extra_slots.get(self.id, [])):
+            name = getattr(var, "id", var)
+            if name not in names:
+                names.append(name)
+        return "%s__slots__ = (%s)\n" % \
+               (prefix, ''.join(["%r, " % name for name in names]).rstrip())
+
     def typeinit(self, varlist, prefix=indent):
         initargs = ''.join([", %s=None" % var.id for var in varlist])
         initvars = ''.join(["%s%sself.%s = %s\n" % (prefix, indent, var.id, var.id)
                             for var in varlist])
         return "%sdef __init__(self%s):\n%s" % (prefix, initargs, initvars)
 
+    def typeeq(self, varlist, hashable=False, prefix=indent):
+        """Return __eq__ comparing field values, and also __hash__ of them
+        if hashable.  Without __hash__, instances are unhashable.
+        """
+        names = [var.id for var in varlist]
+        indent2 = prefix + indent
+        if names:
+            test = (" and\n%s%s" % (indent2, ' ' * 8)).join(
+                ["self.%s == other.%s" % (name, name) for name in names])
+            test = "(%s)" % test
+        else:
+            test = "True"
+        out = "%sdef __eq__(self, other):\n" \
+              "%sif other.__class__ is not self.__class__:\n" \
+              "%s%sreturn NotImplemented\n" \
+              "%sreturn %s\n" % \
+              (prefix, indent2, indent2, indent, indent2, test)
+        if hashable:
+            fields = ', '.join(["self.%s" % name for name in names])
+            if len(names) == 1:
+                fields += ','
+            out += "\n%sdef __hash__(self):\n%sreturn hash((%s))\n" % \
+                   (prefix, indent2, fields)
+        return out
+
 ##     def typerepr(self, varlist, prefix=indent):
 ##         indent2 = prefix + indent
 ##         reprbody = ''.join(["%sif self.%s is not None:\n" \
@@ -856,27 +897,19 @@ class Info(object):
 
     def packenum(self, prefix, data='data'):
         prefix, data, subheader, array = self._array_pack(prefix, data)
-        varlist = ["const.%s" % l.id for l in self.body]
-        check = "%sif self.check_enum and %s not in [%s]:\n" \
-                "%s%sraise XDRError('value=%%s not in enum %s' %% %s)\n" % \
-                (prefix, data, ', '.join(varlist),
-                 prefix, indent, self.id, data)
+        check = enum_check(prefix, data, self.id, self.body)
         pack = check + "%sself.pack_int(%s)\n" % (prefix, data)
         return subheader + pack + array
 
     def unpackenum(self, prefix, data='data'):
         prefix, data, subheader, array = self._array_unpack(prefix, data)
-        varlist = ["const.%s" % l.id for l in self.body]
-        check = "%sif self.check_enum and %s not in [%s]:\n" \
-                "%s%sraise XDRError('value=%%s not in enum %s' %% %s)\n" % \
-                (prefix, data, ', '.join(varlist),
-                 prefix, indent, self.id, data)
+        check = enum_check(prefix, data, self.id, self.body)
         unpack = "%s%s = self.unpack_int()\n" % (prefix, data)
         return subheader + unpack + check + array
 
     def packstruct(self, prefix, data='data'):
         prefix, data, subheader, array = self._array_pack(prefix, data)
-        pack = ''.join( [l.packout(prefix, data) for l in self.body] )
+        pack = pack_fields(self.body, prefix, data)
         return subheader + pack + array
 
     def unpackstruct(self, prefix, data='data'):
@@ -885,14 +918,69 @@ class Info(object):
             classname = "types.%s" % self.id
         else:
             classname = 'nullclass'
-        unpack = "%s%s = %s()\n" % (prefix, data, classname) + \
-                 ''.join( [l.unpackout(prefix, data) for l in self.body] )
+        unpack = "%s%s = %s()\n" % (prefix, data, classname)
+        unpack += unpack_fields(self.body, prefix, data)
         return subheader + unpack + array
 
+    def linked(self):
+        """Return the struct name, if this declaration is an optional
+        pointer to a self-linked struct (see linked_field), else None.
+        """
+        if self.array and not self.fixed and self.type in linked_structs \
+           and const_value(self.len) == 1:
+            return self.type
+        return None
+
+    def use_dispatch(self):
+        """Should arms be chosen by dict lookup, rather than if/elif?
+
+        Only done for named unions, whose arms can be class methods.
+        """
+        return isinstance(self, union_info) and not self.array and \
+               len(self.body) - 2 >= dispatch_arms
+
+    def union_arms(self, mode):
+        """Return class body code defining a method for each arm of
+        the union, and a dict mapping case values to them.
+        """
+        out = ''
+        table = []
+        for i, l in enumerate(self.body[1:-1]):
+            name = "_%s_%s_arm%i" % (mode, self.id, i)
+            body = ''.join([getattr(d, mode + "out")(indent2)
+                            for d in l.declarations])
+            if not body:
+                body = "%spass\n" % indent2
+            out += "%sdef %s(self, data):\n%s\n" % (indent, name, body)
+            table += ["%s%s%s : %s,\n" % (indent, indent, self.fullname(c), name)
+                      for c in l.cases]
+        return out + "%s_%s_arms_%s = {\n%s%s}\n\n" % \
+               (indent, mode, self.id, ''.join(table), indent)
+
+    def union_dispatch(self, mode, prefix, data):
+        """Code calling the union arm chosen by the switch value"""
+        switch = self.body[0].declarations[0]
+        out = "%sarm = self._%s_arms_%s.get(%s.%s)\n" \
+              "%sif arm is not None:\n" \
+              "%s%sarm(self, %s)\n" \
+              "%selse:\n" % (prefix, mode, self.id, data, switch.id,
+                              prefix, prefix, indent, data, prefix)
+        default = self.body[-1].declarations
+        if default != []:
+            out += ''.join([getattr(d, mode + "out")(prefix + indent, data)
+                            for d in default])
+        else:
+            out += "%s%sraise XDRError('bad switch=%%s' %% %s.%s)\n" % \
+                   (prefix, indent, data, switch.id)
+        return out
+
     def packunion(self, prefix, data='data'):
         prefix, data, subheader, array = self._array_pack(prefix, data)
         switch = self.body[0].declarations[0]
         pack = switch.packout(prefix, data)
+        if self.use_dispatch():
+            pack += self.union_dispatch("pack", prefix, data)
+            return subheader + pack + array
         first = ''
         for l in self.body[1:-1]:
             cases = ' or '.join(["%s.%s == %s" %
@@ -921,6 +1009,9 @@ class Info(object):
         unpack = "%s%s = %s()\n" % (prefix, data, classname)
         switch = self.body[0].declarations[0]
         unpack += switch.unpackout(prefix, data)
+        if self.use_dispatch():
+            unpack += self.union_dispatch("unpack", prefix, data)
+            return subheader + unpack + array
         first = ''
         for l in self.body[1:-1]:
             cases = ' or '.join(["%s.%s == %s" %
@@ -955,6 +1046,142 @@ class Info(object):
 
         return subheader + unpack + array
 
+    def sizeof_output(self):
+        return None
+
+    def _get_sizeof_header(self):
+        header = "%sdef sizeof_%s(self, data):\n" % (indent, self.id)
+        return header + self._get_filter()
+
+    def _sizeof_packed(self):
+        """sizeof_ method for types whose size is found by packing"""
+        return "%sdef sizeof_%s(self, data):\n" \
+               "%sreturn self._sizeof_packed('%s', data)\n" % \
+               (indent, self.id, indent2, self.id)
+
+    def sizeout(self, prefix, value):
+        """Return (size, code) for the encoded size of the declaration,
+        whose python value is given by the expression value.
+
+        size is the part known now, and code adds the rest to the local
+        variable size.
+        """
+        if self.type == 'void':
+            return 0, ''
+        if not self.array:
+            if self.type == 'enum':
+                return 4, ''
+            elif self.type == 'struct':
+                return size_decls(self.body, prefix, value)
+            elif self.type == 'union':
+                return self.sizeunion(prefix, value)
+            n = type_size(self.type)
+            if n is not None:
+                return n, ''
+            return 0, "%ssize += self.sizeof_%s(%s)\n" % \
+                   (prefix, self.type, value)
+        if self.linked():
+            return 0, "%ssize += self._sizeof_list_%s(%s)\n" % \
+                   (prefix, self.type, value)
+        if self.type in ('struct', 'union'):
+            # An array of an inline struct or union, sized item by item
+            return self.sizeinline(prefix, value)
+        if self.type in ('opaque', 'string'):
+            if not self.fixed:
+                return 4, "%ssize += (len(%s) + 3) & ~3\n" % (prefix, value)
+            n = const_value(self.len)
+            if n is not None:
+                return n + (-n % 4), ''
+            return 0, "%ssize += (%s + 3) & ~3\n" % \
+                   (prefix, self.fullname(self.len))
+        if self.type == 'enum':
+            elem = 4
+        else:
+            elem = type_size(self.type)
+        if self.fixed:
+            n = const_value(self.len)
+            if elem is None:
+                return 0, "%ssize += sum(map(self.sizeof_%s, %s))\n" % \
+                       (prefix, self.type, value)
+            elif n is None:
+                return 0, "%ssize += %s * %i\n" % \
+                       (prefix, self.fullname(self.len), elem)
+            return n * elem, ''
+        if elem is None:
+            return 4, "%ssize += sum(map(self.sizeof_%s, %s))\n" % \
+                   (prefix, self.type, value)
+        return 4, "%ssize += %i * len(%s)\n" % (prefix, elem, value)
+
+    def sizeinline(self, prefix, value):
+        """Return (size, code) for the encoded size of an array of an
+        inline struct or union"""
+        item = "item%i" % (len(prefix) // len(indent)) # Unique when nested
+        inner = prefix + indent
+        if self.type == 'struct':
+            elem, code = size_decls(self.body, inner, item)
+        else:
+            elem, code = self.sizeunion(inner, item)
+        head = (0 if self.fixed else 4)
+        if code:
+            if elem:
+                code = "%ssize += %i\n" % (inner, elem) + code
+            return head, "%sfor %s in %s:\n" % (prefix, item, value) + code
+        if self.fixed:
+            n = const_value(self.len)
+            if n is not None:
+                return n * elem, ''
+            return 0, "%ssize += %s * %i\n" % \
+                   (prefix, self.fullname(self.len), elem)
+        return 4, "%ssize += %i * len(%s)\n" % (prefix, elem, value)
+
+    def sizeunion(self, prefix, data):
+        """Return (size, code) for the encoded size of a union"""
+        switch = self.body[0].declarations[0]
+        size, code = switch.sizeout(prefix, "%s.%s" % (data, switch.id))
+        if self.use_dispatch():
+            code += "%sarm = self._sizeof_arms_%s.get(%s.%s)\n" \
+                    "%sif arm is not None:\n" \
+                    "%s%ssize += arm(self, %s)\n" % \
+                    (prefix, self.id, data, switch.id,
+                     prefix, prefix, indent, data)
+            first = 'el'
+        else:
+            first = ''
+            for l in self.body[1:-1]:
+                cases = ' or '.join(["%s.%s == %s" %
+                                     (data, switch.id, self.fullname(c))
+                                     for c in l.cases])
+                code += "%s%sif %s:\n" % (prefix, first, cases)
+                code += size_block(l.declarations, prefix + indent, data)
+                first = 'el'
+        default = self.body[-1].declarations
+        if not first:
+            # No case arms
+            return size, code + size_block(default, prefix, data)
+        code += "%selse:\n" % prefix
+        if default != []:
+            code += size_block(default, prefix + indent, data)
+        else:
+            code += "%s%sraise XDRError('bad switch=%%s' %% %s.%s)\n" % \
+                    (prefix, indent, data, switch.id)
+        return size, code
+
+    def sizeof_arms(self):
+        """Return class body code defining a method giving the size of
+        each arm of the union, and a dict mapping case values to them.
+        """
+        out = ''
+        table = []
+        for i, l in enumerate(self.body[1:-1]):
+            name = "_sizeof_%s_arm%i" % (self.id, i)
+            size, code = size_decls(l.declarations, indent2, 'data')
+            out += "%sdef %s(self, data):\n%s\n" % \
+                   (indent, name, size_return(size, code, indent2))
+            table += ["%s%s%s : %s,\n" % (indent, indent, self.fullname(c), name)
+                      for c in l.cases]
+        return out + "%s_sizeof_arms_%s = {\n%s%s}\n\n" % \
+               (indent, self.id, ''.join(table), indent)
+
     def xdrbody(self, prefix=''):
         """Return xdr code for the body (part between braces) of big 3 types"""
         body = ''
@@ -978,6 +1205,327 @@ class Info(object):
                                  for d in self.body[-1].declarations])
         return body
 
+# Encoded sizes of the basic fixed size types
+basic_sizes = {"int" : 4,
+               "uint" : 4,
+               "unsigned" : 4,
+               "hyper" : 8,
+               "uhyper" : 8,
+               "float" : 4,
+               "double" : 8,
+               "quadruple" : 8,
+               "bool" : 4,
+               }
+
+def type_size(name, seen=()):
+    """Return the encoded size of the named type, or None if it varies"""
+    if name in basic_sizes:
+        return basic_sizes[name]
+    info = name_dict.get(name)
+    if info is None or name in seen:
+        return None
+    seen += (name,)
+    if isinstance(info, enum_info):
+        if info.array:
+            return None
+        return 4
+    elif isinstance(info, struct_info):
+        if info.array:
+            return None
+        total = 0
+        for d in info.body:
+            n = decl_size(d, seen)
+            if n is None:
+                return None
+            total += n
+        return total
+    elif isinstance(info, type_info):
+        return decl_size(info, seen)
+    return None
+
+def decl_size(d, seen=()):
+    """Return the encoded size of declaration d, or None if it varies"""
+    if d.type == 'void':
+        return 0
+    if not d.array:
+        if d.type == 'enum':
+            return 4
+        elif d.type == 'struct':
+            sizes = [decl_size(x, seen) for x in d.body]
+            if None in sizes:
+                return None
+            return sum(sizes)
+        elif d.type == 'union':
+            return None
+        return type_size(d.type, seen)
+    if not d.fixed:
+        return None
+    n = const_value(d.len)
+    if n is None:
+        return None
+    if d.type == 'opaque':
+        return n + (-n % 4)
+    if d.type == 'enum':
+        return 4 * n
+    elem = type_size(d.type, seen)
+    if elem is None:
+        return None
+    return n * elem
+
+def size_decls(decls, prefix, data):
+    """Return (size, code) for the encoded size of a list of fields"""
+    size = 0
+    code = ''
+    for d in decls:
+        n, c = d.sizeout(prefix, "%s.%s" % (data, d.id))
+        size += n
+        code += c
+    return size, code
+
+def size_block(decls, prefix, data):
+    """Return code adding the encoded size of fields to size"""
+    size, code = size_decls(decls, prefix, data)
+    if size:
+        code = "%ssize += %i\n" % (prefix, size) + code
+    if not code:
+        code = "%spass\n" % prefix
+    return code
+
+def size_return(size, code, prefix):
+    """Return code returning size plus whatever code adds"""
+    if not code:
+        return "%sreturn %i\n" % (prefix, size)
+    return "%ssize = %i\n%s%sreturn size\n" % (prefix, size, code, prefix)
+
+def linked_field(info):
+    """Return the link field, if info is a struct whose last field is an
+    optional pointer to the struct's own type, as in:
+
+        struct entry4 {
+                ...
+                entry4          *nextentry;
+        };
+
+    Otherwise return None.
+    """
+    if not isinstance(info, struct_info) or info.array or not info.body:
+        return None
+    link = info.body[-1]
+    if link.array and not link.fixed and link.type == info.id and \
+       const_value(link.len) == 1:
+        return link
+    return None
+
+def enum_set(name, body):
+    """Return name of the module level frozenset of the enum's values"""
+    values = tuple(["const.%s" % l.id for l in body])
+    setname = enum_sets.get(values)
+    if setname is None:
+        setname = "_enum_%s" % name
+        while setname in enum_sets.values():
+            setname += "_"
+        enum_sets[values] = setname
+    return setname
+
+def enum_check(prefix, data, name, body):
+    """Return code raising XDRError if data is not one of the enum values"""
+    return "%sif self.check_enum and %s not in %s:\n" \
+           "%s%sraise XDRError('value=%%s not in enum %s' %% %s)\n" % \
+           (prefix, data, enum_set(name, body), prefix, indent, name, data)
+
+# struct format codes of the basic fixed size types, as (pack, unpack).
+# Like xdrlib, hypers are masked and packed unsigned.
+fixed_formats = {"int" : ('l', 'l'),
+                 "uint" : ('L', 'L'),
+                 "unsigned" : ('L', 'L'),
+                 "hyper" : ('Q', 'q'),
+                 "uhyper" : ('Q', 'Q'),
+                 "float" : ('f', 'f'),
+                 "double" : ('d', 'd'),
+                 "quadruple" : ('d', 'd'),
+                 "bool" : ('L', 'L'),
+                 }
+
+def const_value(value):
+    """Return the integer a constant or constant name refers to, or None"""
+    while value in name_dict:
+        info = name_dict[value]
+        if not isinstance(info, const_info):
+            return None
+        value = info.value
+    try:
+        if value[:2].lower() == '0x':
+            return int(value, 16)
+        elif value[:1] == '0' and len(value) > 1:
+            return int(value, 8)
+        return int(value)
+    except ValueError:
+        return None
+
+class Fixed(object):
+    """A struct field whose encoding has a fixed size, so that a run of
+    them can be packed with a single struct.Struct.
+    """
+    def __init__(self, decl, kind, hooks, enum=None, length=None):
+        self.decl = decl # The type_info field declaration
+        self.id = decl.id
+        self.kind = kind # A key of fixed_formats, 'enum' or 'opaque'
+        self.hooks = hooks # Typedef names whose filter_ hooks are skipped
+        self.enum = enum # For enums, the enum_info or inline type_info
+        self.length = length # For opaques, the length as a value
+
+    def format(self, mode):
+        """Return (format, size) for mode 'pack' or 'unpack'.
+
+        If the size is not known until the const module is loaded,
+        the format is a python expression and size is None.
+        """
+        if self.kind == 'opaque':
+            n = const_value(self.length)
+            if n is not None:
+                return "%is%ix" % (n, -n % 4), n + (-n % 4)
+            n = self.decl.fullname(self.length)
+            return "' + '%%is%%ix' %% (%s, -%s %% 4) + '" % (n, n), None
+        if self.kind == 'enum':
+            return 'l', 4
+        code = fixed_formats[self.kind][mode == 'unpack']
+        return code, struct.calcsize('>' + code)
+
+    def pack_value(self, data):
+        value = "%s.%s" % (data, self.id)
+        if self.kind in ('hyper', 'uhyper'):
+            return "%s & 0xffffffffffffffff" % value
+        elif self.kind == 'bool':
+            return "(1 if %s else 0)" % value
+        return value
+
+    def pack_check(self, prefix, data):
+        if self.kind != 'enum':
+            return ''
+        return enum_check(prefix, "%s.%s" % (data, self.id),
+                          self.enum.id, self.enum.body)
+
+    def unpack_post(self, prefix, data):
+        """Code to run on the field once unpacked"""
+        value = "%s.%s" % (data, self.id)
+        if self.kind == 'bool':
+            return "%s%s = bool(%s)\n" % (prefix, value, value)
+        elif self.kind == 'enum':
+            return enum_check(prefix, value, self.enum.id, self.enum.body)
+        return ''
+
+def fixed_field(decl):
+    """Return a Fixed describing the struct field decl, or None if it
+    does not have a fixed size encoding that struct can handle.
+    """
+    hooks = []
+    t = decl
+    while True:
+        if t.array:
+            if t.type == 'opaque' and t.fixed:
+                return Fixed(decl, 'opaque', hooks, length=t.len)
+            return None
+        if t.type in fixed_formats:
+            return Fixed(decl, t.type, hooks)
+        if t.type == 'enum':
+            # An inline enum
+            return Fixed(decl, 'enum', hooks, enum=t)
+        info = name_dict.get(t.type)
+        if isinstance(info, enum_info):
+            if info.array:
+                return None
+            hooks.append(info.id)
+            return Fixed(decl, 'enum', hooks, enum=info)
+        if not isinstance(info, type_info):
+            return None
+        if info.array:
+            # Typedefs of arrays get their own pack_ method, with filter
+            hooks.append(info.id)
+        t = info
+
+def field_runs(body):
+    """Split struct body into runs of consecutive fixed size fields, each
+    given as a list of Fixed, and the other declarations.
+    """
+    out = []
+    for l in body:
+        fixed = None
+        if use_xdrrt and fuse_fields:
+            fixed = fixed_field(l)
+        if fixed is None:
+            out.append(l)
+            continue
+        fused_types.update(fixed.hooks)
+        if out and isinstance(out[-1], list):
+            out[-1].append(fixed)
+        else:
+            out.append([fixed])
+    return out
+
+def fused_struct(run, mode):
+    """Return (name, size) of the module level struct.Struct for run.
+
+    size is the name of the Struct's size attribute if it is not a constant.
+    """
+    formats = [f.format(mode) for f in run]
+    format = "'>%s'" % ''.join([code for code, size in formats])
+    format = format.replace(" + ''", "")
+    if None in [size for code, size in formats]:
+        size = None
+    else:
+        size = sum([size for code, size in formats])
+    name = fused_structs.get(format)
+    if name is None:
+        name = fused_structs[format] = "_fused_%i" % len(fused_structs)
+    if size is None:
+        size = "%s.size" % name
+    return name, size
+
+def fused_pack(run, prefix, data):
+    """Return code appending the fields of run to the buffer in one go.
+
+    Anything struct does not like is handed to the code that packs the
+    fields one at a time, which will raise the appropriate error.
+    """
+    name, size = fused_struct(run, 'pack')
+    values = ', '.join([f.pack_value(data) for f in run])
+    checks = ''.join([f.pack_check(prefix, data) for f in run])
+    fallback = ''.join([f.decl.packout(prefix + indent, data) for f in run])
+    return "%s%stry:\n%s%sself._buf += %s.pack(%s)\n" \
+           "%sexcept (struct.error, TypeError):\n%s" % \
+           (checks, prefix, prefix, indent, name, values, prefix, fallback)
+
+def pack_fields(body, prefix, data):
+    """Return code packing the struct fields in body"""
+    pack = ''
+    for run in field_runs(body):
+        if isinstance(run, list):
+            pack += fused_pack(run, prefix, data)
+        else:
+            pack += run.packout(prefix, data)
+    return pack
+
+def unpack_fields(body, prefix, data):
+    """Return code unpacking the struct fields in body"""
+    unpack = ''
+    for run in field_runs(body):
+        if isinstance(run, list):
+            unpack += fused_unpack(run, prefix, data)
+        else:
+            unpack += run.unpackout(prefix, data)
+    return unpack
+
+def fused_unpack(run, prefix, data):
+    """Return code unpacking the fields of run from the buffer in one go"""
+    name, size = fused_struct(run, 'unpack')
+    targets = ''.join(["%s.%s, " % (data, f.id) for f in run])
+    post = ''.join([f.unpack_post(prefix, data) for f in run])
+    return "%stry:\n%s%s%s= %s.unpack_from(self._buf, self._pos)\n" \
+           "%sexcept struct.error:\n%s%sraise EOFError\n" \
+           "%sself._pos += %s\n%s" % \
+           (prefix, prefix, indent, targets, name,
+            prefix, prefix, indent, prefix, size, post)
+
 class const_info(Info):
     """The result of 'CONST ID EQUALS constant SEMI' or inside of enum as
     'ID EQUALS value' """
@@ -1031,6 +1579,12 @@ class enum_info(Info):
         header = self._get_pack_header()
         return header + self.packenum(indent2)
 
+    def sizeof_output(self):
+        if self.array:
+            return self._sizeof_packed()
+        return "%sdef sizeof_%s(self, data):\n%sreturn 4\n" % \
+               (indent, self.id, indent2)
+
     def unpack_output(self):
         header = "%sdef unpack_%s(self):\n" % (indent, self.id)
         return header + self.unpackenum(indent2) + \
@@ -1063,11 +1617,25 @@ class struct_info(Info):
         xdrdef = "%sXDR definition:\n%sstruct %s {\n%s%s};\n" % \
                  (comment, comment, self.id, xdrbody, comment)
         varlist = [l for l in self.body if l.type != 'void']
+        slots = self.typeslots(varlist)
         init = self.typeinit(varlist)
+        if self.hashable(varlist):
+            eq = self.typeeq(varlist, True)
+        elif value_eq:
+            eq = self.typeeq(varlist)
+        else:
+            eq = ''
         repr = self.typerepr(varlist)
         pass_attr = self.pass_through(varlist)
-        return "class %s:\n%s%s\n%s%s\n" % \
-               (self.id, xdrdef, init, pass_attr, repr)
+        return "class %s:\n%s%s%s\n%s\n%s%s\n" % \
+               (self.id, xdrdef, slots, init, eq, pass_attr, repr)
+
+    def hashable(self, varlist):
+        """Structs whose fields are all fixed size scalars, such as
+        stateid4, are treated as immutable values, and so are hashable.
+        """
+        return bool(varlist) and \
+               None not in [fixed_field(var) for var in varlist]
 
     def pass_through(self, varlist):
         def check(v):
@@ -1091,13 +1659,80 @@ class struct_info(Info):
 
     def pack_output(self):
         header = self._get_pack_header()
+        if self.id in linked_structs:
+            header = self.list_output("pack") + header
         return header + self.packstruct(indent2)
 
+    def sizeof_output(self):
+        if self.array:
+            return self._sizeof_packed()
+        size, code = size_decls(self.body, indent2, 'data')
+        if not code:
+            # Fixed size, so filters cannot change it
+            return "%sdef sizeof_%s(self, data):\n%s" % \
+                   (indent, self.id, size_return(size, code, indent2))
+        header = self._get_sizeof_header()
+        if self.id in linked_structs:
+            header = self.list_output("sizeof") + header
+        return header + size_return(size, code, indent2)
+
     def unpack_output(self):
         header = "%sdef unpack_%s(self):\n" % (indent, self.id)
+        if self.id in linked_structs:
+            header = self.list_output("unpack") + header
         return header + self.unpackstruct(indent2) + \
                self._get_unpack_footer()
 
+    def list_output(self, mode):
+        """Return the _<mode>_list_<id> method for a self-linked struct.
+
+        The chain of optional pointers is handled with a loop, rather
+        than recursion, as a flat python list of structs whose link
+        fields are empty.  When packing, a link field which is not empty
+        is also followed, so chains built by hand still work.
+        """
+        link = linked_structs[self.id]
+        body = self.body[:-1]
+        prefix = indent2 + indent
+        name = "_%s_list_%s" % (mode, self.id)
+        if mode == "unpack":
+            return "%sdef %s(self):\n" \
+                   "%sout = []\n" \
+                   "%swhile True:\n" \
+                   "%smore = self.unpack_uint()\n" \
+                   "%sif not more:\n" \
+                   "%s%sbreak\n" \
+                   "%sif more > 1 and self.check_array:\n" \
+                   "%s%sraise XDRError(" \
+                   "'array length too long for %s.%s')\n" \
+                   "%sdata = types.%s()\n%s" \
+                   "%sdata.%s = []\n%s" \
+                   "%sout.append(data)\n" \
+                   "%sreturn out\n\n" % \
+                   (indent, name, indent2, indent2, prefix, prefix,
+                    prefix, indent, prefix, prefix, indent, self.id, link,
+                    prefix, self.id, unpack_fields(body, prefix, 'data'),
+                    prefix, link, self._get_filter(prefix), prefix, indent2)
+        if mode == "pack":
+            start = ''
+            each = "%sself.pack_uint(1)\n%s" % \
+                   (prefix, pack_fields(body, prefix, 'data'))
+            end = "%sself.pack_uint(0)\n" % indent2
+        else:
+            size, code = size_decls(body, prefix, 'data')
+            start = "%ssize = 4\n" % indent2
+            each = "%ssize += %i\n%s" % (prefix, size + 4, code)
+            end = "%sreturn size\n" % indent2
+        return "%sdef %s(self, data):\n%s" \
+               "%sstack = list(reversed(data))\n" \
+               "%swhile stack:\n" \
+               "%sdata = stack.pop()\n%s%s" \
+               "%sif data.%s:\n" \
+               "%s%sstack.extend(reversed(data.%s))\n%s\n" % \
+               (indent, name, start, indent2, indent2, prefix,
+                self._get_filter(prefix), each, prefix, link,
+                prefix, indent, link, end)
+
 class union_info(Info):
     """The result of 'TYPEDEF UNION <union_body> ID <array> SEMI' or
     'UNION ID <union_body> SEMI'
@@ -1148,6 +1783,34 @@ class union_info(Info):
             get = "[s.%s]" % key
         return "%sswitch = property(lambda s: %s%s)\n" % (prefix, d, get)
 
+    def union_eq(self, prefix=indent):
+        """Return __eq__, which compares the switch and then only the
+        field of the arm it selects, found with the _arms dict.
+        """
+        arms = ''
+        for l in self.body[1:-1]:
+            for c in l.cases:
+                arms += "%s%s%s : %r,\n" % \
+                        (prefix, indent, self.fullname(c), l.declarations[0].id)
+        default = self.body[-1].declarations
+        if default != []:
+            default = default[0].id
+        else:
+            default = None
+        key = self.body[0].declarations[0].id
+        indent2 = prefix + indent
+        return "%s_arms = {\n%s%s}\n\n" \
+               "%sdef __eq__(self, other):\n" \
+               "%sif other.__class__ is not self.__class__:\n" \
+               "%s%sreturn NotImplemented\n" \
+               "%sif self.%s != other.%s:\n" \
+               "%s%sreturn False\n" \
+               "%sarm = self._arms.get(self.%s, %r)\n" \
+               "%sreturn arm is None or getattr(self, arm) == getattr(other, arm)\n" % \
+               (prefix, arms, prefix, prefix, indent2, indent2, indent,
+                indent2, key, key, indent2, indent, indent2, key, default,
+                indent2)
+
     def type_output(self):
         comment = '%s# ' % indent
         xdrbody = self.xdrbody(comment)
@@ -1159,18 +1822,33 @@ class union_info(Info):
         varlist = []
         for c in self.body:
             varlist += [l for l in c.declarations if l.type != 'void']
+        slots = self.typeslots(varlist)
         init = self.typeinit(varlist)
+        eq = (self.union_eq() if value_eq else '')
         repr = self.typerepr(varlist)
-        return "class %s:\n%s%s\n%s\n%s\n%s\n" % \
-               (self.id, xdrdef, init, self.union_switch(),
+        return "class %s:\n%s%s%s\n%s\n%s\n%s\n%s\n" % \
+               (self.id, xdrdef, slots, init, eq, self.union_switch(),
                 self.union_getattr(), repr)
 
     def pack_output(self):
         header = self._get_pack_header()
+        if self.use_dispatch():
+            header = self.union_arms("pack") + header
         return header + self.packunion(indent2)
 
+    def sizeof_output(self):
+        if self.array:
+            return self._sizeof_packed()
+        header = self._get_sizeof_header()
+        if self.use_dispatch():
+            header = self.sizeof_arms() + header
+        size, code = self.sizeunion(indent2, 'data')
+        return header + size_return(size, code, indent2)
+
     def unpack_output(self):
         header = "%sdef unpack_%s(self):\n" % (indent, self.id)
+        if self.use_dispatch():
+            header = self.union_arms("unpack") + header
         return header + self.unpackunion(indent2) + \
                self._get_unpack_footer()
 
@@ -1282,6 +1960,15 @@ class type_info(Info):
         header = self._get_pack_header()
         return header + self._pack_array(indent2)
 
+    def sizeof_output(self):
+        if not self.array:
+            return "%ssizeof_%s = sizeof_%s\n" % (indent, self.id, self.type)
+        size, code = self.sizeout(indent2, 'data')
+        if not code:
+            return "%sdef sizeof_%s(self, data):\n%s" % \
+                   (indent, self.id, size_return(size, code, indent2))
+        return self._get_sizeof_header() + size_return(size, code, indent2)
+
     def unpack_output(self):
         if not self.array:
             return "%sunpack_%s = unpack_%s\n" % (indent, self.id, self.type)
@@ -1290,6 +1977,8 @@ class type_info(Info):
                self._get_unpack_footer()
 
     def _pack_array(self, prefix, data='data'):
+        if self.linked():
+            return "%sself._pack_list_%s(%s)\n" % (prefix, self.type, data)
         if self.fixed or self.len is None:
             limit = ''
         else:
@@ -1314,6 +2003,8 @@ class type_info(Info):
         return limit + pack
 
     def _unpack_array(self, prefix, data='data'):
+        if self.linked():
+            return "%s%s = self._unpack_list_%s()\n" % (prefix, data, self.type)
         if self.fixed or self.len is None:
             limit = ''
         else:
@@ -1353,36 +2044,57 @@ use_filters = True  # Option which causes hooks to be generated which
 allow_attr_passthrough = True # Option which allows substructure attrs to
                               # be referenced directly, in cases where there
                               # is a unique substructure to search.
+use_xdrrt = True # Option to generate code using the bundled xdrrt.py runtime,
+                 # rather than the stdlib xdrlib (removed in python 3.13).
+fuse_fields = True # Option, only with xdrrt, to pack runs of fixed size
+                   # struct fields with a single struct.Struct.  The filter_
+                   # hooks of enum and fixed opaque typedefs are then skipped.
+fused_structs = {} # {format: name} of struct.Structs used for fused fields
+fused_types = set() # Typedef names whose filter_ hooks fusing skips
+enum_sets = {} # {tuple of values: name} of frozensets used for enum checks
+dispatch_arms = 8 # Unions with at least this many arms use dispatch dicts
+use_slots = False # Option to give struct and union classes __slots__, so
+                  # instances have no __dict__.  Code that sets attributes
+                  # which are not XDR fields must name them in extra_slots.
+extra_slots = {} # {type name: list of additional attribute names}
+flat_lists = True # Option to represent optional pointer chains of
+                  # self-linked structs, such as entry4, as flat lists.
+linked_structs = {} # {struct name: link field name} of such structs
+value_eq = False # Option to give every struct and union class an __eq__
+                 # comparing field values, which makes them unhashable.
+                 # Otherwise only structs of fixed size scalars, which are
+                 # also hashable, compare by value.
+
 pack_header = """\
 import sys,os
 sys.path.append(os.path.dirname(__file__))
 import %s as const
 import %s as types
-import xdrlib
-from xdrlib import Error as XDRError
-
+import %s
+from %s import Error as XDRError
+%s
 class nullclass(object):
     pass
 
 """
 
 pack_init = """\
-class %sPacker(xdrlib.Packer):
+class %sPacker(%s.Packer):
 %sdef __init__(self, check_enum=True, check_array=True):
-%sxdrlib.Packer.__init__(self)
+%s%s.Packer.__init__(self)
 %sself.check_enum = check_enum
 %sself.check_array = check_array
 
-""" % ("%s", indent, indent2, indent2, indent2)
+""" % ("%s", "%s", indent, indent2, "%s", indent2, indent2)
 
 unpack_init = """\
-class %sUnpacker(xdrlib.Unpacker):
+class %sUnpacker(%s.Unpacker):
 %sdef __init__(self, data, check_enum=True, check_array=True):
-%sxdrlib.Unpacker.__init__(self, data)
+%s%s.Unpacker.__init__(self, data)
 %sself.check_enum = check_enum
 %sself.check_array = check_array
 
-""" % ("%s", indent, indent2, indent2, indent2)
+""" % ("%s", "%s", indent, indent2, "%s", indent2, indent2)
 
 known_basics = {"int" : "pack_int",
                 #"enum" : "pack_enum",
@@ -1398,16 +2110,133 @@ known_basics = {"int" : "pack_int",
                 "bool" : "pack_bool",
                 "opaque": "pack_opaque",
                 "string": "pack_string"}
-packer_start = ''.join(["%spack_%s = xdrlib.Packer.%s\n" % (indent, k, v)
-                        for k, v in known_basics.items()])
-
-unpacker_start = ''.join(["%sunpack_%s = xdrlib.Unpacker.un%s\n" % (indent, k, v)
-                          for k, v in known_basics.items()])
-
-def run(infile, filters=True, pass_attrs=True, debug=False):
-    global use_filters, allow_attr_passthrough
+def packer_start(lib):
+    return ''.join(["%spack_%s = %s.Packer.%s\n" % (indent, k, lib, v)
+                    for k, v in known_basics.items()])
+
+sizer_start = """\
+%sdef sizeof_int(self, data):
+%sreturn 4
+%ssizeof_uint = sizeof_unsigned = sizeof_bool = sizeof_float = sizeof_int
+
+%sdef sizeof_hyper(self, data):
+%sreturn 8
+%ssizeof_uhyper = sizeof_double = sizeof_quadruple = sizeof_hyper
+
+%sdef sizeof_opaque(self, data):
+%sreturn 4 + ((len(data) + 3) & ~3)
+%ssizeof_string = sizeof_opaque
+
+%sdef _sizeof_packed(self, name, data):
+%s\"\"\"Size of data packed by pack_<name>, found by packing it\"\"\"
+%simport copy
+%sp = copy.copy(self)
+%sp.reset()
+%sgetattr(p, "pack_" + name)(data)
+%sreturn len(p.get_buffer())
+
+""" % ((indent, indent2, indent) * 3 + (indent,) + (indent2,) * 6)
+
+def unpacker_start(lib):
+    return ''.join(["%sunpack_%s = %s.Unpacker.un%s\n" % (indent, k, lib, v)
+                    for k, v in known_basics.items()])
+
+def copy_runtime():
+    """Put a copy of xdrrt.py beside the generated files"""
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xdrrt.py")
+    if os.path.exists("xdrrt.py"):
+        if os.path.samefile(src, "xdrrt.py"):
+            return
+        with open(src, "rb") as fd1, open("xdrrt.py", "rb") as fd2:
+            if fd1.read() == fd2.read():
+                return
+    # Files in one directory may be generated in parallel, so never
+    # leave a partly written copy around
+    tmp = "xdrrt.py.%i" % os.getpid()
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, "xdrrt.py")
+
+def default_cache_dir():
+    """Directory for the yacc tables, shared by all runs"""
+    base = os.environ.get("XDG_CACHE_HOME",
+                          os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "pynfs-xdrgen")
+
+def build_parser(cache_dir=None):
+    """Build the yacc parser, with its tables pickled in cache_dir.
+
+    The tables are only rebuilt when the grammar changes.
+    """
+    import ply.yacc as yacc
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        picklefile = os.path.join(cache_dir, "parsetab.pickle")
+    except OSError:
+        picklefile = None
+    if picklefile is None:
+        return yacc.yacc(debug=False, write_tables=False)
+    return yacc.yacc(debug=False, picklefile=picklefile)
+
+def generator_key(data, options):
+    """Return a key identifying the output for xdr source data.
+
+    It covers the source, the options, and the code of this generator
+    and its runtime, so that any change to these forces regeneration.
+    """
+    h = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ("xdrgen.py", "xdrrt.py"):
+        with open(os.path.join(here, name), "rb") as fd:
+            h.update(fd.read())
+    h.update(repr(sorted(options.items())).encode())
+    h.update(data.encode())
+    return h.hexdigest()
+
+def up_to_date(files, key):
+    """Were all of files generated with the given key?"""
+    for name in files:
+        try:
+            with open(name) as fd:
+                fd.readline()
+                if fd.readline() != "# xdrgen key: %s\n" % key:
+                    return False
+        except IOError:
+            return False
+    return True
+
+def run(infile, filters=True, pass_attrs=True, debug=False, backend="xdrrt",
+        fuse=True, slots=False, extra_attrs={}, flat=True, force=False,
+        cache_dir=None, eq=False):
+    """Generate python code from the xdr file infile.
+
+    backend is "xdrrt", to use the bundled runtime, or "xdrlib".
+    If slots is set, generated classes use __slots__, with extra_attrs
+    a dictionary {type name: list of additional attribute names}.
+    If flat is set, linked lists such as entry4 are flat python lists.
+    If eq is set, all struct and union classes compare by value.
+
+    Nothing is done if the output files were generated from the same
+    source, options and generator, unless force is set.  The yacc tables
+    are kept in cache_dir (see default_cache_dir).
+    """
+    global use_filters, allow_attr_passthrough, use_xdrrt, fuse_fields
+    global fused_structs, fused_types, enum_sets, use_slots, extra_slots
+    global flat_lists, linked_structs, error_occurred, value_eq
     use_filters = filters
+    value_eq = eq
+    flat_lists = flat
     allow_attr_passthrough = pass_attrs
+    use_slots = slots
+    extra_slots = extra_attrs
+    if backend not in ("xdrrt", "xdrlib"):
+        raise ValueError("Unknown backend %r" % backend)
+    use_xdrrt = (backend == "xdrrt")
+    fuse_fields = fuse
+    fused_structs = {}
+    fused_types = set()
+    enum_sets = {}
     print("Input file is", infile)
 
     # Create output file names (without .py)
@@ -1419,23 +2248,46 @@ def run(infile, filters=True, pass_attrs=True, debug=False):
     print("Will use output files %s.py, %s.py, and %s.py" % \
           (constants_file, types_file, packer_file))
 
-    # Parse the input data with yacc
-    global name_dict
-    name_dict = {}
     f = open(infile)
     data = f.read()
     f.close()
-    import ply.yacc as yacc
-    yacc.yacc()
-    yacc.parse(data, debug=debug)
+    options = {"filters" : filters, "pass_attrs" : pass_attrs,
+               "backend" : backend, "fuse" : fuse, "slots" : slots,
+               "extra_attrs" : sorted([(k, sorted(v))
+                                       for k, v in extra_attrs.items()]),
+               "flat" : flat, "eq" : eq}
+    key = generator_key(data, options)
+    outputs = [name + ".py" for name in
+               (constants_file, types_file, packer_file)]
+    if use_xdrrt:
+        outputs.append("xdrrt.py")
+    if not force and up_to_date(outputs[:3], key) and \
+       os.path.exists(outputs[-1]):
+        print("Output files are up to date")
+        return
+
+    # Parse the input data with yacc
+    global name_dict
+    name_dict = {}
+    error_occurred = False
+    lex.lexer.lineno = 1
+    parser = build_parser(cache_dir)
+    parser.parse(data, lexer=lex.lexer, debug=debug)
 
     if error_occurred:
         print
         print("Error occurred, did not write output files")
         return 1
 
-    comment_string = "# Generated by rpcgen.py from %s on %s\n" % \
-                     (infile, time.asctime())
+    linked_structs = {}
+    if flat_lists:
+        for info in name_dict.values():
+            link = linked_field(info)
+            if link is not None:
+                linked_structs[info.id] = link.id
+
+    comment_string = "# Generated by rpcgen.py from %s on %s\n" \
+                     "# xdrgen key: %s\n" % (infile, time.asctime(), key)
     const_fd = open(constants_file + ".py", "w")
     const_fd.write(comment_string)
     type_fd = open(types_file + ".py", "w")
@@ -1443,9 +2295,17 @@ def run(infile, filters=True, pass_attrs=True, debug=False):
     type_fd.write("import sys,os\nsys.path.append(os.path.dirname(__file__))\nimport %s as const\n" % constants_file)
     pack_fd = open(packer_file + ".py", "w")
     pack_fd.write(comment_string)
-    pack_fd.write(pack_header % (constants_file, types_file))
-    pack_fd.write(pack_init % name_base.upper())
-    pack_fd.write(packer_start)
+    if use_xdrrt:
+        copy_runtime()
+        lib = "xdrrt"
+        pack_fd.write(pack_header % (constants_file, types_file, lib, lib,
+                                     "import struct\n"))
+    else:
+        lib = "xdrlib"
+        pack_fd.write(pack_header % (constants_file, types_file, lib, lib, ""))
+    pack_fd.write(pack_init % (name_base.upper(), lib, lib))
+    pack_fd.write(packer_start(lib))
+    pack_fd.write(sizer_start)
 
     type_list = sorted(name_dict.values())
     for value in type_list:
@@ -1463,28 +2323,114 @@ def run(infile, filters=True, pass_attrs=True, debug=False):
             #pack_fd.write("# **** %s %s %s****\n" % (value.id, value.lineno, value.sortno))
             pack_fd.write(output)
             pack_fd.write('\n')
-    pack_fd.write(unpack_init % name_base.upper())
-    pack_fd.write(unpacker_start)
+        output = value.sizeof_output()
+        if output is not None:
+            pack_fd.write(output)
+            pack_fd.write('\n')
+    pack_fd.write(unpack_init % (name_base.upper(), lib, lib))
+    pack_fd.write(unpacker_start(lib))
     for value in type_list:
         output = value.unpack_output()
         if output is not None:
             pack_fd.write(output)
             pack_fd.write('\n')
+    if enum_sets:
+        pack_fd.write("# Values of enums, for check_enum\n")
+        for values, name in sorted(enum_sets.items(), key=lambda x: x[1]):
+            pack_fd.write("%s = frozenset([%s])\n" % (name, ', '.join(values)))
+        pack_fd.write("\n")
+    if fused_structs:
+        pack_fd.write("# Runs of fixed size struct fields\n")
+        for format, name in sorted(fused_structs.items(),
+                                   key=lambda x: int(x[1][7:])):
+            pack_fd.write("%s = struct.Struct(%s)\n" % (name, format))
+        pack_fd.write("\n%sPacker._fused_types = %sUnpacker._fused_types = "
+                      "frozenset([\n" % (name_base.upper(), name_base.upper()))
+        pack_fd.write(''.join(["%s%r,\n" % (indent, name)
+                               for name in sorted(fused_types)]))
+        pack_fd.write("%s])\n" % indent)
 
     const_fd.close()
     type_fd.close()
     pack_fd.close()
     return
 
+def _run_in_dir(infile, kwargs):
+    """Run on infile, with output going to the directory it is in"""
+    cwd = os.getcwd()
+    dir, name = os.path.split(os.path.abspath(infile))
+    os.chdir(dir)
+    try:
+        return run(name, **kwargs)
+    finally:
+        os.chdir(cwd)
+
+def run_many(infiles, jobs=None, **kwargs):
+    """Generate code for each of infiles, each beside its own xdr file.
+
+    Up to jobs files (default the number of cpus) are generated at once,
+    in separate processes.  Other arguments are passed on to run.
+    Returns 1 if any run failed.
+    """
+    infiles = [os.path.abspath(f) for f in infiles]
+    # Make sure the tables are cached, rather than built by every process
+    build_parser(kwargs.get("cache_dir"))
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(infiles))
+    if jobs <= 1:
+        results = [_run_in_dir(f, kwargs) for f in infiles]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(_run_in_dir, infiles,
+                                    [kwargs] * len(infiles)))
+    return 1 if 1 in results else None
+
 #
 # Section: main
 #
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: %s <filename>" % sys.argv[0])
-        sys.exit(1)
-
-    run(sys.argv[1])
+    from optparse import OptionParser
+    p = OptionParser("%prog [options] <filename> [<filename> ...]")
+    p.add_option("--backend", default="xdrrt", choices=["xdrrt", "xdrlib"],
+                 help="Runtime the generated code uses, xdrrt or xdrlib "
+                 "[%default]")
+    p.add_option("--nofuse", action="store_false", default=True, dest="fuse",
+                 help="Pack each struct field with its own pack_ method")
+    p.add_option("--nested_lists", action="store_false", default=True,
+                 dest="flat", help="Keep linked lists such as entry4 as "
+                 "nested chains of optional pointers, rather than flat lists")
+    p.add_option("--force", action="store_true", default=False,
+                 help="Regenerate even if the output files are up to date")
+    p.add_option("-j", "--jobs", type="int", default=None,
+                 help="Number of xdr files to generate at once "
+                 "[number of cpus]")
+    p.add_option("--slots", action="store_true", default=False,
+                 help="Give generated struct and union classes __slots__")
+    p.add_option("--eq", action="store_true", default=False,
+                 help="Give all generated struct and union classes a value "
+                 "__eq__, making those that are not simple values "
+                 "unhashable")
+    p.add_option("--extra_slot", action="append", default=[], metavar="TYPE.ATTR",
+                 help="With --slots, allow setting attribute ATTR on TYPE "
+                 "instances, which is not an XDR field.  May be repeated.")
+    opts, args = p.parse_args()
+    if not args:
+        p.error("Need an xdr file")
+    extra = {}
+    for arg in opts.extra_slot:
+        if arg.count('.') != 1:
+            p.error("Bad --extra_slot %r, expected TYPE.ATTR" % arg)
+        type, attr = arg.split('.')
+        extra.setdefault(type, []).append(attr)
+
+    kwargs = dict(backend=opts.backend, fuse=opts.fuse, slots=opts.slots,
+                  extra_attrs=extra, flat=opts.flat, force=opts.force,
+                  eq=opts.eq)
+    if len(args) == 1:
+        sys.exit(run(args[0], **kwargs))
+    sys.exit(run_many(args, opts.jobs, **kwargs))
 
 # Local variables:
 # py-indent-offset: 4
@@ -0,0 +1,275 @@
+# xdrrt.py - runtime support for code generated by xdrgen.py
+#
+# This replaces the stdlib xdrlib module (which is removed in python 3.13),
+# with which it is interface compatible.  xdrgen.py copies this file next
+# to the *_pack.py files it generates.
+#
+# Primitives are packed by precompiled struct.Struct objects, appending
+# directly to a bytearray, and unpacked with unpack_from without slicing
+# the buffer.  Generated code goes further, and packs runs of fixed size
+# struct fields with a single Struct, using _buf and _pos directly.
+#
+# An Unpacker can also avoid copying large opaques: set its zerocopy
+# attribute, and opaques at least that long are returned as read-only
+# memoryview slices of the buffer.  These keep the whole buffer alive.
+
+import struct
+
+class Error(Exception):
+    """Exception class for this module. Use:
+
+    except xdrrt.Error as var:
+        # var has the Error instance for the exception
+
+    Public ivars:
+        msg -- contains the message
+    """
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __repr__(self):
+        return repr(self.msg)
+
+    def __str__(self):
+        return str(self.msg)
+
+class ConversionError(Error):
+    pass
+
+_int = struct.Struct('>l')
+_uint = struct.Struct('>L')
+_hyper = struct.Struct('>q')
+_uhyper = struct.Struct('>Q')
+_float = struct.Struct('>f')
+_double = struct.Struct('>d')
+
+_TRUE = b'\0\0\0\1'
+_FALSE = b'\0\0\0\0'
+_MASK64 = 0xffffffffffffffff
+
+class _Generated(object):
+    """Refuse subclasses whose filter_ hooks generated code would skip.
+
+    Generated code packs enum and fixed opaque struct fields inline, so
+    filter_ hooks for those typedefs (listed in _fused_types) would
+    never be called.  Regenerate with fusing turned off to use them.
+    """
+    _fused_types = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in cls._fused_types:
+            if hasattr(cls, "filter_" + name):
+                raise TypeError("%s.filter_%s would be skipped by fused "
+                                "struct fields" % (cls.__name__, name))
+
+class Packer(_Generated):
+    """Pack various data representations into a buffer."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buf = bytearray()
+
+    def get_buffer(self):
+        return bytes(self._buf)
+    # backwards compatibility
+    get_buf = get_buffer
+
+    def pack_uint(self, x):
+        try:
+            self._buf += _uint.pack(x)
+        except struct.error as e:
+            raise ConversionError(e.args[0])
+
+    def pack_int(self, x):
+        try:
+            self._buf += _int.pack(x)
+        except struct.error as e:
+            raise ConversionError(e.args[0])
+
+    pack_enum = pack_int
+
+    def pack_bool(self, x):
+        self._buf += (_TRUE if x else _FALSE)
+
+    def pack_uhyper(self, x):
+        # Like xdrlib, out of range values are silently truncated
+        try:
+            self._buf += _uhyper.pack(x & _MASK64)
+        except (struct.error, TypeError) as e:
+            raise ConversionError(str(e))
+
+    pack_hyper = pack_uhyper
+
+    def pack_float(self, x):
+        try:
+            self._buf += _float.pack(x)
+        except struct.error as e:
+            raise ConversionError(e.args[0])
+
+    def pack_double(self, x):
+        try:
+            self._buf += _double.pack(x)
+        except struct.error as e:
+            raise ConversionError(e.args[0])
+
+    def pack_fstring(self, n, s):
+        if n < 0:
+            raise ValueError('fstring size must be nonnegative')
+        padded = ((n + 3) // 4) * 4
+        data = s[:n]
+        self._buf += data
+        if len(data) < padded:
+            self._buf += bytes(padded - len(data))
+
+    pack_fopaque = pack_fstring
+
+    def pack_string(self, s):
+        n = len(s)
+        self.pack_uint(n)
+        self._buf += s
+        if n & 3:
+            self._buf += bytes(4 - (n & 3))
+
+    pack_opaque = pack_string
+    pack_bytes = pack_string
+
+    def pack_list(self, list, pack_item):
+        for item in list:
+            self._buf += _TRUE
+            pack_item(item)
+        self._buf += _FALSE
+
+    def pack_farray(self, n, list, pack_item):
+        if len(list) != n:
+            raise ValueError('wrong array size')
+        for item in list:
+            pack_item(item)
+
+    def pack_array(self, list, pack_item):
+        self.pack_uint(len(list))
+        for item in list:
+            pack_item(item)
+
+class Unpacker(_Generated):
+    """Unpacks various data representations from the given buffer."""
+
+    zerocopy = None # Minimum length of opaque returned as a memoryview
+
+    def __init__(self, data):
+        self.reset(data)
+
+    def reset(self, data):
+        self._buf = data
+        self._pos = 0
+        self._view = None # Read-only memoryview of _buf, made when needed
+
+    def get_position(self):
+        return self._pos
+
+    def set_position(self, position):
+        self._pos = position
+
+    def get_buffer(self):
+        return self._buf
+
+    def done(self):
+        if self._pos < len(self._buf):
+            raise Error('unextracted data remains')
+
+    def unpack_uint(self):
+        try:
+            x = _uint.unpack_from(self._buf, self._pos)[0]
+        except struct.error:
+            raise EOFError
+        self._pos += 4
+        return x
+
+    def unpack_int(self):
+        try:
+            x = _int.unpack_from(self._buf, self._pos)[0]
+        except struct.error:
+            raise EOFError
+        self._pos += 4
+        return x
+
+    unpack_enum = unpack_int
+
+    def unpack_bool(self):
+        return bool(self.unpack_int())
+
+    def unpack_uhyper(self):
+        try:
+            x = _uhyper.unpack_from(self._buf, self._pos)[0]
+        except struct.error:
+            raise EOFError
+        self._pos += 8
+        return x
+
+    def unpack_hyper(self):
+        try:
+            x = _hyper.unpack_from(self._buf, self._pos)[0]
+        except struct.error:
+            raise EOFError
+        self._pos += 8
+        return x
+
+    def unpack_float(self):
+        try:
+            x = _float.unpack_from(self._buf, self._pos)[0]
+        except struct.error:
+            raise EOFError
+        self._pos += 4
+        return x
+
+    def unpack_double(self):
+        try:
+            x = _double.unpack_from(self._buf, self._pos)[0]
+        except struct.error:
+            raise EOFError
+        self._pos += 8
+        return x
+
+    def unpack_fstring(self, n):
+        if n < 0:
+            raise ValueError('fstring size must be nonnegative')
+        i = self._pos
+        j = i + ((n + 3) // 4) * 4
+        if j > len(self._buf):
+            raise EOFError
+        self._pos = j
+        if self.zerocopy is not None and n >= self.zerocopy:
+            if self._view is None:
+                self._view = memoryview(self._buf).toreadonly()
+            return self._view[i:i+n]
+        # Note bytes() does not copy a bytes slice again
+        return bytes(self._buf[i:i+n])
+
+    unpack_fopaque = unpack_fstring
+
+    def unpack_string(self):
+        n = self.unpack_uint()
+        return self.unpack_fstring(n)
+
+    unpack_opaque = unpack_string
+    unpack_bytes = unpack_string
+
+    def unpack_list(self, unpack_item):
+        list = []
+        while True:
+            x = self.unpack_uint()
+            if x == 0:
+                break
+            if x != 1:
+                raise ConversionError('0 or 1 expected, got %r' % (x,))
+            list.append(unpack_item())
+        return list
+
+    def unpack_farray(self, n, unpack_item):
+        return [unpack_item() for i in range(n)]
+
+    def unpack_array(self, unpack_item):
+        n = self.unpack_uint()
+        return [unpack_item() for i in range(n)]